@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import imsearchtools as ist
+ist.monkey_patch()
 import time
 import sys
 import os
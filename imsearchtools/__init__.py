@@ -1,8 +1,37 @@
-from . import engines as query
-from . import process
-from . import utils
-from . import postproc_modules
-from . import http_service_helper
-
-from gevent import monkey
-monkey.patch_all(thread=False, select=False, httplib=False)
+"""
+imsearchtools
+
+Subpackages are only imported when first accessed (e.g. `imsearchtools.query`
+or `from imsearchtools import process`), so that scripts using a single
+engine do not pay for loading the downloader, the post-processing modules
+or the HTTP service.
+
+gevent monkey-patching is not applied on import: call `monkey_patch()` as
+early as possible (before importing anything else which uses sockets) for
+queries and downloads to run concurrently.
+"""
+
+import importlib
+
+# attribute name -> submodule loaded on first access
+_LAZY_SUBMODULES = {'query': '.engines',
+                    'engines': '.engines',
+                    'process': '.process',
+                    'utils': '.utils',
+                    'postproc_modules': '.postproc_modules',
+                    'http_service_helper': '.http_service_helper'}
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        module = importlib.import_module(_LAZY_SUBMODULES[name], __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_SUBMODULES.keys()))
+
+def monkey_patch():
+    """Patch the standard library so that blocking I/O yields to other greenlets"""
+    from gevent import monkey
+    monkey.patch_all(thread=False, select=False, httplib=False)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of GoogleWebSearch result page parsing
+
+Compares the time and memory allocated per page when parsing the stored
+result page fixture with `google_web.iter_image_urls` against the original
+split-based parser. Run with:
+
+    $ python imsearchtools/_tests/bench_google_web_parse.py [page_copies]
+
+where the fixture is repeated `page_copies` times (default: 4) to obtain a
+page of a size similar to the ones returned by Google.
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..', '..'))
+sys.path.append(FILE_DIR)
+from imsearchtools.engines.google_web import iter_image_urls
+from test_google_web_parser import split_parse, ACCEPTABLE_EXTENSIONS, FIXTURE_FN
+
+def compiled_parse(page_text, acceptable_extensions):
+    return list(iter_image_urls(page_text, acceptable_extensions))
+
+def measure(parse_func, page, repeats):
+    seconds = min(timeit.repeat(lambda: parse_func(page, ACCEPTABLE_EXTENSIONS),
+                                number=repeats, repeat=5))/repeats
+    tracemalloc.start()
+    parse_func(page, ACCEPTABLE_EXTENSIONS)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak_bytes
+
+if __name__ == '__main__':
+    page_copies = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    with open(FIXTURE_FN) as f:
+        page = f.read()*page_copies
+
+    print('Page size: %d KB, %d image URLs' % (len(page)/1024,
+                                              len(compiled_parse(page, ACCEPTABLE_EXTENSIONS))))
+    for name, parse_func in [('split', split_parse), ('compiled', compiled_parse)]:
+        seconds, peak_bytes = measure(parse_func, page, 50)
+        print('%-10s %8.3f ms/page %10d KB peak allocated/page' % (name, seconds*1000.0,
+                                                                   peak_bytes/1024))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the perceptual hash index
+
+Inserts `record_count` random 64-bit hashes into a new HashIndex (in batches,
+rebuilding its tables as it grows), reopens it, and reports the mean time of
+a search within each Hamming radius, for queries near indexed hashes. Run
+with:
+
+    $ python imsearchtools/_tests/bench_hash_index.py [record_count]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..', '..'))
+
+from imsearchtools.process.hash_index import HashIndex
+
+BATCH_SIZE = 10000
+QUERY_COUNT = 1000
+
+def main():
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = random.Random(0)
+    index_dir = tempfile.mkdtemp()
+    try:
+        index = HashIndex(index_dir)
+        hashes = []
+        start_time = time.time()
+        for batch_start in range(0, record_count, BATCH_SIZE):
+            batch = [rng.getrandbits(64) for _ in range(min(BATCH_SIZE, record_count - batch_start))]
+            index.add_many((value, 'http://host.com/%d.jpg' % (batch_start + i))
+                           for i, value in enumerate(batch))
+            hashes.extend(batch)
+            # (letting the tables be rebuilt in the background, as in a server)
+            gevent.sleep(0)
+        # (waiting for the rebuild in progress, and including the last records)
+        index.compact()
+        print('%d records inserted in %.1f s (%d in tables)' % (len(index), time.time() - start_time,
+                                                              index._indexed))
+        index.close()
+
+        start_time = time.time()
+        index = HashIndex(index_dir)
+        len(index)
+        print('reopened in %.1f ms' % ((time.time() - start_time)*1000.0))
+
+        for max_distance in (0, 3, 4, 7, 8):
+            queries = []
+            for _ in range(QUERY_COUNT):
+                value = rng.choice(hashes)
+                for position in rng.sample(range(64), rng.randint(0, max_distance)):
+                    value = value ^ (1 << position)
+                queries.append(value)
+            start_time = time.time()
+            found = sum(1 for value in queries if index.search(value, max_distance))
+            elapsed = time.time() - start_time
+            print('radius %d: %.3f ms per search (%d/%d found)' % (max_distance, elapsed*1000.0/QUERY_COUNT,
+                                                                   found, QUERY_COUNT))
+        index.close()
+    finally:
+        shutil.rmtree(index_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of image downloads with and without connection reuse
+
+Serves generated JPEG images from a local HTTP/1.1 server (in a subprocess)
+which waits `setup_delay` seconds on each new connection to emulate the
+cost of a TCP/TLS handshake with a remote host, and downloads them with
+`ImageGetter.process_urls` using either the shared keep-alive session or a
+new connection per image (as `requests.get` does). Run with:
+
+    $ python imsearchtools/_tests/bench_image_download.py [image_count] [setup_delay]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..', '..'))
+import imsearchtools
+imsearchtools.monkey_patch()
+
+import requests
+from imsearchtools.process.image_getter import ImageGetter
+from imsearchtools.process.download_session import make_download_session
+
+SERVER_CODE = '''
+import io, sys, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from PIL import Image
+
+buf = io.BytesIO()
+Image.new('RGB', (320, 240), (200, 30, 30)).save(buf, 'JPEG')
+IMAGE = buf.getvalue()
+SETUP_DELAY = float(sys.argv[1])
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    def setup(self):
+        time.sleep(SETUP_DELAY)
+        BaseHTTPRequestHandler.setup(self)
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+    def log_message(self, *args):
+        pass
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+print(server.server_address[1], flush=True)
+server.serve_forever()
+'''
+
+class NoReuseSession(object):
+    """Opens a new connection for each image, like `requests.get`"""
+    def get(self, url, **kwargs):
+        return requests.get(url, **kwargs)
+
+def run(session, urls):
+    getter = ImageGetter(timeout=60.0, image_timeout=10.0, session=session)
+    output_dir = tempfile.mkdtemp()
+    try:
+        t = time.time()
+        results = getter.process_urls(urls, output_dir, process_images=False)
+        elapsed = time.time() - t
+    finally:
+        shutil.rmtree(output_dir)
+    return elapsed, len(results)
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    setup_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    server = subprocess.Popen([sys.executable, '-c', SERVER_CODE, str(setup_delay)],
+                              stdout=subprocess.PIPE)
+    try:
+        port = int(server.stdout.readline())
+        # two host names for the same server, as result URLs span several hosts
+        urls = [{'url': 'http://%s:%d/%d.jpg' % (('127.0.0.1', 'localhost')[i % 2], port, i),
+                 'image_id': str(i)}
+                for i in range(image_count)]
+
+        # warm up the client and the server before timing
+        run(make_download_session(), urls[:20])
+
+        for name, session in [('new connection per image', NoReuseSession()),
+                              ('shared keep-alive session', make_download_session())]:
+            elapsed, count = run(session, urls)
+            print('%-26s %4d images in %6.2f s (%5.1f ms/image)' %
+                  (name, count, elapsed, 1000.0*elapsed/max(1, count)))
+    finally:
+        server.kill()
+
+if __name__ == '__main__':
+    main()
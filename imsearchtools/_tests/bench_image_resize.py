@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of image processing with different downsizing settings
+
+Generates a fixture corpus of `image_count` JPEG and PNG images of typical
+web image sizes, and processes it with `ImageProcessor.process_image` (a
+clean image of at most `max_dim` pixels and a 90x90 thumbnail) using:
+
+    exact    - full decode and resample (reducing_gap None)
+    default  - the default ImageProcessorSettings
+    fast     - draft mode and reduce as far as possible, bilinear resample
+
+Reports images per second and the mean absolute pixel difference of the
+thumbnails and clean images from those of `exact`. Run with:
+
+    $ python imsearchtools/_tests/bench_image_resize.py [image_count] [max_dim]
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..', '..'))
+
+from PIL import Image, ImageChops, ImageStat
+from imsearchtools.process.image_processor import ImageProcessor, ImageProcessorSettings
+
+IMAGE_SIZES = [(640, 480), (1024, 768), (1600, 1200), (2048, 1536), (3264, 2448), (800, 1200)]
+
+def make_corpus(corpus_dir, image_count):
+    for i in range(image_count):
+        size = IMAGE_SIZES[i % len(IMAGE_SIZES)]
+        # smooth gradients with noise, roughly as compressible as photos
+        im = Image.merge('RGB', [Image.linear_gradient('L').resize(size),
+                                 Image.radial_gradient('L').resize(size),
+                                 Image.effect_noise(size, 30 + i % 40)])
+        if i % 5 == 4:
+            im.save(os.path.join(corpus_dir, 'image%03d.png' % i), 'PNG')
+        else:
+            im.save(os.path.join(corpus_dir, 'image%03d.jpg' % i), 'JPEG', quality=90)
+    return sorted(glob.glob(os.path.join(corpus_dir, 'image*')))
+
+def make_settings(name, max_dim):
+    opts = ImageProcessorSettings()
+    opts.filter['max_size_bytes'] = 100*1024*1024
+    opts.conversion['max_width'] = max_dim
+    opts.conversion['max_height'] = max_dim
+    opts.conversion['suffix'] = '-clean-%s' % name
+    opts.thumbnail['suffix'] = '-thumb-%s' % name
+    if name == 'exact':
+        opts.conversion['reducing_gap'] = None
+        opts.thumbnail['reducing_gap'] = None
+    elif name == 'fast':
+        for group in (opts.conversion, opts.thumbnail):
+            group['reducing_gap'] = 1.0
+            group['resample'] = 'bilinear'
+    return opts
+
+def mean_difference(fn1, fn2):
+    im1 = Image.open(fn1).convert('RGB')
+    im2 = Image.open(fn2).convert('RGB')
+    if im1.size != im2.size:
+        im2 = im2.resize(im1.size)
+    return sum(ImageStat.Stat(ImageChops.difference(im1, im2)).mean)/3.0
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    max_dim = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+
+    corpus_dir = tempfile.mkdtemp()
+    try:
+        fns = make_corpus(corpus_dir, image_count)
+        print('%d images, clean images of at most %dx%d' % (len(fns), max_dim, max_dim))
+        print('%8s %12s %12s %12s' % ('', 'images/sec', 'thumb diff', 'clean diff'))
+        outputs = {}
+        for name in ('exact', 'default', 'fast'):
+            processor = ImageProcessor(make_settings(name, max_dim))
+            start_time = time.time()
+            outputs[name] = [processor.process_image(fn) for fn in fns]
+            elapsed = time.time() - start_time
+
+            thumb_diff = sum(mean_difference(exact[1], out[1])
+                             for exact, out in zip(outputs['exact'], outputs[name]))/len(fns)
+            clean_diff = sum(mean_difference(exact[0], out[0])
+                             for exact, out in zip(outputs['exact'], outputs[name]))/len(fns)
+            print('%8s %12.1f %12.2f %12.2f' % (name, len(fns)/elapsed, thumb_diff, clean_diff))
+    finally:
+        shutil.rmtree(corpus_dir)
+
+if __name__ == '__main__':
+    main()
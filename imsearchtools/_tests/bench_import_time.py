@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of package import time
+
+Measures the wall time of common imports of the package, each in a fresh
+interpreter, and reports the median over several runs. Run with:
+
+    $ python imsearchtools/_tests/bench_import_time.py [runs]
+
+For a breakdown by module, use `python -X importtime -c 'import ...'`.
+"""
+
+import sys
+
+from test_import_time import probe_import
+
+IMPORTS = [('package', 'import imsearchtools'),
+           ('single engine', 'from imsearchtools import query\nquery.GoogleWebSearch'),
+           ('all engines', 'from imsearchtools import query\n'
+                           'query.BingAPISearchV5, query.GoogleAPISearch, query.FlickrAPISearch'),
+           ('downloader', 'from imsearchtools import process\nprocess.ImageGetter'),
+           ('http helper', 'from imsearchtools import http_service_helper')]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('%-16s %10s %8s' % ('import', 'time (ms)', 'modules'))
+    for name, code in IMPORTS:
+        results = [probe_import(code) for i in range(runs)]
+        elapsed = sorted(res['elapsed'] for res in results)[len(results)//2]
+        print('%-16s %10.1f %8d' % (name, 1000.0*elapsed, len(results[0]['modules'])))
+
+if __name__ == '__main__':
+    main()
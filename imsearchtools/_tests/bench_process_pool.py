@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of image processing in the event loop and in process pools
+
+Generates `image_count` JPEG images and processes them (clean image and
+thumbnail) from concurrent greenlets, as `ImageGetter.process_urls` does,
+either in the event loop (0 workers) or in a ProcessPool with each of the
+given numbers of workers. Reports images per second and the longest stall of
+the event loop, i.e. the time for which downloads in progress would have been
+blocked. Run with:
+
+    $ python imsearchtools/_tests/bench_process_pool.py [image_count] [worker_count ...]
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..', '..'))
+import imsearchtools
+imsearchtools.monkey_patch()
+
+import gevent
+from PIL import Image
+from imsearchtools.process.image_processor import (ImageProcessor, ImageProcessorSettings,
+                                                   process_image_outputs_with_settings)
+from imsearchtools.process.process_pool import ProcessPool
+
+def make_images(image_dir, image_count, size=(1600, 1200)):
+    fns = []
+    for i in range(image_count):
+        im = Image.effect_noise(size, 40 + i % 20).convert('RGB')
+        fn = os.path.join(image_dir, 'image%03d.jpg' % i)
+        im.save(fn, 'JPEG', quality=90)
+        fns.append(fn)
+    return fns
+
+def remove_outputs(image_dir):
+    for fn in (glob.glob(os.path.join(image_dir, '*-clean.*')) +
+               glob.glob(os.path.join(image_dir, '*-thumb*'))):
+        os.remove(fn)
+
+def run(fns, opts, worker_count):
+    stalls = [0.0]
+    def monitor():
+        # longest time for which the event loop could not run this greenlet
+        while True:
+            before = time.time()
+            gevent.sleep(0.005)
+            stalls[0] = max(stalls[0], time.time() - before - 0.005)
+
+    if worker_count:
+        pool = ProcessPool(worker_count)
+        # start the workers before timing
+        pool.apply(os.getpid)
+        process = lambda fn: pool.apply(process_image_outputs_with_settings, opts, fn)
+    else:
+        pool = None
+        process = ImageProcessor(opts).process_image_outputs
+
+    monitor_job = gevent.spawn(monitor)
+    gevent.sleep(0)
+    start_time = time.time()
+    gevent.joinall([gevent.spawn(process, fn) for fn in fns], raise_error=True)
+    elapsed = time.time() - start_time
+    monitor_job.kill()
+    if pool is not None:
+        pool.close()
+    return elapsed, stalls[0]
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    worker_counts = [int(arg) for arg in sys.argv[2:]]
+    if not worker_counts:
+        worker_counts = sorted(set([0, 1, 2, multiprocessing.cpu_count()]))
+
+    image_dir = tempfile.mkdtemp()
+    try:
+        fns = make_images(image_dir, image_count)
+        opts = ImageProcessorSettings()
+        opts.conversion['max_width'] = 800
+        opts.conversion['max_height'] = 800
+
+        print('%d images, %d CPUs' % (image_count, multiprocessing.cpu_count()))
+        print('%8s %12s %16s' % ('workers', 'images/sec', 'max stall (ms)'))
+        for worker_count in worker_counts:
+            remove_outputs(image_dir)
+            elapsed, stall = run(fns, opts, worker_count)
+            print('%8d %12.1f %16.1f' % (worker_count, image_count/elapsed, stall*1000.0))
+    finally:
+        shutil.rmtree(image_dir)
+
+if __name__ == '__main__':
+    main()
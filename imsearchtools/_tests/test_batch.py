@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines import batch, searcher_pool, health
+from imsearchtools.engines.search_client import SearchClient, cached_query
+
+class CountingSearch(SearchClient):
+    """Fake search client recording the maximum number of concurrent requests"""
+
+    paged_fetching = True
+
+    def __init__(self):
+        self.timeout = 5.0
+        self.async_query = True
+        self._results_per_req = 10
+        self._supported_sizes_map = {'medium': 'm'}
+        self._supported_styles_map = {'photo': 'photo'}
+        self.running = 0
+        self.max_running = 0
+        self.delay = 0.01
+
+    def _fetch_results_from_offset(self, query, result_offset,
+                                   aux_params={}, headers={},
+                                   num_results=-1):
+        self.running = self.running + 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            gevent.sleep(self.delay)
+        finally:
+            self.running = self.running - 1
+        if query == 'nothing':
+            return []
+        return ['%s-%d' % (query, result_offset + i) for i in range(self._results_per_req)]
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        if num_results > 50:
+            raise ValueError('At most 50 results can be requested')
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
+
+    def _query_params(self, size, style):
+        return {}, {}
+
+    def _convert_results(self, results, size):
+        return [{'url': 'http://example.com/%s.jpg' % item, 'image_id': item}
+                for item in results]
+
+class TestQueryMany(object):
+
+    def setup_method(self):
+        health.reset_engine_health()
+        self._searcher = CountingSearch()
+        searcher_pool._searchers[('counting', None)] = self._searcher
+
+    def teardown_method(self):
+        del searcher_pool._searchers[('counting', None)]
+
+    def test_results_and_errors_per_term(self):
+        terms = ['car', 'nothing', 'bike', 'car']
+        outcomes = batch.query_many(terms, 'counting', num_results=30,
+                                    scheduler=batch.FetchScheduler(8))
+        assert list(outcomes.keys()) == ['car', 'nothing', 'bike']
+        assert len(outcomes['car']['results']) == 30
+        assert outcomes['bike']['results'][0]['image_id'] == 'bike-0'
+        assert 'error' in outcomes['nothing']
+
+    def test_concurrency_is_bounded(self):
+        terms = ['term%d' % i for i in range(20)]
+        batch.query_many(terms, 'counting', num_results=30,
+                         scheduler=batch.FetchScheduler(16, default_engine_cap=100))
+        assert self._searcher.max_running == 16
+        self._searcher.max_running = 0
+        batch.query_many(terms, 'counting', num_results=30,
+                         scheduler=batch.FetchScheduler(16, engine_caps={'CountingSearch': 5}))
+        assert self._searcher.max_running == 5
+
+    def test_iter_yields_in_completion_order(self):
+        outcomes = list(batch.iter_query_many(['nothing', 'car'], 'counting', num_results=10))
+        assert set(term for term, _ in outcomes) == {'nothing', 'car'}
+
+    def test_timeout_includes_waiting_and_kills_requests(self):
+        self._searcher.timeout = 0.05
+        self._searcher.delay = 1.0
+        start_time = time.time()
+        outcomes = batch.query_many(['car'], 'counting', num_results=30,
+                                    scheduler=batch.FetchScheduler(8, default_engine_cap=1))
+        assert time.time() - start_time < 0.5
+        assert 'error' in outcomes['car']
+        gevent.sleep(0)
+        assert self._searcher.running == 0
+
+    def test_query_validates_arguments(self):
+        outcomes = batch.query_many(['car', 'bike'], 'counting', num_results=100)
+        assert 'At most 50' in outcomes['car']['error']
+        assert self._searcher.max_running == 0
+
+    def test_health_is_tracked(self):
+        batch.query_many(['car', 'nothing'], 'counting', num_results=30)
+        stats = health.scoreboard()['CountingSearch']
+        assert stats['samples'] == 2
+        assert stats['error_rate'] == 0.5
+        # terms fail without querying the engine while its circuit is open
+        tracker = health.get_engine_health('CountingSearch')
+        for i in range(health.MIN_SAMPLES):
+            tracker.record(0.1, health.OUTCOME_ERROR)
+        outcomes = batch.query_many(['bike'], 'counting', num_results=30)
+        assert 'error' in outcomes['bike']
+        assert tracker.stats()['rejected_count'] == 1
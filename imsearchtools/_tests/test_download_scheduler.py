@@ -0,0 +1,55 @@
+import os
+import sys
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.download_scheduler import DownloadScheduler, host_from_url
+
+class TestDownloadScheduler(object):
+
+    def setup_method(self, method):
+        self.running = {}
+        self.max_running = {}
+        self.start_order = []
+
+    def fake_download(self, url):
+        host = host_from_url(url)
+        self.start_order.append(url)
+        self.running[host] = self.running.get(host, 0) + 1
+        total = sum(self.running.values())
+        self.max_running[host] = max(self.max_running.get(host, 0), self.running[host])
+        self.max_running['total'] = max(self.max_running.get('total', 0), total)
+        gevent.sleep(0.01)
+        self.running[host] = self.running[host] - 1
+        return url
+
+    def test_limits(self):
+        scheduler = DownloadScheduler(max_concurrency=5, max_per_host=2)
+        urls = ['http://host%d.com/%d.jpg' % (i % 4, i) for i in range(40)]
+        jobs = [scheduler.spawn(url, self.fake_download, url) for url in urls]
+        gevent.joinall(jobs)
+        gevent.sleep(0)
+        assert [job.value for job in jobs] == urls
+        assert self.max_running['total'] == 5
+        assert max(count for host, count in self.max_running.items() if host != 'total') == 2
+        assert scheduler.active_count == 0 and scheduler.pending_count == 0
+
+    def test_round_robin_across_hosts(self):
+        scheduler = DownloadScheduler(max_concurrency=1, max_per_host=1)
+        urls = (['http://big.com/%d.jpg' % i for i in range(5)] +
+                ['http://small.com/%d.jpg' % i for i in range(2)])
+        jobs = [scheduler.spawn(url, self.fake_download, url) for url in urls]
+        gevent.joinall(jobs)
+        hosts = [host_from_url(url) for url in self.start_order]
+        assert hosts[:5] == ['big.com', 'small.com', 'big.com', 'small.com', 'big.com']
+
+    def test_killed_pending_jobs_never_start(self):
+        scheduler = DownloadScheduler(max_concurrency=1, max_per_host=1)
+        urls = ['http://a.com/%d.jpg' % i for i in range(3)]
+        jobs = [scheduler.spawn(url, self.fake_download, url) for url in urls]
+        gevent.killall(jobs[1:], block=False)
+        gevent.joinall(jobs)
+        gevent.sleep(0)
+        assert self.start_order == urls[:1]
+        assert scheduler.active_count == 0 and scheduler.pending_count == 0
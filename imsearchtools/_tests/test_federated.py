@@ -0,0 +1,80 @@
+import os
+import sys
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines.search_client import SearchClient, QueryException
+from imsearchtools.engines.federated import FederatedSearch, canonical_url, reciprocal_rank_fusion
+from imsearchtools.engines import health
+
+class FixedSearch(SearchClient):
+
+    def __init__(self, urls, delay=0.0, fail=False):
+        self.urls = urls
+        self.delay = delay
+        self.fail = fail
+        self._supported_sizes_map = {'medium': 'm'}
+        self._supported_styles_map = {'photo': 'photo'}
+
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None):
+        gevent.sleep(self.delay)
+        if self.fail:
+            raise QueryException("No image URLs could be retrieved")
+        return [{'url': url, 'image_id': url} for url in self.urls[:num_results]]
+
+class SlowSearch(FixedSearch):
+    pass
+
+class TestFederatedSearch(object):
+
+    def setup_method(self, method):
+        health.reset_engine_health()
+
+    def test_canonical_url(self):
+        assert (canonical_url('http://Example.com:80/a.jpg#frag') ==
+                canonical_url('https://example.com/a.jpg'))
+        assert canonical_url('http://a.com/a.jpg?x=1') != canonical_url('http://a.com/a.jpg?x=2')
+
+    def test_rank_fusion_prefers_consensus(self):
+        res = reciprocal_rank_fusion([('A', [{'url': 'http://a/1.jpg'}, {'url': 'http://a/2.jpg'}]),
+                                      ('B', [{'url': 'https://a/2.jpg'}, {'url': 'http://b/1.jpg'}])])
+        assert [item['url'] for item in res] == ['http://a/2.jpg', 'http://a/1.jpg', 'http://b/1.jpg']
+        assert res[0]['engines'] == ['A', 'B']
+        assert [item['rank'] for item in res] == [1, 2, 3]
+
+    def test_partial_results_on_deadline(self):
+        searcher = FederatedSearch([FixedSearch(['http://a/1.jpg']),
+                                    FixedSearch(['http://b/1.jpg'], delay=5.0),
+                                    FixedSearch(['http://c/1.jpg'], fail=True)],
+                                   timeout=0.2)
+        res = searcher.query('car')
+        assert [item['url'] for item in res] == ['http://a/1.jpg']
+        assert res.partial
+        status = {}
+        res = list(searcher.iter_query('bike', status=status))
+        assert len(res) == 1
+        assert status['partial']
+
+    def test_no_results_raises(self):
+        searcher = FederatedSearch([FixedSearch([], fail=True)], timeout=0.2)
+        try:
+            searcher.query('car')
+        except QueryException:
+            return
+        assert False
+
+    def test_open_circuit_is_skipped(self):
+        tracker = health.get_engine_health('SlowSearch')
+        for i in range(tracker.min_samples):
+            tracker.record(1.0, health.OUTCOME_TIMEOUT)
+        assert tracker.state == health.STATE_OPEN
+        searcher = FederatedSearch([FixedSearch(['http://a/1.jpg']),
+                                    SlowSearch(['http://b/1.jpg'], delay=5.0)],
+                                   timeout=1.0)
+        res = searcher.query('car')
+        assert [item['url'] for item in res] == ['http://a/1.jpg']
+        assert not res.partial
+        # (the searchers are recorded in the scoreboard as any other query)
+        assert health.scoreboard()['FixedSearch']['samples'] == 1
+        assert tracker.stats()['rejected_count'] == 1
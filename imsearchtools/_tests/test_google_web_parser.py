@@ -0,0 +1,41 @@
+import os
+import sys
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines.google_web import iter_image_urls
+
+ACCEPTABLE_EXTENSIONS = {"jpg", "jpeg", "png", "JPG", "JPEG", "PNG"}
+FIXTURE_FN = os.path.join(FILE_DIR, 'data', 'google_web_results.html')
+
+def split_parse(page_text, acceptable_extensions):
+    # the original split-based parser, kept as a reference
+    image_data = []
+    for item in page_text.split('["'):
+        if item.startswith('http') and item.split('"')[0].split('.')[-1] in acceptable_extensions:
+            url = item.split('"')[0]
+            name = url.rsplit('/', 1)[-1]
+            if url and name:
+                image_data.append((url, name))
+    return image_data
+
+class TestGoogleWebParser(object):
+
+    def setup_method(self):
+        with open(FIXTURE_FN) as f:
+            self._page = f.read()
+
+    def test_fixture_matches_split_parser(self):
+        res = list(iter_image_urls(self._page, ACCEPTABLE_EXTENSIONS))
+        assert len(res) > 50
+        assert res == split_parse(self._page, ACCEPTABLE_EXTENSIONS)
+
+    def test_edge_cases_match_split_parser(self):
+        page = ('["http://a.com/x.jpg",1]["https://a.jpg.com/y"]["http://b.com/z.png?w=1"]'
+                '["http://c.com/d.e/f.JPEG"]["ftp://d.com/e.jpg"]["http://e.com/f.jpg""]'
+                '["http://f.com/.png"]["httpx.jpg"]')
+        res = list(iter_image_urls(page, ACCEPTABLE_EXTENSIONS))
+        assert res == split_parse(page, ACCEPTABLE_EXTENSIONS)
+        assert [url for url, _ in res] == ['http://a.com/x.jpg', 'http://c.com/d.e/f.JPEG',
+                                           'http://e.com/f.jpg', 'http://f.com/.png',
+                                           'httpx.jpg']
@@ -0,0 +1,115 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.hash_index import HashIndex, build_tables, MAX_SEARCH_DISTANCE
+from imsearchtools.process.phash import hamming_distance
+
+def flip_bits(value, count, rng):
+    for position in rng.sample(range(64), count):
+        value = value ^ (1 << position)
+    return value
+
+class TestHashIndex(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = random.Random(1)
+        self.hashes = [self.rng.getrandbits(64) for _ in range(500)]
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_index(self, **kwargs):
+        index = HashIndex(os.path.join(self.tmp_dir, 'index'), **kwargs)
+        index.add_many((value, 'key%d' % i) for i, value in enumerate(self.hashes))
+        return index
+
+    def brute_force(self, value, max_distance):
+        return sorted((hamming_distance(value, other), 'key%d' % i)
+                      for i, other in enumerate(self.hashes)
+                      if hamming_distance(value, other) <= max_distance)
+
+    def check_searches(self, index):
+        for i in range(50):
+            query = flip_bits(self.hashes[i*7], i % 9, self.rng)
+            for max_distance in (0, 4, 8):
+                assert sorted(index.search(query, max_distance)) == self.brute_force(query, max_distance)
+
+    def test_search_in_delta(self):
+        index = self.make_index()
+        assert index._indexed == 0
+        self.check_searches(index)
+
+    def test_search_in_tables(self):
+        index = self.make_index(compact_min_records=100)
+        # (the tables are rebuilt in the background)
+        index._compact_job.join()
+        assert index._indexed > 0
+        self.check_searches(index)
+        index.compact()
+        assert index._indexed == 500
+        self.check_searches(index)
+
+    def test_persistent(self):
+        index = self.make_index(compact_min_records=300)
+        index.close()
+        indexed = index._indexed
+        index = HashIndex(os.path.join(self.tmp_dir, 'index'))
+        assert len(index) == 500
+        assert index._indexed == indexed
+        self.check_searches(index)
+        index.add(12345, 'new')
+        assert index.search(12345 ^ 1, 1) == [(1, 'new')]
+        index.close()
+
+    def test_add_while_rebuilding(self):
+        index = self.make_index(compact_min_records=100)
+        # (whether the rebuild was done, each time the ticker ran)
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(index._compact_job.ready())
+                gevent.sleep(0.001)
+        ticker = gevent.spawn(tick)
+        # (the rebuild starts, and other greenlets keep running meanwhile)
+        gevent.sleep(0)
+        more_hashes = [self.rng.getrandbits(64) for _ in range(50)]
+        index.add_many((value, 'key%d' % (500 + i)) for i, value in enumerate(more_hashes))
+        self.hashes.extend(more_hashes)
+        assert not index._compact_job.ready()
+        assert index.search(more_hashes[0], 0) == [(0, 'key500')]
+        index._compact_job.join()
+        ticker.kill()
+        assert ticks.count(False) > 1
+        assert index._indexed == 500
+        assert len(index._recent) == 50
+        self.check_searches(index)
+        assert index.search(more_hashes[0], 0) == [(0, 'key500')]
+        index.close()
+
+    def test_search_distance_limited(self):
+        index = self.make_index()
+        assert sorted(index.search(self.hashes[0], 64)) == self.brute_force(self.hashes[0],
+                                                                              MAX_SEARCH_DISTANCE)
+        index.close()
+
+    def test_many_matches(self):
+        index = HashIndex(os.path.join(self.tmp_dir, 'index'))
+        index.add_many((12345, 'key%d' % i) for i in range(1200))
+        results = index.search(12345, 0)
+        assert len(results) == 1200
+        assert set(key for _, key in results) == set('key%d' % i for i in range(1200))
+        index.close()
+
+    def test_build_tables(self):
+        offsets, ids = build_tables([0x0001, 0x0002, 0x0001])[0]
+        assert list(ids[offsets[1]:offsets[2]]) == [0, 2]
+        assert list(ids[offsets[2]:offsets[3]]) == [1]
+        assert offsets[-1] == 3
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines import health
+from imsearchtools.engines.search_client import QueryException, cached_query
+from imsearchtools.engines.result_cache import ResultCache
+from imsearchtools.utils.deadline import ResultList, Deadline
+
+class FlakySearch(object):
+
+    def __init__(self, results=None, fail=False):
+        self.results = results
+        self.fail = fail
+        self.query_count = 0
+
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None):
+        self.query_count = self.query_count + 1
+        if self.fail:
+            raise QueryException("No image URLs could be retrieved")
+        return self.results
+
+class StreamSearch(FlakySearch):
+
+    def iter_query(self, query, deadline=None, status=None, **query_params):
+        results = self.query(query, deadline=deadline, **query_params)
+        for item in results:
+            yield item
+        if status is not None:
+            status['partial'] = getattr(results, 'partial', False)
+
+class CachedFlakySearch(FlakySearch):
+
+    def __init__(self, results=None, fail=False):
+        super(CachedFlakySearch, self).__init__(results, fail)
+        self.result_cache = ResultCache()
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None):
+        return super(CachedFlakySearch, self).query(query, size, style, num_results, deadline)
+
+class TestEngineHealth(object):
+
+    def setup_method(self, method):
+        health.reset_engine_health()
+
+    def test_opens_on_error_rate(self):
+        tracker = health.EngineHealth(min_samples=4, max_error_rate=0.5)
+        for outcome in ['ok', 'error', 'error']:
+            tracker.record(0.1, outcome)
+        assert tracker.state == health.STATE_CLOSED
+        tracker.record(0.1, 'timeout')
+        assert tracker.state == health.STATE_OPEN
+        assert not tracker.allow_request()
+        assert tracker.stats()['error_rate'] == 0.75
+
+    def test_opens_on_empty_rate_and_latency(self):
+        tracker = health.EngineHealth(min_samples=2, max_empty_rate=0.5)
+        tracker.record(0.1, 'empty')
+        tracker.record(0.1, 'empty')
+        assert tracker.state == health.STATE_OPEN
+        tracker = health.EngineHealth(min_samples=2, max_mean_latency=1.0)
+        tracker.record(0.5, 'ok')
+        tracker.record(2.0, 'ok')
+        assert tracker.state == health.STATE_OPEN
+
+    def test_half_open_trial(self):
+        tracker = health.EngineHealth(min_samples=1, open_seconds=0.05)
+        tracker.record(0.1, 'error')
+        assert not tracker.allow_request()
+        gevent.sleep(0.06)
+        assert tracker.allow_request()
+        # only a single trial query at a time
+        assert not tracker.allow_request()
+        tracker.record(0.1, 'error')
+        assert tracker.state == health.STATE_OPEN
+        gevent.sleep(0.06)
+        assert tracker.allow_request()
+        tracker.record(0.1, 'ok')
+        assert tracker.state == health.STATE_CLOSED
+        assert tracker.stats()['samples'] == 0
+
+    def test_tracked_query(self):
+        searcher = FlakySearch(fail=True)
+        for i in range(health.MIN_SAMPLES):
+            try:
+                health.tracked_query(searcher, 'car')
+            except QueryException:
+                pass
+        try:
+            health.tracked_query(searcher, 'car')
+            assert False
+        except health.EngineUnavailable:
+            pass
+        assert searcher.query_count == health.MIN_SAMPLES
+        board = health.scoreboard()
+        assert board['FlakySearch']['state'] == health.STATE_OPEN
+        assert board['FlakySearch']['rejected_count'] == 1
+
+    def test_query_outcome(self):
+        assert health.query_outcome([]) == health.OUTCOME_EMPTY
+        assert health.query_outcome(ResultList([{}], partial=True)) == health.OUTCOME_TIMEOUT
+        assert health.query_outcome(ResultList([{}])) == health.OUTCOME_OK
+
+    def test_tracked_iter_query(self):
+        res = list(health.tracked_iter_query(StreamSearch(results=[{'url': 'a'}]), 'car'))
+        assert res == [{'url': 'a'}]
+        assert health.scoreboard()['StreamSearch']['samples'] == 1
+        assert health.scoreboard()['StreamSearch']['error_rate'] == 0.0
+
+    def test_cut_short_stream_is_timeout(self):
+        # the same outcome as for a partial query returned at once
+        deadline = Deadline(0.01)
+        gevent.sleep(0.02)
+        partial_results = ResultList([{'url': 'a'}], partial=True)
+        health.tracked_query(FlakySearch(results=partial_results), 'car', deadline=deadline)
+        status = {}
+        res = list(health.tracked_iter_query(StreamSearch(results=partial_results), 'car',
+                                             deadline=deadline, status=status))
+        assert len(res) == 1 and status['partial']
+        # a stream closed by the caller once the deadline expired
+        stream = health.tracked_iter_query(StreamSearch(results=[{'url': 'a'}, {'url': 'b'}]),
+                                           'car', deadline=deadline)
+        next(stream)
+        stream.close()
+        assert health.scoreboard()['FlakySearch']['error_rate'] == 1.0
+        assert health.scoreboard()['StreamSearch']['samples'] == 2
+        assert health.scoreboard()['StreamSearch']['error_rate'] == 1.0
+
+    def test_cache_hits_not_tracked(self):
+        searcher = CachedFlakySearch(results=[{'url': 'a'}])
+        health.tracked_query(searcher, 'car')
+        # cached results are returned while the circuit is open, without being recorded
+        tracker = health.get_engine_health('CachedFlakySearch')
+        for i in range(health.MIN_SAMPLES):
+            tracker.record(0.1, health.OUTCOME_ERROR)
+        assert tracker.state == health.STATE_OPEN
+        assert health.tracked_query(searcher, 'car') == [{'url': 'a'}]
+        assert searcher.query_count == 1
+        assert tracker.stats()['samples'] == health.MIN_SAMPLES + 1
+        assert tracker.stats()['rejected_count'] == 0
+        try:
+            health.tracked_query(searcher, 'bike')
+            assert False
+        except health.EngineUnavailable:
+            pass
+        assert searcher.result_cache.stats()['misses'] == 2
+
+    def test_cache_hit_not_half_open_trial(self):
+        searcher = CachedFlakySearch(results=[{'url': 'a'}])
+        health.tracked_query(searcher, 'car')
+        tracker = health.get_engine_health('CachedFlakySearch')
+        tracker.open_seconds = 0.0
+        for i in range(health.MIN_SAMPLES):
+            tracker.record(0.1, health.OUTCOME_ERROR)
+        health.tracked_query(searcher, 'car')
+        assert tracker.state == health.STATE_OPEN
+        searcher.fail = True
+        try:
+            health.tracked_query(searcher, 'bike')
+            assert False
+        except QueryException:
+            pass
+        # the trial reached the engine and failed
+        assert searcher.query_count == 2
+        assert tracker.state == health.STATE_OPEN
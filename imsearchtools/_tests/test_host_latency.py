@@ -0,0 +1,100 @@
+import os
+import sys
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process import host_latency
+from imsearchtools.process.host_latency import HostLatency, HostLatencyTracker
+from imsearchtools.process.image_getter import ImageGetter
+
+class TestHostLatency(object):
+
+    def test_default_until_known(self):
+        latency = HostLatency()
+        latency.record_response(0.05)
+        assert latency.timeouts(1.0) == (1.0, 1.0)
+        assert latency.p95_ttfb() is None
+
+    def test_fast_host(self):
+        latency = HostLatency()
+        for _ in range(10):
+            latency.record_response(0.02)
+        connect_timeout, read_timeout = latency.timeouts(1.0)
+        assert connect_timeout == host_latency.MIN_TIMEOUT
+        assert read_timeout == host_latency.MIN_TIMEOUT
+
+    def test_slow_host(self):
+        latency = HostLatency()
+        for _ in range(10):
+            latency.record_response(1.5)
+        connect_timeout, read_timeout = latency.timeouts(1.0)
+        assert 1.5 < connect_timeout <= 1.0*host_latency.MAX_TIMEOUT_FACTOR
+
+    def test_timeouts_widen(self):
+        latency = HostLatency()
+        for _ in range(3):
+            latency.record_response(0.5)
+        before = latency.timeouts(1.0)[0]
+        latency.record_timeout(before)
+        assert latency.timeouts(1.0)[0] > before
+
+    def test_slow_body(self):
+        latency = HostLatency()
+        for _ in range(3):
+            latency.record_response(0.01)
+            latency.record_body(1024*1024, 4.0)
+        read_timeout = latency.timeouts(10.0)[1]
+        assert abs(read_timeout - 4.0*host_latency.READ_CHUNK_BYTES/(256*1024)) < 1e-6
+
+    def test_p95(self):
+        latency = HostLatency()
+        for ttfb in range(1, 21):
+            latency.record_response(ttfb/100.0)
+        assert latency.p95_ttfb() == 0.2
+
+    def test_tracker_by_host(self):
+        tracker = HostLatencyTracker(max_hosts=2)
+        tracker.host('http://a.com/1.jpg').record_response(0.1)
+        assert tracker.host('http://A.com/2.jpg').sample_count == 1
+        tracker.host('http://b.com/1.jpg')
+        tracker.host('http://c.com/1.jpg')
+        assert sorted(tracker.stats().keys()) == ['b.com', 'c.com']
+
+class SlowSession(object):
+    # the first request for a URL stalls, later ones respond immediately
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(url)
+        if len(self.requests) == 1:
+            gevent.sleep(0.2)
+        return len(self.requests)
+
+class TestHedgedRequests(object):
+
+    def setup_method(self, method):
+        self.tracker = HostLatencyTracker()
+        for _ in range(5):
+            self.tracker.host('http://a.com/').record_response(0.01)
+
+    def test_hedged_request_wins(self):
+        session = SlowSession()
+        getter = ImageGetter(session=session, latency_tracker=self.tracker, hedge_requests=True)
+        assert getter._get_response('http://a.com/1.jpg', timeout=1.0) == 2
+        assert len(session.requests) == 2
+
+    def test_not_hedged_by_default(self):
+        session = SlowSession()
+        getter = ImageGetter(session=session, latency_tracker=self.tracker)
+        assert getter._get_response('http://a.com/1.jpg', timeout=1.0) == 1
+        assert len(session.requests) == 1
+
+    def test_adapted_timeouts(self):
+        getter = ImageGetter(latency_tracker=self.tracker)
+        timeouts = getter._download_timeout('http://a.com/1.jpg')
+        assert timeouts == (host_latency.MIN_TIMEOUT, host_latency.MIN_TIMEOUT)
+        getter = ImageGetter(latency_tracker=self.tracker, adaptive_timeouts=False)
+        assert getter._download_timeout('http://a.com/1.jpg') == getter.image_timeout
@@ -0,0 +1,307 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import gevent
+
+from PIL import Image
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.image_getter import ImageGetter
+from imsearchtools.process.image_processor import ImageProcessorSettings, FilterException
+from imsearchtools.process.image_store import ImageStore
+
+def jpeg_bytes(size=(64, 48)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+class FakeResponse(object):
+
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers if headers is not None else {'Content-Type': 'image/jpeg'}
+        self.bytes_read = 0
+        self.closed = False
+
+    def __bool__(self):
+        return True
+
+    def iter_content(self, chunk_size):
+        chunk_size = 1024  # small chunks, to check when the transfer stops
+        for start in range(0, len(self.body), chunk_size):
+            self.bytes_read = start + chunk_size
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+class FakeSession(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+class TestDownloadFilters(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_fn = os.path.join(self.tmp_dir, 'image.jpg')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def download(self, response, opts=None):
+        getter = ImageGetter(opts=opts or ImageProcessorSettings(), session=FakeSession(response))
+        getter._download_image('http://a.com/image.jpg', self.output_fn)
+
+    def assert_filtered(self, response, opts=None):
+        try:
+            self.download(response, opts)
+        except FilterException:
+            assert not os.path.exists(self.output_fn)
+            assert response.closed
+            return
+        assert False
+
+    def test_accepted_image_is_saved(self):
+        body = jpeg_bytes()
+        self.download(FakeResponse(body))
+        with open(self.output_fn, 'rb') as f:
+            assert f.read() == body
+
+    def test_rejected_content_type(self):
+        response = FakeResponse(b'<html></html>', {'Content-Type': 'text/html; charset=utf-8'})
+        self.assert_filtered(response)
+        assert response.bytes_read == 0
+
+    def test_rejected_content_length(self):
+        opts = ImageProcessorSettings()
+        opts.filter['max_file_bytes'] = 1000
+        response = FakeResponse(jpeg_bytes(), {'Content-Length': '5000'})
+        self.assert_filtered(response, opts)
+        assert response.bytes_read == 0
+
+    def test_rejected_dimensions_from_header(self):
+        opts = ImageProcessorSettings()
+        opts.filter['max_width'] = 500
+        # noisy image so that the body is much larger than the header
+        im = Image.frombytes('L', (1000, 1000), os.urandom(1000*1000)).convert('RGB')
+        buf = io.BytesIO()
+        im.save(buf, 'JPEG')
+        response = FakeResponse(buf.getvalue())
+        self.assert_filtered(response, opts)
+        assert response.bytes_read < len(response.body)/10
+
+class ResetResponse(FakeResponse):
+    # the connection is reset after the first chunk of the body
+
+    def iter_content(self, chunk_size):
+        yield self.body[:1024]
+        raise IOError('Connection reset by peer')
+
+class TestInterruptedDownload(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_partial_file_removed(self):
+        output_fn = os.path.join(self.tmp_dir, 'image.jpg')
+        getter = ImageGetter(session=FakeSession(ResetResponse(jpeg_bytes((300, 300)))))
+        getter._download_image('http://a.com/image.jpg', output_fn)
+        assert os.listdir(self.tmp_dir) == []
+
+    def test_not_stored(self):
+        store = ImageStore(os.path.join(self.tmp_dir, 'store'))
+        output_dir = os.path.join(self.tmp_dir, 'out')
+        os.makedirs(output_dir)
+        urldata = {'url': 'http://a.com/image.jpg', 'image_id': 'image'}
+        getter = ImageGetter(session=FakeSession(ResetResponse(jpeg_bytes((300, 300)))), store=store)
+        assert getter.process_url(dict(urldata), output_dir) is None
+        assert store.link_url(urldata['url'], os.path.join(output_dir, 'other.jpg')) is None
+        # a later download from a healthy server succeeds and is stored
+        getter = ImageGetter(session=FakeSession(FakeResponse(jpeg_bytes((300, 300)))), store=store)
+        assert getter.process_url(dict(urldata), output_dir) is not None
+        assert store.link_url(urldata['url'], os.path.join(output_dir, 'other.jpg')) is not None
+
+    def test_undecodable_image_not_stored(self):
+        store = ImageStore(os.path.join(self.tmp_dir, 'store'))
+        urldata = {'url': 'http://a.com/image.jpg', 'image_id': 'image'}
+        getter = ImageGetter(session=FakeSession(FakeResponse(b'GIF89a not really')), store=store)
+        assert getter.process_url(urldata, self.tmp_dir) is None
+        assert store.link_url(urldata['url'], os.path.join(self.tmp_dir, 'other.jpg')) is None
+
+class TestInMemoryDownload(object):
+
+    def test_download_to_memory(self):
+        body = jpeg_bytes()
+        response = FakeResponse(body, {'Content-Type': 'image/jpeg',
+                                       'Content-Length': str(len(body))})
+        getter = ImageGetter(session=FakeSession(response))
+        data = getter._download_image_data('http://a.com/image.jpg')
+        assert data == body
+        assert response.closed
+
+    def test_unknown_length(self):
+        body = jpeg_bytes((300, 300))
+        getter = ImageGetter(session=FakeSession(FakeResponse(body)))
+        assert getter._download_image_data('http://a.com/image.jpg') == body
+
+    def test_rejected_before_allocation(self):
+        opts = ImageProcessorSettings()
+        opts.filter['max_file_bytes'] = 1000
+        response = FakeResponse(jpeg_bytes(), {'Content-Length': str(1024**5)})
+        getter = ImageGetter(opts=opts, session=FakeSession(response))
+        try:
+            getter._download_image_data('http://a.com/image.jpg')
+        except FilterException:
+            assert response.closed
+            return
+        assert False
+
+    def test_filter_from_memory(self):
+        opts = ImageProcessorSettings()
+        opts.filter['min_width'] = 100
+        getter = ImageGetter(opts=opts)
+        try:
+            getter.process_image('/nonexistent/image.jpg', jpeg_bytes())
+        except FilterException:
+            return
+        assert False
+
+class DelayedGetter(ImageGetter):
+    # "processes" each URL dict by sleeping for its 'delay'
+
+    def __init__(self, **kwargs):
+        ImageGetter.__init__(self, **kwargs)
+        self.cancelled = []
+        self.running = 0
+        self.max_running = 0
+
+    def process_url(self, urldata, output_dir, **kwargs):
+        self.running = self.running + 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            gevent.sleep(abs(urldata['delay']))
+        except gevent.GreenletExit:
+            self.cancelled.append(urldata['image_id'])
+            raise
+        finally:
+            self.running = self.running - 1
+        if urldata['delay'] < 0:
+            if kwargs.get('call_completion_func'):
+                self._callback_handler.skip()
+            return None
+        if kwargs.get('call_completion_func'):
+            self._callback_handler.run_callback(urldata, blocking=True)
+        return urldata
+
+def delayed_urls(delays):
+    return [{'url': 'http://a%d.com/%d.jpg' % (rank, rank), 'image_id': str(rank),
+             'rank': rank, 'delay': delay}
+            for rank, delay in enumerate(delays)]
+
+class TestProcessUrls(object):
+
+    def test_timed_out_jobs_not_in_results(self):
+        getter = DelayedGetter(timeout=0.05, max_downloads=1)
+        results = getter.process_urls(delayed_urls([0.0, 0.2, 0.2, 0.2]), '/tmp')
+        assert [result['rank'] for result in results] == [0]
+        assert results.partial
+
+    def test_killed_jobs_skip_callbacks(self, monkeypatch):
+        monkeypatch.setattr(time, 'sleep', gevent.sleep)
+        getter = DelayedGetter(timeout=0.05, max_downloads=1)
+        results = getter.process_urls(delayed_urls([0.0, 0.2, 0.2]), '/tmp',
+                                      completion_func=lambda out_dict: None)
+        assert [result['rank'] for result in results] == [0]
+        # (only the job killed in progress is left - the one waiting for a
+        # slot is skipped)
+        assert getter._callback_handler.task_count == 1
+
+class TestIterProcessUrls(object):
+
+    def test_completion_order(self):
+        urls = delayed_urls([0.03, 0.01, 0.02])
+        results = list(DelayedGetter().iter_process_urls(urls, '/tmp'))
+        assert [result['rank'] for result in results] == [1, 2, 0]
+
+    def test_rank_order(self):
+        urls = delayed_urls([0.03, 0.01, 0.02, 0.0])
+        getter = DelayedGetter()
+        results = list(getter.iter_process_urls(urls, '/tmp', ordered=True, reorder_window=2))
+        assert [result['rank'] for result in results] == [0, 1, 2, 3]
+        assert getter.max_running == 2
+
+    def test_failures_are_skipped(self):
+        urls = delayed_urls([0.01, 0.0, 0.02])
+        urls[1]['delay'] = -0.01
+        results = list(DelayedGetter().iter_process_urls(urls, '/tmp', ordered=True))
+        assert [result['rank'] for result in results] == [0, 2]
+
+    def test_close_cancels_jobs(self):
+        getter = DelayedGetter()
+        results = getter.iter_process_urls(delayed_urls([0.0, 1.0, 1.0]), '/tmp')
+        assert next(results)['rank'] == 0
+        results.close()
+        gevent.sleep(0)
+        assert sorted(getter.cancelled) == ['1', '2']
+
+    def test_timeout(self):
+        getter = DelayedGetter(timeout=0.05)
+        results = list(getter.iter_process_urls(delayed_urls([0.0, 1.0]), '/tmp'))
+        assert [result['rank'] for result in results] == [0]
+        gevent.sleep(0)
+        assert getter.cancelled == ['1']
+
+    def test_processes_downloads(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            getter = ImageGetter(session=FakeSession(FakeResponse(jpeg_bytes())))
+            urls = [{'url': 'http://a.com/%d.jpg' % rank, 'image_id': str(rank)} for rank in range(3)]
+            results = list(getter.iter_process_urls(urls, tmp_dir, ordered=True))
+            assert [result['image_id'] for result in results] == ['0', '1', '2']
+            assert all(os.path.exists(result['clean_fn']) for result in results)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class TestTargetCount(object):
+
+    def test_stops_at_target(self):
+        getter = DelayedGetter()
+        urls = delayed_urls([0.02, -0.01, 0.01, 0.05, 0.05, 0.05, 0.05, 0.05])
+        results = getter.process_urls(urls, '/tmp', target_count=2, overshoot=1)
+        assert [result['rank'] for result in results] == [0, 2]
+        assert not results.partial
+        # at most the missing images and the overshoot are processed at a time
+        assert getter.max_running == 3
+        gevent.sleep(0)
+        assert getter.cancelled == ['3']
+
+    def test_urls_taken_as_needed(self):
+        taken = []
+        def url_iter():
+            for urldata in delayed_urls([0.0]*10):
+                taken.append(urldata['rank'])
+                yield urldata
+        results = DelayedGetter().process_urls(url_iter(), '/tmp', target_count=3, overshoot=0)
+        assert [result['rank'] for result in results] == [0, 1, 2]
+        assert taken == [0, 1, 2]
+
+    def test_callbacks_for_target_only(self, monkeypatch):
+        # (CallbackHandler waits using time.sleep, which is patched in the service)
+        monkeypatch.setattr(time, 'sleep', gevent.sleep)
+        called = []
+        urls = delayed_urls([0.01, 0.0, 0.02, 0.0])
+        results = DelayedGetter().process_urls(urls, '/tmp', completion_func=called.append,
+                                               completion_worker_count=1, target_count=2)
+        assert [result['rank'] for result in results] == [0, 1]
+        assert sorted(result['rank'] for result in called) == [0, 1]
@@ -0,0 +1,189 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from PIL import Image
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process import imutils
+from imsearchtools.process.image_processor import ImageProcessor, ImageProcessorSettings
+
+class TestResize(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'image.jpg')
+        Image.new('RGB', (800, 400), (200, 30, 30)).save(self.fn, 'JPEG')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fit_size(self):
+        assert imutils.fit_size((800, 400), (90, 90)) == (90, 45)
+        assert imutils.fit_size((400, 800), (90, 90)) == (45, 90)
+        assert imutils.fit_size((60, 40), (90, 90)) == (60, 40)
+
+    def test_padded_thumbnail_is_centred(self):
+        im = Image.new('RGB', (800, 400), (255, 255, 255))
+        thumb = imutils.create_thumbnail(im, (90, 120))
+        assert thumb.size == (120, 90)
+        assert thumb.getpixel((60, 45)) == (255, 255, 255)
+        assert thumb.getpixel((60, 5)) == (0, 0, 0)
+
+    def test_draft_decodes_jpeg_at_reduced_scale(self):
+        im = imutils.load_image(self.fn, draft_size=(180, 90))
+        assert im.size == (200, 100)
+        assert imutils.load_image(self.fn).size == (800, 400)
+
+    def test_draft_size(self):
+        draft_size = ImageProcessor._draft_size
+        assert draft_size((800, 400), [((90, 45), 2.0)]) == (180, 90)
+        assert draft_size((800, 400), [((90, 45), 2.0), ((400, 200), 1.5)]) == (600, 300)
+        assert draft_size((800, 400), [((90, 45), 2.0), ((800, 400), 3.0)]) is None
+        assert draft_size((800, 400), [((90, 45), None)]) is None
+
+    def test_unknown_resample_filter(self):
+        try:
+            imutils.resample_filter('sharpest')
+        except ValueError:
+            return
+        assert False
+
+    def test_process_image(self):
+        opts = ImageProcessorSettings()
+        opts.conversion['max_width'] = 400
+        opts.thumbnail['pad_to_size'] = False
+        clean_fn, thumb_fn = ImageProcessor(opts).process_image(self.fn)
+        assert Image.open(clean_fn).size == (400, 200)
+        assert Image.open(thumb_fn).size == (90, 45)
+
+    def test_reduced_decode_is_opt_in(self):
+        draft_sizes = []
+        decode_image = imutils.decode_image
+        def recording_decode_image(im, draft_size=None):
+            draft_sizes.append(draft_size)
+            return decode_image(im, draft_size)
+        imutils.decode_image = recording_decode_image
+        try:
+            opts = ImageProcessorSettings()
+            opts.conversion['max_width'] = 400
+            ImageProcessor(opts).process_image(self.fn)
+            opts.conversion['reducing_gap'] = 1.5
+            opts.thumbnail['reducing_gap'] = 1.5
+            opts.conversion['suffix'] = '-reduced'
+            ImageProcessor(opts).process_image(self.fn)
+        finally:
+            imutils.decode_image = decode_image
+        assert draft_sizes == [None, (600, 300)]
+
+class TestVariants(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'image.jpg')
+        Image.new('RGB', (800, 400), (200, 30, 30)).save(self.fn, 'JPEG')
+        self.opts = ImageProcessorSettings()
+        self.opts.add_variant('preview', 400, 400, quality=80)
+        self.opts.add_variant('features', 64, 64, format='png', pad_to_size=True)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_all_outputs_from_one_decode(self):
+        decoded = []
+        decode_image = imutils.decode_image
+        def counting_decode_image(*args, **kwargs):
+            decoded.append(args)
+            return decode_image(*args, **kwargs)
+        imutils.decode_image = counting_decode_image
+        try:
+            out_fns = ImageProcessor(self.opts).process_image_outputs(self.fn)
+        finally:
+            imutils.decode_image = decode_image
+        assert len(decoded) == 1
+        assert list(out_fns.keys()) == ['clean', 'thumb', 'preview', 'features']
+        assert out_fns['preview'].endswith('image-preview-400x400.jpg')
+        assert Image.open(out_fns['clean']).size == (800, 400)
+        assert Image.open(out_fns['preview']).size == (400, 200)
+        assert Image.open(out_fns['thumb']).size == (90, 90)
+        features = Image.open(out_fns['features'])
+        assert features.format == 'PNG' and features.size == (64, 64)
+
+    def test_existing_outputs_are_skipped(self):
+        processor = ImageProcessor(self.opts)
+        out_fns = processor.process_image_outputs(self.fn)
+        os.remove(out_fns['features'])
+        mtime = os.path.getmtime(out_fns['preview'])
+        processor.process_image_outputs(self.fn)
+        assert os.path.exists(out_fns['features'])
+        assert os.path.getmtime(out_fns['preview']) == mtime
+
+    def test_duplicate_variant_name(self):
+        try:
+            self.opts.add_variant('thumb', 10, 10)
+        except ValueError:
+            return
+        assert False
+
+    def test_invalid_variant_settings(self):
+        invalid = [dict(name='../x'), dict(width=0), dict(height='10'),
+                   dict(format='bogus'), dict(resample='bogus'), dict(quality=0),
+                   dict(reducing_gap=0.5)]
+        for settings in invalid:
+            variant = dict(name='small', width=10, height=10)
+            variant.update(settings)
+            try:
+                self.opts.add_variant(**variant)
+            except ValueError:
+                continue
+            assert False, settings
+        self.opts.add_variant('small', 10, 10, format='PNG', resample='box', quality=90)
+
+class TestPassthrough(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = ImageProcessorSettings()
+        self.opts.conversion['passthrough'] = True
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def save(self, name, size=(320, 240), mode='RGB', format='JPEG'):
+        fn = os.path.join(self.tmp_dir, name)
+        Image.new(mode, size).save(fn, format)
+        return fn
+
+    def read(self, fn):
+        with open(fn, 'rb') as f:
+            return f.read()
+
+    def test_conforming_jpeg_is_not_reencoded(self):
+        fn = self.save('image.jpg')
+        clean_fn, thumb_fn = ImageProcessor(self.opts).process_image(fn)
+        assert self.read(clean_fn) == self.read(fn)
+        assert Image.open(thumb_fn).size == (90, 90)
+
+    def test_conforming_jpeg_from_memory(self):
+        fn = self.save('image.jpg')
+        data = self.read(fn)
+        os.remove(fn)
+        clean_fn, _ = ImageProcessor(self.opts).process_image(fn, data)
+        assert self.read(clean_fn) == data
+
+    def test_nonconforming_images_are_converted(self):
+        self.opts.conversion['max_width'] = 200
+        processor = ImageProcessor(self.opts)
+        for fn in [self.save('large.jpg'),
+                   self.save('grey.jpg', mode='L'),
+                   self.save('image.png', format='PNG')]:
+            clean_fn, _ = processor.process_image(fn)
+            assert self.read(clean_fn) != self.read(fn)
+            assert Image.open(clean_fn).mode == 'RGB'
+
+    def test_disabled_by_default(self):
+        fn = self.save('image.jpg')
+        clean_fn, _ = ImageProcessor(ImageProcessorSettings()).process_image(fn)
+        assert not os.path.samefile(clean_fn, fn)
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.image_store import ImageStore, file_hash, DB_TIMEOUT
+
+class TestImageStore(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = ImageStore(os.path.join(self.tmp_dir, 'store'))
+
+    def teardown_method(self, method):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, name, content):
+        fn = os.path.join(self.tmp_dir, name)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        with open(fn, 'wb') as f:
+            f.write(content)
+        return fn
+
+    def test_store_created_on_first_use(self):
+        assert not os.path.exists(self.store.root_dir)
+        assert self.store.link_url('http://a.com/1.jpg', os.path.join(self.tmp_dir, 'x.jpg')) is None
+        assert os.path.isdir(self.store.root_dir)
+
+    def test_url_linked_into_other_directory(self):
+        fn = self.write_file('q1/1.jpg', b'image data')
+        content_hash = self.store.add_url('http://a.com/1.jpg', fn)
+        assert content_hash == file_hash(fn)
+
+        fn2 = os.path.join(self.tmp_dir, 'q2', '1.jpg')
+        assert self.store.link_url('https://A.com/1.jpg', fn2) == content_hash
+        assert os.path.samefile(fn, fn2)
+        assert self.store.ref_count(content_hash) == 2
+
+    def test_same_content_from_other_url_is_deduplicated(self):
+        fn = self.write_file('q1/1.jpg', b'image data')
+        fn2 = self.write_file('q2/2.jpg', b'image data')
+        assert self.store.add_url('http://a.com/1.jpg', fn) == self.store.add_url('http://b.com/2.jpg', fn2)
+        assert os.path.samefile(fn, fn2)
+        assert self.store.stats()['files'] == 1
+        assert self.store.stats()['urls'] == 2
+
+    def test_derived_images(self):
+        fn = self.write_file('q1/1-clean.jpg', b'clean data')
+        self.store.add_derived('abc', 'clean-1', fn)
+        fn2 = os.path.join(self.tmp_dir, 'q2', '1-clean.jpg')
+        assert self.store.link_derived('abc', 'clean-1', fn2)
+        assert not self.store.link_derived('abc', 'clean-2', fn2)
+        with open(fn2, 'rb') as f:
+            assert f.read() == b'clean data'
+
+    def test_gc_removes_unreferenced(self):
+        fn = self.write_file('q1/1.jpg', b'image data')
+        fn2 = self.write_file('q2/2.jpg', b'other data')
+        self.store.add_url('http://a.com/1.jpg', fn)
+        self.store.add_url('http://a.com/2.jpg', fn2)
+        assert self.store.gc() == 0
+        os.remove(fn)
+        assert self.store.gc() == 1
+        assert self.store.link_url('http://a.com/1.jpg', os.path.join(self.tmp_dir, 'x.jpg')) is None
+        assert self.store.stats()['files'] == 1
+
+    def test_locked_index_is_skipped(self):
+        fn = self.write_file('q1/1.jpg', b'image data')
+        content_hash = self.store.add_url('http://a.com/1.jpg', fn)
+        # (e.g. another process writing to the index)
+        other = sqlite3.connect(os.path.join(self.store.root_dir, 'index.sqlite'))
+        other.execute('BEGIN EXCLUSIVE')
+        try:
+            start_time = time.time()
+            fn2 = os.path.join(self.tmp_dir, 'q2', '1.jpg')
+            assert self.store.link_url('http://a.com/1.jpg', fn2) is None
+            assert not os.path.exists(fn2)
+            fn3 = self.write_file('q2/3.jpg', b'other data')
+            assert self.store.add_url('http://a.com/3.jpg', fn3) == file_hash(fn3)
+            assert not self.store.link_derived(content_hash, 'clean-1', fn2)
+            self.store.add_derived(content_hash, 'clean-1', fn3)
+            assert time.time() - start_time < 8*DB_TIMEOUT
+        finally:
+            other.rollback()
+            other.close()
+        assert self.store.stats()['files'] == 1
+        assert len(os.listdir(os.path.join(self.store.root_dir, 'blobs', content_hash[:2]))) == 1
+        assert self.store.link_url('http://a.com/1.jpg', fn2) == content_hash
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import subprocess
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+PACKAGE_DIR = os.path.join(FILE_DIR, '..', '..')
+
+# prints the modules loaded by (and the wall time of) the given import code
+IMPORT_PROBE = '''
+import sys, time, json
+t = time.time()
+%s
+elapsed = time.time() - t
+modules = sorted(sys.modules.keys())
+import gevent.monkey
+print(json.dumps({'elapsed': elapsed,
+                  'modules': modules,
+                  'patched': gevent.monkey.is_module_patched('socket')}))
+'''
+
+def probe_import(code):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE % code],
+                                     cwd=PACKAGE_DIR)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+class TestImportTime(object):
+
+    def test_package_import_is_lightweight(self):
+        res = probe_import('import imsearchtools')
+        modules = res['modules']
+        assert 'imsearchtools.engines' not in modules
+        assert 'imsearchtools.process' not in modules
+        assert 'requests' not in modules
+        assert 'flask' not in modules
+        assert not res['patched']
+
+    def test_single_engine_import(self):
+        res = probe_import('from imsearchtools import query\n'
+                           'query.GoogleWebSearch')
+        modules = res['modules']
+        assert 'imsearchtools.engines.google_web' in modules
+        assert 'imsearchtools.engines.bing_api_v5' not in modules
+        assert 'imsearchtools.process.image_getter' not in modules
+        assert 'imsearchtools.http_service_helper' not in modules
+        assert 'flask' not in modules
+        assert 'PIL' not in modules
+        assert not res['patched']
+
+    def test_lazy_attributes(self):
+        res = probe_import('import imsearchtools as ist\n'
+                           'ist.monkey_patch()\n'
+                           'assert ist.query.ResultCache\n'
+                           'assert ist.query.GOOGLE_WEB_ENTRY\n'
+                           'assert ist.process.ImageGetter\n'
+                           'assert ist.utils.deadline.Deadline')
+        assert 'imsearchtools.process.image_getter' in res['modules']
+        assert res['patched']
@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import tempfile
+import gevent
+
+from PIL import Image
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.memory_budget import MemoryBudget, MemoryBudgetTimeout
+from imsearchtools.process.image_getter import ImageGetter
+
+class TestMemoryBudget(object):
+
+    def setup_method(self, method):
+        self.budget = MemoryBudget(100)
+
+    def test_waits_until_released(self):
+        order = []
+        def job(name, nbytes):
+            with self.budget.reserved(nbytes):
+                order.append(name)
+                gevent.sleep(0.01)
+        jobs = [gevent.spawn(job, 'a', 60), gevent.spawn(job, 'b', 60), gevent.spawn(job, 'c', 30)]
+        gevent.sleep(0)
+        assert order == ['a']
+        assert self.budget.stats()['waiting'] == 2
+        gevent.joinall(jobs, raise_error=True)
+        # waiters are admitted in order of arrival (c fits next to a, but b came first)
+        assert order == ['a', 'b', 'c']
+        stats = self.budget.stats()
+        assert stats['used_bytes'] == 0
+        assert stats['peak_bytes'] == 90
+        assert stats['wait_count'] == 2
+
+    def test_large_reservations_are_reduced(self):
+        assert self.budget.reserve(1000) == 100
+        self.budget.release(100)
+        assert self.budget.stats()['used_bytes'] == 0
+
+    def test_timeout(self):
+        self.budget.reserve(80)
+        try:
+            self.budget.reserve(50, timeout=0.01)
+        except MemoryBudgetTimeout:
+            assert self.budget.stats()['waiting'] == 0
+            self.budget.release(80)
+            assert self.budget.reserve(50) == 50
+            return
+        assert False
+
+    def test_killed_waiter_is_removed(self):
+        self.budget.reserve(80)
+        job = gevent.spawn(self.budget.reserve, 50)
+        gevent.sleep(0)
+        job.kill()
+        self.budget.release(80)
+        assert self.budget.stats()['used_bytes'] == 0
+        assert self.budget.stats()['waiting'] == 0
+
+class TestDecodeAdmission(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        Image.new('RGB', (200, 100)).save(os.path.join(self.tmp_dir, 'a.jpg'), 'JPEG')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reserves_decoded_size(self):
+        budget = MemoryBudget(1024*1024)
+        getter = ImageGetter(memory_budget=budget)
+        out_fns = getter._run_process_image(os.path.join(self.tmp_dir, 'a.jpg'))
+        assert os.path.exists(out_fns['clean'])
+        stats = budget.stats()
+        assert stats['peak_bytes'] == 200*100*3
+        assert stats['used_bytes'] == 0
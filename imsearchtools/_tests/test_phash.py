@@ -0,0 +1,133 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+from PIL import Image
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process import phash
+from imsearchtools.process.image_getter import ImageGetter
+from imsearchtools.process.hash_index import HashIndex
+from imsearchtools.process.image_processor import ImageProcessor, ImageProcessorSettings
+
+def picture(size=(640, 480)):
+    return Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 100).convert('RGB')
+
+def other_picture(size=(640, 480)):
+    return Image.radial_gradient('L').resize(size).convert('RGB')
+
+class TestHash(object):
+
+    def test_resized_copy_is_near(self):
+        im = picture()
+        distance = phash.hamming_distance(phash.dhash(im), phash.dhash(im.resize((200, 150))))
+        assert distance <= phash.MAX_DISTANCE
+
+    def test_different_pictures_are_far(self):
+        distance = phash.hamming_distance(phash.dhash(picture()), phash.dhash(other_picture()))
+        assert distance > phash.MAX_DISTANCE
+
+    def test_hex_round_trip(self):
+        value = phash.dhash(picture())
+        assert len(phash.hash_to_hex(value)) == 16
+        assert phash.hash_from_hex(phash.hash_to_hex(value)) == value
+
+    def test_hamming_distances(self):
+        assert list(phash.hamming_distances(0b1011, [0b1011, 0b0011, 0, 2**64 - 1])) == [0, 1, 3, 61]
+
+    def test_near_duplicate_filter(self):
+        dup_filter = phash.NearDuplicateFilter(max_distance=2)
+        assert dup_filter.check(0b1111) is None
+        assert dup_filter.check(0b1100) == 0b1111
+        assert dup_filter.check(0b11110000) is None
+        assert len(dup_filter) == 2
+
+    def test_near_duplicate_filter_ranks(self):
+        dup_filter = phash.NearDuplicateFilter(max_distance=2)
+        assert dup_filter.check(0b1111, 5, 'a') is None
+        assert dup_filter.check(0b1110, 6, 'b') == 0b1111
+        # a better ranked near-duplicate supersedes the image checked first
+        assert dup_filter.check(0b1100, 2, 'c') is None
+        assert dup_filter.superseded('a')
+        assert not dup_filter.superseded('b') and not dup_filter.superseded('c')
+        assert dup_filter.check(0b1101, 3, 'd') == 0b1100
+        assert len(dup_filter) == 1
+
+class TestNearDuplicateResults(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        picture().save(os.path.join(self.tmp_dir, 'a.jpg'), 'JPEG')
+        picture((320, 240)).save(os.path.join(self.tmp_dir, 'b.jpg'), 'JPEG', quality=50)
+        other_picture().save(os.path.join(self.tmp_dir, 'c.jpg'), 'JPEG')
+        self.opts = ImageProcessorSettings()
+        self.opts.phash['enabled'] = True
+        # (the files exist, so they are not downloaded again)
+        self.urls = [{'url': 'http://a.com/%s.jpg' % image_id, 'image_id': image_id}
+                     for image_id in ('a', 'b', 'c')]
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hash_in_outputs(self):
+        out_fns = ImageProcessor(self.opts).process_image_outputs(os.path.join(self.tmp_dir, 'a.jpg'))
+        assert len(out_fns['phash']) == 16
+        # also computed when all outputs already exist
+        again = ImageProcessor(self.opts).process_image_outputs(os.path.join(self.tmp_dir, 'a.jpg'))
+        assert phash.hamming_distance(phash.hash_from_hex(again['phash']),
+                                      phash.hash_from_hex(out_fns['phash'])) <= phash.MAX_DISTANCE
+
+    def test_near_duplicates_dropped(self):
+        results = ImageGetter(opts=self.opts).process_urls(self.urls, self.tmp_dir)
+        assert len(results) == 2
+        assert all(len(result['phash']) == 16 for result in results)
+        assert 'c' in [result['image_id'] for result in results]
+
+    def test_near_duplicate_survivor_by_rank(self):
+        # (a is processed first, but b has the better rank)
+        for rank, urldata in zip((2, 1, 3), self.urls):
+            urldata['rank'] = rank
+        results = ImageGetter(opts=self.opts).process_urls(self.urls, self.tmp_dir)
+        assert sorted(result['image_id'] for result in results) == ['b', 'c']
+        for urldata in self.urls:
+            urldata.pop('orig_fn', None)
+        results = list(ImageGetter(opts=self.opts).iter_process_urls(self.urls, self.tmp_dir,
+                                                                     ordered=True))
+        assert [result['image_id'] for result in results] == ['b', 'c']
+
+    def test_near_duplicates_kept(self):
+        self.opts.phash['max_distance'] = -1
+        results = ImageGetter(opts=self.opts).process_urls(self.urls, self.tmp_dir)
+        assert len(results) == 3
+
+    def test_duplicates_across_queries(self):
+        index = HashIndex(os.path.join(self.tmp_dir, 'index'))
+        first = ImageGetter(opts=self.opts, hash_index=index).process_urls(self.urls[:1], self.tmp_dir)
+        assert first[0]['duplicate_of'] is None
+        # the same URL again, and the same picture from another URL
+        results = ImageGetter(opts=self.opts, hash_index=index).process_urls(self.urls, self.tmp_dir)
+        duplicate_of = dict((result['image_id'], result['duplicate_of']) for result in results)
+        assert duplicate_of['a'] is None
+        assert duplicate_of.get('b', 'http://a.com/a.jpg') == 'http://a.com/a.jpg'
+        assert duplicate_of['c'] is None
+        assert len(index) == 2
+        index.close()
+
+    def test_locked_hash_index_is_skipped(self):
+        index = HashIndex(os.path.join(self.tmp_dir, 'index'))
+        len(index)
+        other = sqlite3.connect(os.path.join(index.root_dir, 'keys.sqlite'))
+        other.execute('BEGIN EXCLUSIVE')
+        try:
+            results = ImageGetter(opts=self.opts, hash_index=index).process_urls(self.urls,
+                                                                                 self.tmp_dir)
+        finally:
+            other.rollback()
+            other.close()
+        assert len(results) == 2
+        assert all(result['duplicate_of'] is None for result in results)
+        assert len(index) == 0
+        index.close()
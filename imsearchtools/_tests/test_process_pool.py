@@ -0,0 +1,86 @@
+import io
+import os
+import sys
+import math
+import time
+import shutil
+import tempfile
+import gevent
+
+from PIL import Image
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.process.process_pool import ProcessPool, WorkerError
+from imsearchtools.process.image_getter import ImageGetter
+from imsearchtools.process.image_processor import ImageProcessorSettings
+
+class TestProcessPool(object):
+
+    def setup_method(self, method):
+        self.pool = ProcessPool(worker_count=2, queue_depth=2)
+
+    def teardown_method(self, method):
+        self.pool.close()
+
+    def test_runs_in_worker_processes(self):
+        jobs = [gevent.spawn(self.pool.apply, os.getpid) for _ in range(6)]
+        gevent.joinall(jobs, raise_error=True)
+        pids = set(job.value for job in jobs)
+        assert os.getpid() not in pids
+        assert len(pids) <= 2
+
+    def test_exceptions_are_raised_in_caller(self):
+        try:
+            self.pool.apply(math.sqrt, -1.0)
+        except ValueError:
+            assert self.pool.apply(math.sqrt, 4.0) == 2.0
+            return
+        assert False
+
+    def test_event_loop_is_not_blocked(self):
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(20)])
+        self.pool.apply(time.sleep, 0.3)
+        ticker.kill()
+        assert len(ticks) >= 10
+
+    def test_dead_worker_is_restarted(self):
+        try:
+            self.pool.apply(os._exit, 1)
+        except WorkerError:
+            assert self.pool.apply(math.sqrt, 9.0) == 3.0
+            return
+        assert False
+
+    def test_closed_pool_rejects_tasks(self):
+        self.pool.close()
+        try:
+            self.pool.apply(os.getpid)
+        except WorkerError:
+            return
+        assert False
+
+class TestImageGetterProcessPool(object):
+
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'image.jpg')
+        Image.new('RGB', (320, 240), (200, 30, 30)).save(self.fn, 'JPEG')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_process_image_in_pool(self):
+        getter = ImageGetter(process_workers=1)
+        out_fns = getter._run_process_image(self.fn)
+        assert Image.open(out_fns['clean']).size == (320, 240)
+        assert os.path.exists(out_fns['thumb'])
+
+    def test_filter_exception_from_pool(self):
+        opts = ImageProcessorSettings()
+        opts.filter['min_width'] = 1000
+        getter = ImageGetter(opts=opts, process_workers=1)
+        result = getter.process_url({'url': 'http://a.com/image.jpg', 'image_id': 'image'},
+                                    self.tmp_dir)
+        assert result is None
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines import rate_limiter
+from imsearchtools.engines.search_client import SearchClient, QueryException
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class ThrottledSearch(SearchClient):
+    """Fake search client whose first `throttle_count` requests are throttled"""
+
+    def __init__(self, throttle_count, retry_after=None):
+        self.throttle_count = throttle_count
+        self.retry_after = retry_after
+        self.request_times = []
+        self.timeout = 5.0
+
+    def get(self, url, **kwargs):
+        self.request_times.append(time.time())
+        if len(self.request_times) <= self.throttle_count:
+            headers = {'Retry-After': self.retry_after} if self.retry_after else {}
+            return FakeResponse(429, headers)
+        return FakeResponse(200)
+
+class TestRateLimiter(object):
+
+    def setup_method(self):
+        self._rate_limit = rate_limiter.RATE_LIMITS.get('ThrottledSearch')
+        self._limiter = rate_limiter._rate_limiters.get('ThrottledSearch')
+        rate_limiter.set_rate_limit('ThrottledSearch', 1000.0, 10)
+        self._backoff_base = rate_limiter.BACKOFF_BASE
+        rate_limiter.BACKOFF_BASE = 0.01
+
+    def teardown_method(self):
+        rate_limiter.BACKOFF_BASE = self._backoff_base
+        rate_limiter.RATE_LIMITS.pop('ThrottledSearch')
+        rate_limiter._rate_limiters.pop('ThrottledSearch')
+        if self._rate_limit is not None:
+            rate_limiter.RATE_LIMITS['ThrottledSearch'] = self._rate_limit
+        if self._limiter is not None:
+            rate_limiter._rate_limiters['ThrottledSearch'] = self._limiter
+
+    def test_token_bucket_limits_rate(self):
+        limiter = rate_limiter.RateLimiter(100.0, burst=5)
+        t = time.time()
+        for i in range(15):
+            limiter.acquire()
+        # 5 requests from the burst, then 10 at 100 requests/sec
+        assert time.time() - t >= 0.09
+
+    def test_throttled_requests_are_retried(self):
+        searcher = ThrottledSearch(2)
+        resp = searcher._rate_limited_get('http://example.com')
+        assert resp.status_code == 200
+        assert len(searcher.request_times) == 3
+        limiter = rate_limiter.get_rate_limiter('ThrottledSearch')
+        assert limiter.throttle_count == 2
+        assert limiter.rate < limiter.max_rate
+
+    def test_retry_after_is_honoured(self):
+        searcher = ThrottledSearch(1, retry_after='0.2')
+        searcher._rate_limited_get('http://example.com')
+        assert searcher.request_times[1] - searcher.request_times[0] >= 0.2
+
+    def test_retry_after_is_capped(self):
+        limiter = rate_limiter.RateLimiter(1000.0, burst=10)
+        limiter.on_throttle(86400.0)
+        assert limiter._blocked_until <= time.time() + rate_limiter.MAX_RETRY_AFTER
+        try:
+            limiter.acquire(timeout=1.0)
+        except rate_limiter.RateLimitTimeout:
+            return
+        assert False
+
+    def test_fails_instead_of_waiting_past_timeout(self):
+        searcher = ThrottledSearch(1, retry_after='3600')
+        searcher.timeout = 0.1
+        t = time.time()
+        try:
+            searcher._rate_limited_get('http://example.com')
+        except QueryException:
+            assert time.time() - t < 0.5
+            assert len(searcher.request_times) == 1
+            return
+        assert False
+
+    def test_gives_up_after_max_retries(self):
+        searcher = ThrottledSearch(100)
+        resp = searcher._rate_limited_get('http://example.com')
+        assert resp.status_code == 429
+        assert len(searcher.request_times) == rate_limiter.MAX_RETRIES + 1
+
+    def test_parse_retry_after(self):
+        assert rate_limiter.parse_retry_after('3') == 3.0
+        assert rate_limiter.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+        assert rate_limiter.parse_retry_after('garbage') is None
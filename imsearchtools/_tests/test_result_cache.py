@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines.search_client import SearchClient, cached_query
+from imsearchtools.engines.result_cache import ResultCache
+
+class CountingSearch(SearchClient):
+
+    def __init__(self):
+        self.query_count = 0
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100):
+        self.query_count = self.query_count + 1
+        return [{'url': 'http://example.com/%s/%d.jpg' % (query, i),
+                 'image_id': '%s%d' % (query, i)} for i in range(num_results)]
+
+class TestResultCache(object):
+
+    def setup_method(self):
+        self._disk_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self._disk_dir)
+
+    def test_repeated_query_hits_cache(self):
+        searcher = CountingSearch()
+        searcher.result_cache = ResultCache()
+        res = searcher.query('car', num_results=10)
+        res2 = searcher.query('car', size='medium', num_results=10)
+        assert searcher.query_count == 1
+        assert res == res2
+        searcher.query('car', num_results=20)
+        assert searcher.query_count == 2
+        stats = searcher.result_cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 2
+
+    def test_returned_results_are_copies(self):
+        searcher = CountingSearch()
+        searcher.result_cache = ResultCache()
+        res = searcher.query('car', num_results=2)
+        res[0]['orig_fn'] = '/tmp/car.jpg'
+        assert 'orig_fn' not in searcher.query('car', num_results=2)[0]
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        for q in ['a', 'b', 'c']:
+            cache.set(cache.make_key('Engine', q, '', '', 1), [{'url': q}])
+        assert cache.get(cache.make_key('Engine', 'a', '', '', 1)) is None
+        assert cache.get(cache.make_key('Engine', 'c', '', '', 1)) == [{'url': 'c'}]
+        assert cache.stats()['evictions'] == 1
+
+    def test_per_engine_ttl(self):
+        cache = ResultCache(default_ttl=60.0, engine_ttls={'Stale': 0.01})
+        cache.set(cache.make_key('Stale', 'a', '', '', 1), [{'url': 'a'}])
+        cache.set(cache.make_key('Fresh', 'a', '', '', 1), [{'url': 'a'}])
+        time.sleep(0.02)
+        assert cache.get(cache.make_key('Stale', 'a', '', '', 1)) is None
+        assert cache.get(cache.make_key('Fresh', 'a', '', '', 1)) is not None
+
+    def test_disk_tier_survives_new_instance(self):
+        key = ResultCache.make_key('Engine', 'car', 'medium', 'photo', 1)
+        ResultCache(disk_dir=self._disk_dir).set(key, [{'url': 'http://a.jpg'}])
+        cache = ResultCache(disk_dir=self._disk_dir)
+        assert cache.get(key) == [{'url': 'http://a.jpg'}]
+        assert cache.stats()['disk_hits'] == 1
+
+    def test_disk_tier_is_bounded(self):
+        cache = ResultCache(disk_dir=self._disk_dir, max_disk_entries=10)
+        for i in range(25):
+            cache.set(cache.make_key('Engine', str(i), '', '', 1), [{'url': str(i)}])
+        assert len(os.listdir(self._disk_dir)) <= 10
@@ -0,0 +1,121 @@
+import os
+import sys
+import gevent
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines.search_client import SearchClient
+from imsearchtools.engines.result_cache import ResultCache
+from imsearchtools.utils.deadline import Deadline, time_left
+
+# (timeouts fall between the delays of the first and second pages)
+PAGE_DELAY = 0.05
+
+class PagedSearch(SearchClient):
+    """Fake search client returning pages of 10 results, later pages first"""
+
+    paged_fetching = True
+
+    def __init__(self, async_query=True, timeout=5.0):
+        self.timeout = timeout
+        self.async_query = async_query
+        self._results_per_req = 10
+        self._supported_sizes_map = {'medium': 'm'}
+        self._supported_styles_map = {'photo': 'photo'}
+        self.requested_offsets = []
+
+    def _fetch_results_from_offset(self, query, result_offset,
+                                   aux_params={}, headers={},
+                                   num_results=-1):
+        self.requested_offsets.append(result_offset)
+        gevent.sleep(PAGE_DELAY*(num_results - result_offset)/self._results_per_req)
+        return ['%s-%d' % (query, result_offset + i) for i in range(self._results_per_req)]
+
+    def _query_params(self, size, style):
+        return {}, {}
+
+    def _convert_results(self, results, size):
+        return [{'url': 'http://example.com/%s.jpg' % item, 'image_id': item}
+                for item in results]
+
+    def query(self, query, size='medium', style='photo', num_results=100):
+        aux_params, headers = self._query_params(size, style)
+        results = self._fetch_results(query, num_results, aux_params=aux_params, headers=headers)
+        return self._convert_results(results, size)
+
+class TestIterQuery(object):
+
+    def test_pages_yielded_as_they_arrive(self):
+        searcher = PagedSearch()
+        res = list(searcher.iter_query('car', num_results=30))
+        assert [item['image_id'] for item in res[:10]] == ['car-%d' % i for i in range(20, 30)]
+        assert sorted(item['rank'] for item in res) == list(range(1, 31))
+        assert res[0]['rank'] == 21
+
+    def test_same_results_as_query(self):
+        searcher = PagedSearch(async_query=False)
+        res = list(searcher.iter_query('car', num_results=30))
+        assert [dict(item, rank=None) for item in res] == \
+            [dict(item, rank=None) for item in searcher.query('car', num_results=30)]
+
+    def test_timeout_returns_completed_pages(self):
+        searcher = PagedSearch(timeout=1.5*PAGE_DELAY)
+        status = {}
+        res = list(searcher.iter_query('car', num_results=30, status=status))
+        assert len(res) == 10
+        assert status['partial']
+
+    def test_complete_stream_not_partial(self):
+        status = {}
+        res = list(PagedSearch().iter_query('car', num_results=30, status=status))
+        assert len(res) == 30
+        assert not status['partial']
+
+    def test_streamed_results_are_cached(self):
+        searcher = PagedSearch()
+        searcher.result_cache = ResultCache()
+        res = list(searcher.iter_query('car', num_results=30))
+        for item in res:
+            item['orig_fn'] = '/tmp/image.jpg'
+        searcher.requested_offsets = []
+        res2 = list(searcher.iter_query('car', num_results=30))
+        assert searcher.requested_offsets == []
+        assert [item['rank'] for item in res2] == list(range(1, 31))
+        assert 'orig_fn' not in res2[0]
+
+    def test_unpaged_client(self):
+        searcher = PagedSearch()
+        searcher.paged_fetching = False
+        try:
+            searcher.split_cached_iter_query('car')
+        except NotImplementedError:
+            return
+        assert False
+
+class TestDeadline(object):
+
+    def test_time_left(self):
+        assert time_left(None, 5.0) == 5.0
+        assert time_left(Deadline(), 5.0) == 5.0
+        assert time_left(Deadline(), None) is None
+        assert 0.0 < time_left(Deadline(1.0), 5.0) <= 1.0
+        assert 0.0 < time_left(Deadline(1.0), -1.0) <= 1.0
+        assert time_left(Deadline(10.0), 5.0) == 5.0
+
+    def test_complete_results_not_partial(self):
+        searcher = PagedSearch()
+        res = searcher._query('car', 'medium', 'photo', 30, deadline=Deadline(5.0))
+        assert len(res) == 30
+        assert not res.partial
+
+    def test_deadline_returns_partial_results(self):
+        searcher = PagedSearch()
+        res = searcher._query('car', 'medium', 'photo', 30, deadline=Deadline(1.5*PAGE_DELAY))
+        assert len(res) == 10
+        assert res.partial
+
+    def test_expired_deadline_in_sync_mode(self):
+        searcher = PagedSearch(async_query=False)
+        res = searcher._query('car', 'medium', 'photo', 30, deadline=Deadline(1.5*PAGE_DELAY))
+        assert 0 < len(res) < 30
+        assert res.partial
@@ -0,0 +1,56 @@
+import os
+import sys
+
+FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FILE_DIR, '..'))
+from imsearchtools.engines import searcher_pool
+from imsearchtools.engines.result_cache import ResultCache
+
+class TestSearcherPool(object):
+
+    def teardown_method(self):
+        searcher_pool.clear_searchers()
+        searcher_pool.set_result_cache(None)
+
+    def test_searchers_are_reused(self):
+        searcher = searcher_pool.get_searcher('google_web')
+        assert searcher_pool.get_searcher('google_web') is searcher
+        assert searcher_pool.get_searcher('google_web', 2.0) is not searcher
+        assert searcher_pool.get_searcher('google_web', 2.0).timeout == 2.0
+
+    def test_timeouts_are_bucketed(self):
+        searcher = searcher_pool.get_searcher('google_web', 2.0)
+        assert searcher_pool.get_searcher('google_web', 2.1) is searcher
+        assert searcher_pool.get_searcher('google_web', 0.01).timeout == searcher_pool.TIMEOUT_BUCKET
+
+    def test_registry_is_bounded(self):
+        searcher = searcher_pool.get_searcher('google_web')
+        for i in range(2*searcher_pool.MAX_SEARCHERS):
+            searcher_pool.get_searcher('google_web', 1.0 + i)
+            # (recently used searchers are kept)
+            assert searcher_pool.get_searcher('google_web') is searcher
+        assert len(searcher_pool._searchers) == searcher_pool.MAX_SEARCHERS
+        assert searcher_pool.get_searcher('google_web', 1.0).timeout == 1.0
+
+    def test_adapter_pool_size(self):
+        searcher = searcher_pool.get_searcher('google_web')
+        adapter = searcher.get_adapter('https://www.google.com/')
+        assert adapter._pool_maxsize == searcher_pool.POOL_MAXSIZE
+
+    def test_result_cache_is_shared(self):
+        cache = ResultCache()
+        searcher = searcher_pool.get_searcher('google_web')
+        searcher_pool.set_result_cache(cache)
+        assert searcher.result_cache is cache
+        assert searcher_pool.get_searcher('google_web', 1.0).result_cache is cache
+
+    def test_federated_uses_pooled_searchers(self):
+        searcher = searcher_pool.get_searcher('federated')
+        assert searcher_pool.get_searcher('google_web') in searcher.searchers
+
+    def test_unknown_engine(self):
+        try:
+            searcher_pool.get_searcher('altavista')
+        except ValueError:
+            return
+        assert False
@@ -1,6 +1,50 @@
-from .bing_api_v1 import *
-from .bing_api_v5 import *
-from .google_old_api import *
-from .google_api import *
-from .google_web import *
-from .flickr_api import *
+"""
+Search engine clients (available as `imsearchtools.query`)
+
+Each client is only imported when it is first accessed, so e.g.
+`imsearchtools.query.GoogleWebSearch` does not load the other engines.
+"""
+
+import importlib
+import importlib.util
+
+# attribute name -> submodule defining it
+_LAZY_ATTRIBUTES = {'SearchClient': 'search_client',
+                    'QueryException': 'search_client',
+                    'NoAPICredentials': 'search_client',
+                    'BingAPISearchV1': 'bing_api_v1',
+                    'BingAPISearchV5': 'bing_api_v5',
+                    'GoogleOldAPISearch': 'google_old_api',
+                    'GoogleAPISearch': 'google_api',
+                    'GoogleWebSearch': 'google_web',
+                    'FlickrAPISearch': 'flickr_api',
+                    'ResultCache': 'result_cache',
+                    'FederatedSearch': 'federated',
+                    'query_many': 'batch',
+                    'iter_query_many': 'batch'}
+
+# modules searched for any other attribute, as previously exported using
+# `from .<module> import *`
+_ENGINE_MODULES = ['bing_api_v1', 'bing_api_v5', 'google_old_api', 'google_api',
+                   'google_web', 'flickr_api']
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+    elif not name.startswith('_') and importlib.util.find_spec('.' + name, __name__) is None:
+        # (submodules of the package are imported normally)
+        for module_name in _ENGINE_MODULES:
+            module = importlib.import_module('.' + module_name, __name__)
+            if hasattr(module, name):
+                value = getattr(module, name)
+                break
+        else:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()))
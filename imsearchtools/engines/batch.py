@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import logging
+from collections import OrderedDict
+
+import gevent
+from gevent import pool
+from gevent.lock import BoundedSemaphore
+
+from .search_client import QueryException
+from . import searcher_pool
+from . import health
+
+log = logging.getLogger(__name__)
+
+## Batch Configuration
+#  --------------------------------------------
+
+# maximum number of page requests in flight for all batch queries in the
+# process, and for each engine (keyed by the name of the search client class)
+MAX_CONCURRENT_FETCHES = 32
+ENGINE_FETCH_CAPS = {'GoogleWebSearch': 8,
+                     'BingAPISearchV5': 4,
+                     'GoogleAPISearch': 8,
+                     'FlickrAPISearch': 4}
+DEFAULT_ENGINE_FETCH_CAP = 8
+
+## Fetch Scheduler
+#  --------------------------------------------
+
+class FetchScheduler(object):
+    """
+    Runs the page requests of many queries in one bounded pool of greenlets
+
+    At most `max_concurrency` requests are run at the same time, and at most
+    `engine_caps[engine_name]` (or `default_engine_cap`) of these for any
+    single engine. `spawner(engine_name)` returns a function with the same
+    signature as `gevent.spawn` which can be passed to
+    `SearchClient._fetch_results`, and which blocks until a slot is free.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_FETCHES, engine_caps=None,
+                 default_engine_cap=DEFAULT_ENGINE_FETCH_CAP):
+        self.pool = pool.Pool(size=max_concurrency)
+        self.engine_caps = dict(ENGINE_FETCH_CAPS if engine_caps is None else engine_caps)
+        self.default_engine_cap = default_engine_cap
+        self._engine_semaphores = {}
+
+    def spawner(self, engine_name):
+        semaphore = self._engine_semaphores.get(engine_name)
+        if semaphore is None:
+            semaphore = BoundedSemaphore(self.engine_caps.get(engine_name,
+                                                              self.default_engine_cap))
+            self._engine_semaphores[engine_name] = semaphore
+
+        def spawn(func, *args, **kwargs):
+            semaphore.acquire()
+            try:
+                job = self.pool.spawn(func, *args, **kwargs)
+            except BaseException:
+                semaphore.release()
+                raise
+            job.link(lambda job: semaphore.release())
+            return job
+
+        return spawn
+
+_fetch_scheduler = None
+
+def get_fetch_scheduler():
+    """Return the fetch scheduler shared by all batch queries in the process"""
+    global _fetch_scheduler
+    if _fetch_scheduler is None:
+        _fetch_scheduler = FetchScheduler()
+    return _fetch_scheduler
+
+## Batch Queries
+#  --------------------------------------------
+
+def _query_term(searcher, term, size, style, num_results, spawn):
+    # (cached in the result cache of the searcher, and recorded in the engine
+    # health scoreboard, as any other query)
+    query_params = dict(size=size, style=style, num_results=num_results)
+    if searcher.paged_fetching:
+        # (clients which do not fetch pages, e.g. FederatedSearch, spawn their own requests)
+        query_params['spawn'] = spawn
+    return health.tracked_query(searcher, term, **query_params)
+
+def _query_term_outcome(searcher, term, size, style, num_results, spawn):
+    try:
+        return {'results': _query_term(searcher, term, size, style, num_results, spawn)}
+    except (QueryException, ValueError) as e:
+        log.info('Batch query failed for term: %s (%s)', term, str(e))
+        return {'error': str(e)}
+
+def iter_query_many(terms, engine='google_web', size='medium', style='photo',
+                    num_results=100, timeout=None, scheduler=None):
+    """Query `engine` for all `terms`, yielding results as each term completes
+
+    The page requests of all terms are run through `scheduler` (by default,
+    the scheduler shared by the whole process) so that the number of requests
+    in flight stays bounded. Searchers are taken from `searcher_pool`, with
+    `timeout` applying to each term from the time its requests are submitted
+    to the scheduler (so that waiting for a free slot counts towards it).
+    Each term is queried through `health.tracked_query`, so it is recorded in
+    the engine health scoreboard and fails while the circuit breaker of the
+    engine is open.
+
+    Yields tuples (term, outcome) in order of completion, where outcome is
+    either {'results': [...]} with results in the same form as returned from
+    `SearchClient.query`, or {'error': 'message'} if the term failed.
+    """
+    searcher = searcher_pool.get_searcher(engine, timeout)
+    if scheduler is None:
+        scheduler = get_fetch_scheduler()
+    spawn = scheduler.spawner(searcher.__class__.__name__)
+
+    # remove duplicate terms, keeping the original order
+    terms = list(OrderedDict.fromkeys(terms))
+    jobs = [gevent.spawn(_query_term_outcome, searcher, term, size, style,
+                         num_results, spawn)
+            for term in terms]
+    term_from_job = dict(zip(jobs, terms))
+
+    try:
+        for job in gevent.iwait(jobs):
+            if job.successful():
+                yield term_from_job[job], job.value
+            else:
+                yield term_from_job[job], {'error': str(job.exception)}
+    finally:
+        gevent.killall([job for job in jobs if not job.ready()], block=False)
+
+def query_many(terms, engine='google_web', size='medium', style='photo',
+               num_results=100, timeout=None, scheduler=None):
+    """Query `engine` for all `terms` concurrently (see `iter_query_many`)
+
+    Returns:
+        An ordered dict mapping each term (in the order given) to either
+        {'results': [...]} or {'error': 'message'}
+    """
+    terms = list(terms)
+    outcomes = dict(iter_query_many(terms, engine, size=size, style=style,
+                                    num_results=num_results, timeout=timeout,
+                                    scheduler=scheduler))
+    return OrderedDict((term, outcomes[term]) for term in OrderedDict.fromkeys(terms))
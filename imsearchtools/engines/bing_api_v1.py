@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gevent
 import requests
 from hashlib import md5
 
@@ -27,6 +28,8 @@ class BingAPISearchV1(requests.Session, SearchClient):
     http://www.bing.com/developers/
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(BingAPISearchV1, self).__init__()
 
@@ -67,8 +70,8 @@ class BingAPISearchV1(requests.Session, SearchClient):
             if DEBUG_MESSAGES:
                 print(aux_params)
 
-            resp = self.get(BING_API_ENTRY + BING_API_FUNC, params=aux_params,
-                            headers=headers)
+            resp = self._rate_limited_get(BING_API_ENTRY + BING_API_FUNC, params=aux_params,
+                                          headers=headers)
             resp.raise_for_status()
 
             # extract list of results from response
@@ -81,12 +84,12 @@ class BingAPISearchV1(requests.Session, SearchClient):
             print('error occurred: ' + str(e))
             return []
 
-    def __bing_results_to_results(self, results):
+    def _convert_results(self, results, size):
         return [{'url': item['MediaUrl'],
                  'image_id': md5(item['ID']).hexdigest(),
                  'title': item['Title']} for item in results]
 
-    def query(self, query, size='medium', style='photo', num_results=100):
+    def _query_params(self, size, style):
         # prepare query parameters
         size = self._size_to_native_size(size)
         style = self._style_to_native_style(style)
@@ -106,12 +109,9 @@ class BingAPISearchV1(requests.Session, SearchClient):
         if quoted_image_filters:
             aux_params['ImageFilters'] = quoted_image_filters
 
-        # prepare output
-        results = []
-
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params)
+        return aux_params, {}
 
-        return self.__bing_results_to_results(results)
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gevent
 import requests
 
 try:
@@ -25,6 +26,8 @@ class BingAPISearchV5(requests.Session, SearchClient):
     http://www.bing.com/developers/
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(BingAPISearchV5, self).__init__()
 
@@ -64,7 +67,7 @@ class BingAPISearchV5(requests.Session, SearchClient):
             if DEBUG_MESSAGES:
                 print(aux_params)
 
-            resp = self.get(BING_API_ENTRY, params=aux_params, headers=headers)
+            resp = self._rate_limited_get(BING_API_ENTRY, params=aux_params, headers=headers)
             resp.raise_for_status()
 
             # extract list of results from response
@@ -77,12 +80,12 @@ class BingAPISearchV5(requests.Session, SearchClient):
             print('error occurred: ' + str(e))
             return []
 
-    def __bing_results_to_results(self, results):
+    def _convert_results(self, results, size):
         return [{'url': item['contentUrl'],
                  'image_id': item['imageId'],
                  'title': item['name']} for item in results]
 
-    def query(self, query, size='medium', style='photo', num_results=100):
+    def _query_params(self, size, style):
         # prepare query parameters
         size = self._size_to_native_size(size)
         style = self._style_to_native_style(style)
@@ -93,15 +96,9 @@ class BingAPISearchV5(requests.Session, SearchClient):
         if style:
             aux_params['imageType'] = style
 
-        # prepare output
-        results = []
-
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params,
-                                      headers=self.headers
-                                      )
-
-        return self.__bing_results_to_results(results)
+        return aux_params, self.headers
 
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import logging
+
+import gevent
+
+from .search_client import *
+from . import health
+from imsearchtools.utils.deadline import ResultList, time_left
+from imsearchtools.utils.urls import canonical_url
+
+log = logging.getLogger(__name__)
+
+## Fusion Configuration
+#  --------------------------------------------
+
+# constant used in reciprocal rank fusion scores: 1/(RRF_K + rank)
+RRF_K = 60
+
+## Result Fusion
+#  --------------------------------------------
+
+def reciprocal_rank_fusion(result_lists, num_results=-1, k=RRF_K):
+    """Merge ranked result lists from several engines into a single list
+
+    Args:
+        result_lists: a list of (engine_name, results) tuples, where results is a
+            list of result dicts as returned from `SearchClient.query`
+        [num_results]: maximum number of results to return (-1 for all)
+        [k]: reciprocal rank fusion constant
+
+    Returns:
+        A list of result dicts sorted by decreasing fused score. Results with
+        the same canonical URL are merged (keeping the fields of the highest
+        ranked copy), and the names of all engines which returned them are
+        listed in an 'engines' field. The 'rank' field is set to the fused rank.
+    """
+    scores = {}
+    merged = {}
+    first_seen = []
+    for engine_name, results in result_lists:
+        seen_in_engine = set()
+        for rank, item in enumerate(results):
+            curl = canonical_url(item['url'])
+            if curl in seen_in_engine:
+                continue
+            seen_in_engine.add(curl)
+            scores[curl] = scores.get(curl, 0.0) + 1.0/(k + rank + 1)
+            if curl not in merged:
+                merged[curl] = dict(item, engines=[engine_name])
+                first_seen.append(curl)
+            else:
+                merged[curl]['engines'].append(engine_name)
+
+    # sort is stable, so ties keep the order in which results were first seen
+    fused = sorted(first_seen, key=lambda curl: -scores[curl])
+    if num_results > 0:
+        fused = fused[:num_results]
+
+    output = []
+    for index, curl in enumerate(fused):
+        item = merged[curl]
+        item['rank'] = index + 1
+        output.append(item)
+    return output
+
+## Search Class
+#  --------------------------------------------
+
+class FederatedSearch(SearchClient):
+    """
+    Search client which queries several other search clients concurrently
+    and merges their results using reciprocal rank fusion.
+
+    All searchers are queried at the same time and given `timeout` seconds
+    in total to return. Searchers which miss the deadline or fail are
+    ignored, and the merged results of the remaining ones are returned
+    (the 'engines' field of each result lists the engines which returned it).
+    A QueryException is only raised if none of the searchers returned any
+    results, otherwise a ResultList is returned with its `partial` flag set
+    if any searcher missed the deadline or returned partial results.
+
+    The outcome of each searcher is recorded in the engine health scoreboard
+    (see `health`), and searchers whose circuit breaker is open are skipped.
+    """
+
+    def __init__(self, searchers, timeout=5.0, rrf_k=RRF_K):
+        if not searchers:
+            raise ValueError('At least one searcher must be specified')
+
+        self.searchers = list(searchers)
+        self.timeout = timeout
+        self.rrf_k = rrf_k
+
+        # sizes and styles are passed through to (and validated by) each searcher
+        self._supported_sizes_map = {}
+        self._supported_styles_map = {}
+        for searcher in self.searchers:
+            for size in searcher.supported_sizes:
+                self._supported_sizes_map[size] = size
+            for style in searcher.supported_styles:
+                self._supported_styles_map[style] = style
+
+        self.async_query = True
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None):
+        jobs = [gevent.spawn(health.tracked_query, searcher, query, deadline=deadline,
+                             size=size, style=style, num_results=num_results)
+                for searcher in self.searchers]
+
+        gevent.joinall(jobs, timeout=time_left(deadline, self.timeout))
+
+        result_lists = []
+        partial = False
+        for searcher, job in zip(self.searchers, jobs):
+            engine_name = searcher.__class__.__name__
+            if not job.ready():
+                log.info('%s missed the deadline for query: %s', engine_name, query)
+                job.kill(block=False)
+                partial = True
+            elif not job.successful():
+                log.info('%s failed for query: %s (%s)', engine_name, query, str(job.exception))
+            elif job.value:
+                result_lists.append((engine_name, job.value))
+                partial = partial or getattr(job.value, 'partial', False)
+
+        if not result_lists:
+            raise QueryException("No image URLs could be retrieved")
+
+        return ResultList(reciprocal_rank_fusion(result_lists, num_results, self.rrf_k),
+                          partial=partial)
+
+    def iter_query(self, query, size='medium', style='photo', num_results=100,
+                   deadline=None, status=None):
+        # fused ranks are only known once all searchers have returned
+        results = self.query(query, size=size, style=style, num_results=num_results,
+                             deadline=deadline)
+        for item in _iter_with_status(results, status):
+            yield item
+
+    def split_cached_iter_query(self, query, size='medium', style='photo', num_results=100,
+                                deadline=None, status=None):
+        cached_results, query_engine = split_cached_query(self, query, size=size, style=style,
+                                                          num_results=num_results,
+                                                          deadline=deadline)
+        return cached_results, lambda: _iter_with_status(query_engine(), status)
+
+def _iter_with_status(results, status):
+    # yield `results`, setting status['partial'] (see SearchClient.iter_query) once done
+    for item in results:
+        yield item
+    if status is not None:
+        status['partial'] = getattr(results, 'partial', False)
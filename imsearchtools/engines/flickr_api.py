@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gevent
 import requests
 from hashlib import md5
 
@@ -25,6 +26,8 @@ class FlickrAPISearch(requests.Session, SearchClient):
     https://www.flickr.com/help/forum/
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(FlickrAPISearch, self).__init__()
 
@@ -66,7 +69,7 @@ class FlickrAPISearch(requests.Session, SearchClient):
                 full_url = full_url + key + '=' + str(value) + '&'
             full_url = full_url[: len(full_url)-1] # remove last '&'
 
-            resp = self.get(full_url) # This only works with the full URL. It no longer works specifying the parameters in a separate variable.
+            resp = self._rate_limited_get(full_url) # This only works with the full URL. It no longer works specifying the parameters in a separate variable.
             resp.raise_for_status()
 
             # extract list of results from response
@@ -77,7 +80,8 @@ class FlickrAPISearch(requests.Session, SearchClient):
         except requests.exceptions.RequestException:
             return []
 
-    def __flickr_results_to_results(self, results, size=None):
+    def _convert_results(self, results, size):
+        size = self._size_to_native_size(size)
         if size:
             size = '_%s' % size
         flickr_api_img_url = 'http://farm%s.staticflickr.com/%s/%s_%s%s.jpg'
@@ -89,10 +93,7 @@ class FlickrAPISearch(requests.Session, SearchClient):
                  'image_id': md5(item['id']).hexdigest(),
                  'title': item['title']} for item in results]
 
-    def query(self, query, size='medium', style='photo', num_results=100):
-        # prepare query parameters
-        size = self._size_to_native_size(size)
-
+    def _query_params(self, size, style):
         # prepare auxilary parameter list
         aux_params = {'method': FLICKR_API_METHOD,
                       'api_key': FLICKR_API_KEY,
@@ -101,9 +102,9 @@ class FlickrAPISearch(requests.Session, SearchClient):
                       'sort': 'relevance',
                       'content_type': 1} # just photos, 'style' parameter would be ignored
 
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params)
+        return aux_params, {}
 
-        return self.__flickr_results_to_results(results, size)
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
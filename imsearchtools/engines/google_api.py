@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gevent
 import requests
 from hashlib import md5
 
@@ -26,6 +27,8 @@ class GoogleAPISearch(requests.Session, SearchClient):
        there is no way to search the web without specifying a list of custom URLs **
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(GoogleAPISearch, self).__init__()
 
@@ -59,8 +62,8 @@ class GoogleAPISearch(requests.Session, SearchClient):
             aux_params['start'] = result_offset + 1
             aux_params['num'] = req_result_count
 
-            resp = self.get(GOOGLE_API_ENTRY + GOOGLE_API_FUNC,
-                            params=aux_params, headers=headers)
+            resp = self._rate_limited_get(GOOGLE_API_ENTRY + GOOGLE_API_FUNC,
+                                          params=aux_params, headers=headers)
             resp.raise_for_status()
 
             # extract list of results from response
@@ -71,16 +74,12 @@ class GoogleAPISearch(requests.Session, SearchClient):
         except requests.exceptions.RequestException:
             return []
 
-    def __google_results_to_results(self, results):
+    def _convert_results(self, results, size):
         return [{'url': item['link'],
                  'image_id': md5(item['link']).hexdigest(),
                  'title': item['title']} for item in results]
 
-    def query(self, query, size='medium', style='photo', num_results=100):
-        # check input
-        if num_results > 100:
-            raise ValueError('Google API currently allows for a maximum of 100 results to be returend')
-
+    def _query_params(self, size, style):
         # prepare query parameters
         size = self._size_to_native_size(size)
         style = self._style_to_native_style(style)
@@ -94,9 +93,13 @@ class GoogleAPISearch(requests.Session, SearchClient):
         if style:
             aux_params['imgType'] = style
 
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params)
+        return aux_params, {}
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        # check input
+        if num_results > 100:
+            raise ValueError('Google API currently allows for a maximum of 100 results to be returend')
 
-        return self.__google_results_to_results(results)
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
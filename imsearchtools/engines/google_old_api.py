@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import gevent
 import requests
 from hashlib import md5
 
@@ -22,6 +23,8 @@ class GoogleOldAPISearch(requests.Session, SearchClient):
     ** NOTE: As of 26 May 2011 the Image Search API has been deprecated **
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(GoogleOldAPISearch, self).__init__()
 
@@ -55,8 +58,8 @@ class GoogleOldAPISearch(requests.Session, SearchClient):
             aux_params['start'] = result_offset
             aux_params['rsz'] = req_result_count
 
-            resp = self.get(GOOGLE_OLD_API_ENTRY + GOOGLE_OLD_API_FUNC,
-                            params=aux_params, headers=headers)
+            resp = self._rate_limited_get(GOOGLE_OLD_API_ENTRY + GOOGLE_OLD_API_FUNC,
+                                          params=aux_params, headers=headers)
 
             # extract list of results from response
             result_dict = resp.json()
@@ -66,16 +69,12 @@ class GoogleOldAPISearch(requests.Session, SearchClient):
         except requests.exceptions.RequestException:
             return []
 
-    def __google_results_to_results(self, results):
+    def _convert_results(self, results, size):
         return [{'url': item['unescapedUrl'],
                  'image_id': md5(item['imageId']).hexdigest(),
                  'title': item['titleNoFormatting']} for item in results]
 
-    def query(self, query, size='medium', style='photo', num_results=64):
-        # check input
-        if num_results > 64:
-            raise ValueError('Google API currently allows for a maximum of 64 results to be returend')
-
+    def _query_params(self, size, style):
         # prepare query parameters
         size = self._size_to_native_size(size)
         style = self._style_to_native_style(style)
@@ -88,12 +87,13 @@ class GoogleOldAPISearch(requests.Session, SearchClient):
         if style:
             aux_params['imgtype'] = style
 
-        # prepare output
-        results = []
+        return aux_params, {}
 
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params)
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=64, deadline=None,
+              spawn=gevent.spawn):
+        # check input
+        if num_results > 64:
+            raise ValueError('Google API currently allows for a maximum of 64 results to be returend')
 
-        return self.__google_results_to_results(results)
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
+import re
 import math
 from hashlib import md5
+from itertools import islice
+import gevent
 import requests
-from .search_client import SearchClient
+from .search_client import SearchClient, cached_query
 
 ## Engine Configuration
 #  --------------------------------------------
@@ -11,6 +14,26 @@ from .search_client import SearchClient
 GOOGLE_WEB_ENTRY = 'https://www.google.com/'
 GOOGLE_WEB_FUNC = 'search'
 
+# image URLs are embedded in the result page as the first item of JS arrays,
+# e.g. ["https://example.com/image.jpg",600,800] - the URL runs up to the next
+# quote and its extension is whatever follows the last '.' before that quote
+IMAGE_URL_PATTERN = re.compile(r'\["(http[^"]*\.([^".]*))"')
+
+## Result Page Parsing
+#  --------------------------------------------
+
+def iter_image_urls(page_text, acceptable_extensions):
+    """Yield (url, name) tuples for all image URLs in a result page
+
+    Scans `page_text` once, yielding URLs in the order they appear in the page
+    whose extension is in `acceptable_extensions`. The name is the last
+    component of the URL path.
+    """
+    for match in IMAGE_URL_PATTERN.finditer(page_text):
+        if match.group(2) in acceptable_extensions:
+            url = match.group(1)
+            yield url, url.rsplit('/', 1)[-1]
+
 ## Search Class
 #  --------------------------------------------
 
@@ -23,6 +46,8 @@ class GoogleWebSearch(requests.Session, SearchClient):
     web search pages (acting as Firefox).
     """
 
+    paged_fetching = True
+
     def __init__(self, async_query=True, timeout=5.0, **kwargs):
         super(GoogleWebSearch, self).__init__()
 
@@ -60,28 +85,14 @@ class GoogleWebSearch(requests.Session, SearchClient):
             # can hack it with a 'CONSENT' cookie set to 'YES+' (see
             # https://gitlab.com/vgg/vgg_frontend/-/issues/28 and
             # https://stackoverflow.com/questions/70560247/)
-            resp = self.get(GOOGLE_WEB_ENTRY + GOOGLE_WEB_FUNC,
-                            params=aux_params, headers=headers,
-                            cookies={'CONSENT' : 'YES+'})
-            resp_str = resp.text
-
-            html = resp_str.split('["')
-            image_data = []
-            for item in html:
-                if item.startswith('http') and item.split('"')[0].split('.')[-1] in self.acceptable_extensions:
-                    url = item.split('"')[0]
-                    name = url.rsplit('/', 1)[-1]
-                    if url and name:
-                        image_data.append((url, name))
-
-            # modify returned results list according to input params
-            # (if necessary)
-            if page_offset >= len(image_data):
-                image_data = []
-            else:
-                image_data = image_data[page_offset:]
-            if num_results > 0 and len(image_data) > num_results:
-                image_data = image_data[:num_results]
+            resp = self._rate_limited_get(GOOGLE_WEB_ENTRY + GOOGLE_WEB_FUNC,
+                                          params=aux_params, headers=headers,
+                                          cookies={'CONSENT' : 'YES+'})
+
+            # only parse as much of the page as required by the input params
+            page_end = page_offset + num_results if num_results > 0 else None
+            image_data = list(islice(iter_image_urls(resp.text, self.acceptable_extensions),
+                                     page_offset, page_end))
 
             # package for output
             resp_dict = [{'url': item[0],
@@ -92,7 +103,7 @@ class GoogleWebSearch(requests.Session, SearchClient):
         except requests.exceptions.RequestException:
             return []
 
-    def query(self, query, size='medium', style='photo', num_results=100):
+    def _query_params(self, size, style):
         # prepare query parameters
         size = self._size_to_native_size(size)
         style = self._style_to_native_style(style)
@@ -110,10 +121,13 @@ class GoogleWebSearch(requests.Session, SearchClient):
 
         headers = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:58.0) Gecko/20100101 Firefox/58.0'}
 
-        # do request
-        results = self._fetch_results(query,
-                                      num_results,
-                                      aux_params=aux_params,
-                                      headers=headers)
+        return aux_params, headers
 
+    def _convert_results(self, results, size):
+        # results are packaged for output by _fetch_results_from_offset
         return results
+
+    @cached_query
+    def query(self, query, size='medium', style='photo', num_results=100, deadline=None,
+              spawn=gevent.spawn):
+        return self._query(query, size, style, num_results, deadline=deadline, spawn=spawn)
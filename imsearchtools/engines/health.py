@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+import time
+import logging
+from collections import deque
+
+import gevent
+
+from .search_client import QueryException, split_cached_query
+
+log = logging.getLogger(__name__)
+
+## Health Configuration
+#  --------------------------------------------
+
+# number of recent queries (no older than HEALTH_WINDOW_SECONDS) over which
+# the latency, error rate and empty result rate of each engine are computed
+HEALTH_WINDOW = 50
+HEALTH_WINDOW_SECONDS = 300.0
+
+# the circuit breaker of an engine opens when, over at least
+# MIN_SAMPLES queries of the window, any of the following is exceeded
+MIN_SAMPLES = 10
+MAX_ERROR_RATE = 0.5        # failed or timed out queries
+MAX_EMPTY_RATE = 0.8        # queries returning no results
+MAX_MEAN_LATENCY = 10.0     # seconds
+
+# time an open circuit rejects queries before a single trial query is let
+# through (half-open) to check whether the engine has recovered
+OPEN_SECONDS = 30.0
+
+# possible outcomes of a query
+OUTCOME_OK = 'ok'
+OUTCOME_EMPTY = 'empty'
+OUTCOME_ERROR = 'error'
+OUTCOME_TIMEOUT = 'timeout'
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+class EngineUnavailable(QueryException):
+    pass
+
+## Engine Health Class
+#  --------------------------------------------
+
+class EngineHealth(object):
+    """
+    Rolling health statistics and circuit breaker for a single engine
+
+    The outcome and latency of each query should be reported by calling
+    `record()`. While the circuit is closed all queries are allowed; once the
+    error rate (failures and timeouts), empty result rate or mean latency over
+    the window crosses its threshold the circuit opens and `allow_request()`
+    returns False for `open_seconds`. After that a single trial query is
+    allowed (half-open): if it succeeds the circuit closes again with a fresh
+    window, otherwise it reopens.
+    """
+
+    def __init__(self, name='', window=HEALTH_WINDOW, window_seconds=HEALTH_WINDOW_SECONDS,
+                 min_samples=MIN_SAMPLES, max_error_rate=MAX_ERROR_RATE,
+                 max_empty_rate=MAX_EMPTY_RATE, max_mean_latency=MAX_MEAN_LATENCY,
+                 open_seconds=OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.max_empty_rate = max_empty_rate
+        self.max_mean_latency = max_mean_latency
+        self.open_seconds = open_seconds
+
+        self._samples = deque(maxlen=window)  # (time, latency, outcome)
+        self.state = STATE_CLOSED
+        self.open_count = 0
+        self.rejected_count = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+
+    def allow_request(self):
+        if self.state == STATE_OPEN:
+            if time.time() - self._opened_at < self.open_seconds:
+                self.rejected_count = self.rejected_count + 1
+                return False
+            self.state = STATE_HALF_OPEN
+        if self.state == STATE_HALF_OPEN:
+            if self._trial_in_progress:
+                self.rejected_count = self.rejected_count + 1
+                return False
+            self._trial_in_progress = True
+        return True
+
+    def abandon(self):
+        # a query was allowed but its outcome says nothing about the engine
+        # (e.g. invalid arguments), so let another trial query through
+        self._trial_in_progress = False
+
+    def record(self, latency, outcome):
+        now = time.time()
+        self._samples.append((now, latency, outcome))
+
+        if self.state == STATE_HALF_OPEN:
+            self._trial_in_progress = False
+            if outcome == OUTCOME_OK:
+                log.info('Circuit of %s closed again after successful trial query', self.name)
+                self.state = STATE_CLOSED
+                self._samples.clear()
+            else:
+                self._open(now)
+        elif self.state == STATE_CLOSED:
+            reason = self._threshold_crossed(now)
+            if reason:
+                log.info('Circuit of %s opened (%s)', self.name, reason)
+                self._open(now)
+
+    def stats(self):
+        samples = self._window(time.time())
+        count = len(samples)
+        stats = dict(state=self.state,
+                     samples=count,
+                     open_count=self.open_count,
+                     rejected_count=self.rejected_count,
+                     error_rate=None, empty_rate=None,
+                     mean_latency=None, max_latency=None)
+        if count:
+            latencies = [latency for _, latency, _ in samples]
+            stats['error_rate'] = self._rate(samples, (OUTCOME_ERROR, OUTCOME_TIMEOUT))
+            stats['empty_rate'] = self._rate(samples, (OUTCOME_EMPTY,))
+            stats['mean_latency'] = sum(latencies)/count
+            stats['max_latency'] = max(latencies)
+        return stats
+
+    def _open(self, now):
+        self.state = STATE_OPEN
+        self._opened_at = now
+        self.open_count = self.open_count + 1
+
+    def _window(self, now):
+        return [sample for sample in self._samples
+                if now - sample[0] <= self.window_seconds]
+
+    @staticmethod
+    def _rate(samples, outcomes):
+        return sum(1 for sample in samples if sample[2] in outcomes)/float(len(samples))
+
+    def _threshold_crossed(self, now):
+        samples = self._window(now)
+        if len(samples) < self.min_samples:
+            return None
+        error_rate = self._rate(samples, (OUTCOME_ERROR, OUTCOME_TIMEOUT))
+        if error_rate > self.max_error_rate:
+            return 'error rate %.2f' % error_rate
+        empty_rate = self._rate(samples, (OUTCOME_EMPTY,))
+        if empty_rate > self.max_empty_rate:
+            return 'empty result rate %.2f' % empty_rate
+        mean_latency = sum(sample[1] for sample in samples)/len(samples)
+        if mean_latency > self.max_mean_latency:
+            return 'mean latency %.1fs' % mean_latency
+        return None
+
+## Process-wide Scoreboard
+#  --------------------------------------------
+
+_engine_health = {}
+
+def get_engine_health(engine_name):
+    """Return the health tracker shared by all searchers of engine `engine_name`"""
+    tracker = _engine_health.get(engine_name)
+    if tracker is None:
+        tracker = EngineHealth(engine_name)
+        _engine_health[engine_name] = tracker
+    return tracker
+
+def reset_engine_health():
+    _engine_health.clear()
+
+def scoreboard():
+    """Return a dict mapping each engine name to its current health statistics"""
+    return dict((engine_name, tracker.stats())
+                for engine_name, tracker in _engine_health.items())
+
+def query_outcome(results):
+    """Classify the (successfully returned) results of a query"""
+    return _outcome(len(results), getattr(results, 'partial', False))
+
+def _outcome(result_count, partial):
+    # (results cut short by the timeout or the deadline of the caller are
+    # recorded as a timeout, whether they were returned at once or streamed)
+    if not result_count:
+        return OUTCOME_EMPTY
+    if partial:
+        return OUTCOME_TIMEOUT
+    return OUTCOME_OK
+
+## Tracked Queries
+#  --------------------------------------------
+
+def _allow_request(engine_name):
+    tracker = get_engine_health(engine_name)
+    if not tracker.allow_request():
+        raise EngineUnavailable('Circuit breaker of %s is open' % engine_name)
+    return tracker
+
+def tracked_query(searcher, query, deadline=None, **query_params):
+    """Call `searcher.query`, recording its outcome in the scoreboard
+
+    Raises EngineUnavailable without querying the engine if its circuit
+    breaker is open. Results in the result cache of the searcher are returned
+    (even while the circuit is open) without being recorded, as they say
+    nothing about the engine.
+    """
+    cached_results, query_engine = split_cached_query(searcher, query, deadline=deadline,
+                                                      **query_params)
+    if cached_results is not None:
+        return cached_results
+    engine_name = searcher.__class__.__name__
+    tracker = _allow_request(engine_name)
+    start_time = time.time()
+    try:
+        results = query_engine()
+    except ValueError:
+        tracker.abandon()
+        raise
+    except gevent.GreenletExit:
+        # killed by the caller after its timeout
+        tracker.record(time.time() - start_time, OUTCOME_TIMEOUT)
+        raise
+    except BaseException:
+        tracker.record(time.time() - start_time, OUTCOME_ERROR)
+        raise
+    tracker.record(time.time() - start_time, query_outcome(results))
+    return results
+
+def tracked_iter_query(searcher, query, deadline=None, status=None, **query_params):
+    """Return `searcher.iter_query(...)`, recording its outcome in the scoreboard
+
+    The circuit breaker is checked immediately (raising EngineUnavailable if
+    it is open) rather than when the first result is requested. As for
+    `tracked_query`, cached results are returned without being recorded.
+    Streams cut short by the timeout or `deadline` (including streams closed
+    by the caller once `deadline` expired) are recorded as timeouts.
+    """
+    if status is None:
+        status = {}
+    split_iter_query = getattr(searcher, 'split_cached_iter_query', None)
+    if split_iter_query is not None:
+        cached_results, iter_engine = split_iter_query(query, deadline=deadline, status=status,
+                                                       **query_params)
+    else:
+        cached_results = None
+        iter_engine = lambda: searcher.iter_query(query, deadline=deadline, status=status,
+                                                  **query_params)
+    if cached_results is not None:
+        return iter(cached_results)
+    tracker = _allow_request(searcher.__class__.__name__)
+    return _tracked_iter(tracker, iter_engine(), status, deadline)
+
+def _tracked_iter(tracker, result_iter, status, deadline):
+    start_time = time.time()
+    result_count = 0
+    try:
+        for item in result_iter:
+            result_count = result_count + 1
+            yield item
+    except ValueError:
+        tracker.abandon()
+        raise
+    except GeneratorExit:
+        if deadline is not None and deadline.expired():
+            tracker.record(time.time() - start_time, OUTCOME_TIMEOUT)
+        else:
+            # the consumer stopped early
+            tracker.abandon()
+        raise
+    except BaseException:
+        tracker.record(time.time() - start_time, OUTCOME_ERROR)
+        raise
+    tracker.record(time.time() - start_time,
+                   _outcome(result_count, status.get('partial', False)))
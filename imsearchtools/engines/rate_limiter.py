@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import time
+import random
+import logging
+from email.utils import parsedate_to_datetime
+
+import gevent
+
+log = logging.getLogger(__name__)
+
+## Rate Limit Configuration
+#  --------------------------------------------
+
+# maximum sustained requests per second and burst size for each engine,
+# keyed by the name of the search client class
+RATE_LIMITS = {'GoogleWebSearch': (5.0, 10),
+               'BingAPISearchV5': (3.0, 3),
+               'GoogleAPISearch': (10.0, 10),
+               'FlickrAPISearch': (1.0, 5)}
+DEFAULT_RATE_LIMIT = (10.0, 10)
+
+# HTTP status codes signalling that the engine is throttling requests
+THROTTLE_STATUS_CODES = (429, 503)
+
+# retries of throttled requests, using jittered exponential backoff
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Retry-After delays longer than this (in seconds) are shortened to it, so
+# that a single response cannot block an engine for the whole process for long
+MAX_RETRY_AFTER = 60.0
+
+class RateLimitTimeout(Exception):
+    pass
+
+## Rate Limiter Class
+#  --------------------------------------------
+
+class RateLimiter(object):
+    """
+    Adaptive token bucket rate limiter for gevent greenlets
+
+    Tokens are added to the bucket at `rate` tokens per second, up to a
+    maximum of `burst` tokens, and `acquire()` blocks the calling greenlet
+    until a token is available.
+
+    When a request is throttled by the server `on_throttle()` should be
+    called, which halves the current rate (down to 1/16 of the configured
+    rate) and, if the server specified a Retry-After delay (of at most
+    MAX_RETRY_AFTER seconds), blocks all requests until it has passed. Each
+    successful request reported through `on_success()` then increases the
+    rate again towards the configured one.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate/16.0
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.throttle_count = 0
+        self._last_refill = time.time()
+        self._blocked_until = 0.0
+
+    def acquire(self, timeout=None):
+        """Wait for a token, raising RateLimitTimeout at once if it would take
+        longer than `timeout` seconds (None or negative for no limit)"""
+        end_time = None if timeout is None or timeout < 0 else time.time() + timeout
+        while True:
+            now = time.time()
+            if now < self._blocked_until:
+                delay = self._blocked_until - now
+            else:
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens = self.tokens - 1.0
+                    return
+                delay = (1.0 - self.tokens)/self.rate
+            if end_time is not None and now + delay > end_time:
+                raise RateLimitTimeout('No request allowed within %.1fs' % timeout)
+            gevent.sleep(delay)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate/16.0)
+
+    def on_throttle(self, retry_after=None):
+        self.throttle_count = self.throttle_count + 1
+        self._refill(time.time())
+        self.rate = max(self.min_rate, self.rate/2.0)
+        self.tokens = 0.0
+        if retry_after:
+            retry_after = min(retry_after, MAX_RETRY_AFTER)
+            self._blocked_until = max(self._blocked_until, time.time() + retry_after)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.tokens = min(float(self.burst), self.tokens + elapsed*self.rate)
+
+## Process-wide Rate Limiters
+#  --------------------------------------------
+
+_rate_limiters = {}
+
+def get_rate_limiter(engine_name):
+    """Return the rate limiter shared by all searchers of engine `engine_name`"""
+    limiter = _rate_limiters.get(engine_name)
+    if limiter is None:
+        rate, burst = RATE_LIMITS.get(engine_name, DEFAULT_RATE_LIMIT)
+        limiter = RateLimiter(rate, burst)
+        _rate_limiters[engine_name] = limiter
+    return limiter
+
+def set_rate_limit(engine_name, rate, burst=1):
+    """Configure the rate limit of engine `engine_name` for the whole process"""
+    RATE_LIMITS[engine_name] = (rate, burst)
+    _rate_limiters[engine_name] = RateLimiter(rate, burst)
+
+def parse_retry_after(value):
+    """Parse the value of a Retry-After header to a delay in seconds (or None)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+def backoff_delay(attempt):
+    """Delay before retry number `attempt` (from 0) using full jitter"""
+    return random.uniform(0.0, min(BACKOFF_MAX, BACKOFF_BASE*(2**attempt)))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import time
+import json
+import logging
+from hashlib import md5
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+## Cache Configuration
+#  --------------------------------------------
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_DISK_ENTRIES = 10000
+
+## Cache Class
+#  --------------------------------------------
+
+class ResultCache(object):
+    """
+    Two-tier cache for the result lists returned by `SearchClient.query`.
+
+    Results are kept in an in-memory LRU tier of at most `max_entries` entries
+    and, if `disk_dir` is specified, also in an on-disk tier of at most
+    `max_disk_entries` JSON files which survives restarts of the process.
+
+    Entries expire after a time-to-live which can be set per engine (using
+    the name of the search client class as key) through `engine_ttls`,
+    falling back to `default_ttl` for engines not listed.
+
+    The number of hits (in memory and on disk), misses and evictions is
+    counted and can be retrieved by calling `stats()`.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL,
+                 engine_ttls=None, disk_dir=None,
+                 max_disk_entries=DEFAULT_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.engine_ttls = dict(engine_ttls) if engine_ttls else {}
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+
+        self._entries = OrderedDict()  # key -> (expiry time, results)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # the directory of the disk tier is only created on the first write
+        self._disk_entry_count = 0
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            self._disk_entry_count = len(self._list_disk_entries())
+
+    @staticmethod
+    def make_key(engine, query, size, style, num_results):
+        return (engine, query, size, style, num_results)
+
+    def ttl_for(self, engine):
+        return self.engine_ttls.get(engine, self.default_ttl)
+
+    def get(self, key):
+        """Return a copy of the cached results for `key`, or None on a miss"""
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expiry, results = entry
+            if expiry > now:
+                self._entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return self._copy_results(results)
+            del self._entries[key]
+
+        if self.disk_dir:
+            entry = self._read_disk_entry(key)
+            if entry is not None and entry[0] > now:
+                self._set_memory_entry(key, entry[0], entry[1])
+                self.disk_hits = self.disk_hits + 1
+                return self._copy_results(entry[1])
+
+        self.misses = self.misses + 1
+        return None
+
+    def set(self, key, results):
+        ttl = self.ttl_for(key[0])
+        if ttl <= 0:
+            return
+        expiry = time.time() + ttl
+        results = self._copy_results(results)
+        self._set_memory_entry(key, expiry, results)
+        if self.disk_dir:
+            self._write_disk_entry(key, expiry, results)
+
+    def clear(self):
+        self._entries.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for fn in self._list_disk_entries():
+                self._remove_disk_file(fn)
+            self._disk_entry_count = 0
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    disk_hits=self.disk_hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    memory_entries=len(self._entries),
+                    disk_entries=self._disk_entry_count)
+
+    # Memory tier
+    def _set_memory_entry(self, key, expiry, results):
+        self._entries[key] = (expiry, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    @staticmethod
+    def _copy_results(results):
+        # result dicts are updated in place further down the pipeline
+        # (e.g. by ImageGetter.process_url) so never hand out cached ones
+        return [dict(item) for item in results]
+
+    # Disk tier
+    def _disk_fn_from_key(self, key):
+        key_str = json.dumps(list(key))
+        return os.path.join(self.disk_dir,
+                            md5(key_str.encode('utf-8')).hexdigest() + '.json')
+
+    def _list_disk_entries(self):
+        return [os.path.join(self.disk_dir, fn)
+                for fn in os.listdir(self.disk_dir) if fn.endswith('.json')]
+
+    def _read_disk_entry(self, key):
+        fn = self._disk_fn_from_key(key)
+        try:
+            with open(fn) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # guard against (unlikely) hash collisions
+        if entry.get('key') != list(key):
+            return None
+        if entry['expiry'] <= time.time():
+            self._remove_disk_file(fn)
+            self._disk_entry_count = max(0, self._disk_entry_count - 1)
+            return None
+        return entry['expiry'], entry['results']
+
+    def _write_disk_entry(self, key, expiry, results):
+        fn = self._disk_fn_from_key(key)
+        tmp_fn = fn + '.tmp'
+        is_new = not os.path.exists(fn)
+        try:
+            if not os.path.isdir(self.disk_dir):
+                os.makedirs(self.disk_dir)
+            with open(tmp_fn, 'w') as f:
+                json.dump({'key': list(key), 'expiry': expiry, 'results': results}, f)
+            os.replace(tmp_fn, fn)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            log.info('Could not write query cache entry %s (%s)', fn, str(e))
+            self._remove_disk_file(tmp_fn)
+            return
+        if is_new:
+            self._disk_entry_count = self._disk_entry_count + 1
+            if self._disk_entry_count > self.max_disk_entries:
+                self._prune_disk_entries()
+
+    def _prune_disk_entries(self):
+        # remove the least recently written entries, leaving some slack so that
+        # the directory is not listed again on every subsequent write
+        entries = []
+        for fn in self._list_disk_entries():
+            try:
+                entries.append((os.path.getmtime(fn), fn))
+            except OSError:
+                pass
+        entries.sort()
+        keep_count = int(self.max_disk_entries * 0.9)
+        remove_count = max(0, len(entries) - keep_count)
+        for _, fn in entries[:remove_count]:
+            self._remove_disk_file(fn)
+        self.evictions = self.evictions + remove_count
+        self._disk_entry_count = len(entries) - remove_count
+
+    @staticmethod
+    def _remove_disk_file(fn):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
@@ -1,13 +1,76 @@
 #!/usr/bin/env python
 
+import inspect
+import logging
+import functools
 import gevent
 
+from . import rate_limiter
+from imsearchtools.utils.deadline import ResultList, time_left
+
+log = logging.getLogger(__name__)
+
 class QueryException(Exception):
     pass
 
 class NoAPICredentials(Exception):
     pass
 
+## Query Caching
+#  --------------------------------------------
+
+def cached_query(query_func):
+    """Decorator for the `query` method of SearchClient subclasses
+
+    If the instance has a `result_cache` (see result_cache.ResultCache) then
+    results are looked up there before querying the engine, using the name
+    of the class along with the query, size, style and number of results as
+    the key. Only successful queries which returned all their results
+    (i.e. without running out of time) are stored.
+    """
+    @functools.wraps(query_func)
+    def wrapper(self, *args, **kwargs):
+        results, query_engine = _split_cached_query(self, query_func, args, kwargs)
+        if results is None:
+            results = query_engine()
+        return results
+
+    wrapper.uncached_query = query_func
+    return wrapper
+
+def split_cached_query(searcher, *args, **kwargs):
+    """Look up a call to `searcher.query(*args, **kwargs)` in the result cache
+
+    Returns a tuple (results, query_engine), where results are the cached
+    results (or None if the query is not cached, or `query` is not a
+    cached_query), and query_engine() queries the engine without looking up
+    the cache again, adding its results to the cache. This lets callers tell
+    cache hits from queries which reach the engine (see health.tracked_query).
+    """
+    query_func = getattr(type(searcher).query, 'uncached_query', None)
+    if query_func is None:
+        return None, lambda: searcher.query(*args, **kwargs)
+    return _split_cached_query(searcher, query_func, args, kwargs)
+
+def _split_cached_query(searcher, query_func, args, kwargs):
+    cache = getattr(searcher, 'result_cache', None)
+    if cache is None:
+        return None, lambda: query_func(searcher, *args, **kwargs)
+
+    bound_args = inspect.signature(query_func).bind(searcher, *args, **kwargs)
+    bound_args.apply_defaults()
+    prms = bound_args.arguments
+    key = cache.make_key(searcher.__class__.__name__, prms['query'],
+                         prms['size'], prms['style'], prms['num_results'])
+
+    def query_engine():
+        results = query_func(searcher, *args, **kwargs)
+        if not getattr(results, 'partial', False):
+            cache.set(key, results)
+        return results
+
+    return cache.get(key), query_engine
+
 ## Search Classes
 #  --------------------------------------------
 
@@ -29,14 +92,37 @@ class SearchClient(object):
           make queries asynchronously or not
      + timeout (Float)
           timeout in seconds for HTTP requests
+     + result_cache (ResultCache)
+          optional cache of query results (None by default), used when the
+          subclass decorates its `query` method with `cached_query`
+     + paged_fetching (Bool)
+          set to True by subclasses which implement `_query_params` and
+          `_convert_results` below, and so support `iter_query` and `_query`
     METHODS:
      + def _fetch_results_from_offset(self, query, result_offset,
                                       aux_params={}, headers={},
                                       num_results=-1)
           this method should return a set of results given an offset from the
           first result and a count of results to return
+     + def _query_params(self, size, style)
+          this method should return a tuple (aux_params, headers) of the
+          parameters/headers to use in all requests for a query
+     + def _convert_results(self, results, size)
+          this method should convert a list of raw results returned from
+          `_fetch_results_from_offset` to the list of result dicts returned
+          from `query`
+
+    The `query` method of subclasses should accept an optional `deadline`
+    (see imsearchtools.utils.deadline) which, if specified, further limits
+    the time taken by the query, in which case a ResultList is returned with
+    its `partial` flag set if not all requests completed in time. The `query`
+    method of clients with `paged_fetching` should also accept a `spawn`
+    function (see `_fetch_results`), e.g. to run requests in a bounded pool.
     """
 
+    result_cache = None
+    paged_fetching = False
+
     @property
     def supported_sizes(self):
         return self._supported_sizes_map.keys()
@@ -65,9 +151,45 @@ class SearchClient(object):
 
         return self._supported_styles_map[style]
 
+    def _rate_limited_get(self, url, **kwargs):
+        """Make a GET request through the rate limiter shared by the engine
+
+        Requests which are throttled by the server (see
+        rate_limiter.THROTTLE_STATUS_CODES) are retried up to
+        rate_limiter.MAX_RETRIES times with jittered exponential backoff,
+        honouring any Retry-After header. The response of the last attempt is
+        returned. Requires the subclass to also derive from requests.Session.
+
+        Raises QueryException instead of waiting for the rate limiter (e.g.
+        after a long Retry-After) past the `timeout` of the client, after
+        which the requests of a query are abandoned anyway.
+        """
+        limiter = rate_limiter.get_rate_limiter(self.__class__.__name__)
+        attempt = 0
+        while True:
+            try:
+                limiter.acquire(self.timeout)
+            except rate_limiter.RateLimitTimeout as e:
+                raise QueryException('%s is rate limited (%s)' % (self.__class__.__name__, str(e)))
+            resp = self.get(url, **kwargs)
+            if resp.status_code not in rate_limiter.THROTTLE_STATUS_CODES:
+                limiter.on_success()
+                return resp
+
+            retry_after = rate_limiter.parse_retry_after(resp.headers.get('Retry-After'))
+            limiter.on_throttle(retry_after)
+            if attempt >= rate_limiter.MAX_RETRIES:
+                return resp
+            log.info('%s throttled with status %d, retrying (attempt %d)',
+                     self.__class__.__name__, resp.status_code, attempt + 1)
+            gevent.sleep(rate_limiter.backoff_delay(attempt))
+            attempt = attempt + 1
+
     def _fetch_results(self, query, num_results,
                        aux_params={},
-                       headers={}):
+                       headers={},
+                       deadline=None,
+                       spawn=gevent.spawn):
         """Routine for fetching results from server using multiple requests.
 
         Parameters:
@@ -81,26 +203,46 @@ class SearchClient(object):
                 func(self, query, result_offset[, num_results, aux_params, headers])
         - [aux_params, headers]
             optional parameter/header arguments
+        - [deadline]
+            optional Deadline by which all requests should have completed
+            (in addition to `timeout`)
+        - [spawn]
+            function used to spawn the greenlet of each request when querying
+            asynchronously (e.g. to run them in a bounded pool). It may block
+            until the request can be run, in which case the time waiting
+            counts towards `timeout`.
+
+        When querying asynchronously, requests which are still running (or
+        were not spawned yet) after `timeout` are killed, and the results
+        are flagged as partial.
         """
         if self.async_query:
-            jobs = [gevent.spawn(self._fetch_results_from_offset,
-                                 query, result_offset,
-                                 aux_params=aux_params,
-                                 headers=headers,
-                                 num_results=num_results)
-                    for result_offset in range(0, num_results, self._results_per_req)]
+            offsets = range(0, num_results, self._results_per_req)
+            jobs = []
+            with gevent.Timeout(time_left(deadline, self.timeout), False):
+                for result_offset in offsets:
+                    jobs.append(spawn(self._fetch_results_from_offset,
+                                      query, result_offset,
+                                      aux_params=aux_params,
+                                      headers=headers,
+                                      num_results=num_results))
+                gevent.joinall(jobs)
 
-            gevent.joinall(jobs, timeout=self.timeout)
-
-            results = []
+            results = ResultList(partial=(len(jobs) < len(offsets)))
 
             for job in jobs:
                 if job.value:
                     results.extend(job.value)
+                elif not job.ready():
+                    results.partial = True
+            gevent.killall([job for job in jobs if not job.ready()], block=False)
         else:
-            results = []
+            results = ResultList()
 
             for result_offset in range(0, num_results, self._results_per_req):
+                if deadline is not None and deadline.expired():
+                    results.partial = True
+                    break
                 results.extend(self._fetch_results_from_offset(query,
                                                                result_offset,
                                                                aux_params=aux_params,
@@ -111,3 +253,137 @@ class SearchClient(object):
             raise QueryException("No image URLs could be retrieved")
 
         return results
+
+    def _iter_fetch_results(self, query, num_results,
+                            aux_params={},
+                            headers={},
+                            deadline=None):
+        """Generator form of `_fetch_results`
+
+        Yields tuples (result_offset, results) for each request made to the
+        server as soon as it completes, even if it returned no results (so
+        when querying asynchronously these are yielded in order of completion
+        rather than in order of offset). Requests which do not complete within `timeout`
+        seconds of the first request being made (or by `deadline`, if
+        specified), or which are still running when the generator is closed,
+        are killed.
+        """
+        offsets = range(0, num_results, self._results_per_req)
+        if self.async_query:
+            jobs = [gevent.spawn(self._fetch_results_from_offset,
+                                 query, result_offset,
+                                 aux_params=aux_params,
+                                 headers=headers,
+                                 num_results=num_results)
+                    for result_offset in offsets]
+            offset_from_job = dict(zip(jobs, offsets))
+
+            try:
+                for job in gevent.iwait(jobs, timeout=time_left(deadline, self.timeout)):
+                    yield offset_from_job[job], job.value or []
+            finally:
+                gevent.killall([job for job in jobs if not job.ready()], block=False)
+        else:
+            for result_offset in offsets:
+                if deadline is not None and deadline.expired():
+                    break
+                results = self._fetch_results_from_offset(query,
+                                                          result_offset,
+                                                          aux_params=aux_params,
+                                                          headers=headers,
+                                                          num_results=num_results)
+                yield result_offset, results
+
+    def _check_paged_fetching(self):
+        if not self.paged_fetching:
+            raise NotImplementedError('%s does not fetch pages of results' %
+                                      self.__class__.__name__)
+
+    def _query(self, query, size, style, num_results, deadline=None, spawn=gevent.spawn):
+        """Common implementation of `query` for subclasses
+
+        Returns a ResultList of result dicts, flagged as partial if some
+        requests did not complete in time. See `_fetch_results` for the
+        `deadline` and `spawn` arguments.
+        """
+        self._check_paged_fetching()
+        aux_params, headers = self._query_params(size, style)
+
+        # do request
+        results = self._fetch_results(query,
+                                      num_results,
+                                      aux_params=aux_params,
+                                      headers=headers,
+                                      deadline=deadline,
+                                      spawn=spawn)
+
+        return ResultList(self._convert_results(results, size), partial=results.partial)
+
+    def iter_query(self, query, size='medium', style='photo', num_results=100,
+                   deadline=None, status=None):
+        """Generator form of `query`
+
+        Yields result dicts of the same form as those returned from `query`
+        as soon as each page of results is retrieved from the server, so
+        that processing of the first results can start before the remaining
+        ones are available. As pages may arrive out of order, a 'rank' field
+        (starting from 1) is added to each result if not already present.
+
+        If the client has a `result_cache` and the query is cached, the cached
+        results are yielded instead. Results are only added to the cache if
+        the generator is run to completion before the timeout (or `deadline`).
+
+        As a generator has no `partial` flag, a dict can be given as `status`
+        instead: once the generator is exhausted, status['partial'] is set if
+        some results were cut short by the timeout or `deadline`.
+        """
+        cached_results, iter_engine = self.split_cached_iter_query(query, size, style,
+                                                                   num_results, deadline,
+                                                                   status)
+        if cached_results is None:
+            cached_results = iter_engine()
+        for item in cached_results:
+            yield item
+
+    def split_cached_iter_query(self, query, size='medium', style='photo', num_results=100,
+                                deadline=None, status=None):
+        """Look up a call to `iter_query` in the result cache
+
+        Returns a tuple (results, iter_engine) as `split_cached_query`, where
+        iter_engine() returns a generator of the results from the engine.
+        """
+        self._check_paged_fetching()
+        key = None
+        cached_results = None
+        if self.result_cache is not None:
+            key = self.result_cache.make_key(self.__class__.__name__, query, size, style,
+                                             num_results)
+            cached_results = self.result_cache.get(key)
+            if cached_results is not None:
+                for index, item in enumerate(cached_results):
+                    item.setdefault('rank', index + 1)
+        return cached_results, lambda: self._iter_query_engine(query, size, style, num_results,
+                                                               deadline, key, status)
+
+    def _iter_query_engine(self, query, size, style, num_results, deadline, key, status):
+        cache = self.result_cache
+        aux_params, headers = self._query_params(size, style)
+        all_results = []
+        page_count = 0
+        for result_offset, results in self._iter_fetch_results(query, num_results,
+                                                               aux_params=aux_params,
+                                                               headers=headers,
+                                                               deadline=deadline):
+            page_count = page_count + 1
+            for index, item in enumerate(self._convert_results(results, size)):
+                item.setdefault('rank', result_offset + index + 1)
+                # keep a copy, as the caller may update yielded dicts in place
+                all_results.append(dict(item))
+                yield item
+
+        all_pages_received = (page_count == len(range(0, num_results, self._results_per_req)))
+        if status is not None:
+            status['partial'] = not all_pages_received
+        if cache is not None and all_results and all_pages_received:
+            all_results.sort(key=lambda item: item['rank'])
+            cache.set(key, all_results)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import logging
+from collections import OrderedDict
+
+import gevent
+import requests
+from requests.adapters import HTTPAdapter
+
+from .search_client import NoAPICredentials
+from . import bing_api_v5
+from . import google_old_api
+from . import google_api
+from . import google_web
+from . import flickr_api
+from .federated import FederatedSearch
+
+log = logging.getLogger(__name__)
+
+## Pool Configuration
+#  --------------------------------------------
+
+# engine name -> (search client class, URL used to pre-connect to the engine)
+ENGINES = {'bing_api': (bing_api_v5.BingAPISearchV5, bing_api_v5.BING_API_ENTRY),
+           'google_old_api': (google_old_api.GoogleOldAPISearch, google_old_api.GOOGLE_OLD_API_ENTRY),
+           'google_api': (google_api.GoogleAPISearch, google_api.GOOGLE_API_ENTRY),
+           'google_web': (google_web.GoogleWebSearch, google_web.GOOGLE_WEB_ENTRY),
+           'flickr_api': (flickr_api.FlickrAPISearch, flickr_api.FLICKR_API_ENTRY)}
+
+# engines queried concurrently when using the 'federated' engine (engines
+# without API credentials are skipped)
+FEDERATED_ENGINES = ['google_web', 'bing_api', 'flickr_api', 'google_api']
+
+# connection pool sizes of each searcher: the number of hosts to keep pools
+# for, and the number of keep-alive connections kept per host (this should
+# cover the number of concurrent page requests made for all queries served)
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+
+PRECONNECT_TIMEOUT = 5.0
+
+# searchers are kept for each engine and timeout, with timeouts rounded to a
+# multiple of TIMEOUT_BUCKET seconds (as they may be chosen by clients), and
+# at most MAX_SEARCHERS kept (least recently used searchers are dropped first)
+TIMEOUT_BUCKET = 0.5
+MAX_SEARCHERS = 32
+
+## Searcher Creation
+#  --------------------------------------------
+
+def make_searcher(engine, timeout=None):
+    """Create a new searcher for `engine` (one of the keys of ENGINES or 'federated')"""
+    searcher_args = dict()
+    if timeout is not None:
+        searcher_args['timeout'] = timeout
+
+    if engine == 'federated':
+        searchers = []
+        for federated_engine in FEDERATED_ENGINES:
+            try:
+                searchers.append(get_searcher(federated_engine, timeout))
+            except NoAPICredentials:
+                pass
+        return FederatedSearch(searchers, **searcher_args)
+
+    if engine not in ENGINES:
+        raise ValueError('Unknown query engine')
+    searcher = ENGINES[engine][0](**searcher_args)
+
+    adapter_args = dict(pool_connections=POOL_CONNECTIONS,
+                        pool_maxsize=POOL_MAXSIZE)
+    searcher.mount('https://', HTTPAdapter(**adapter_args))
+    searcher.mount('http://', HTTPAdapter(**adapter_args))
+    return searcher
+
+## Process-wide Searcher Registry
+#  --------------------------------------------
+
+_searchers = OrderedDict()
+_result_cache = None
+
+def set_result_cache(result_cache):
+    """Use `result_cache` for all current and future searchers in the registry"""
+    global _result_cache
+    _result_cache = result_cache
+    for searcher in _searchers.values():
+        searcher.result_cache = result_cache
+
+def get_searcher(engine, timeout=None):
+    """Return the searcher for `engine` and `timeout` shared by the whole process
+
+    Searchers are created on first use and then reused, so that connections
+    to the engine are kept alive between queries. A searcher can be used by
+    several greenlets at the same time, but should not be modified by them.
+    `timeout` is rounded to a multiple of TIMEOUT_BUCKET.
+    """
+    timeout = bucket_timeout(timeout)
+    key = (engine, timeout)
+    searcher = _searchers.pop(key, None)
+    if searcher is None:
+        searcher = make_searcher(engine, timeout)
+        searcher.result_cache = _result_cache
+        # (dropped searchers are not closed, as they may still be in use -
+        # their connections are closed once they are garbage collected)
+        while len(_searchers) >= MAX_SEARCHERS:
+            _searchers.popitem(last=False)
+    _searchers[key] = searcher
+    return searcher
+
+def bucket_timeout(timeout):
+    """Round `timeout` to the nearest (non-zero) multiple of TIMEOUT_BUCKET"""
+    if timeout is None:
+        return None
+    return max(1, int(round(timeout/TIMEOUT_BUCKET)))*TIMEOUT_BUCKET
+
+def clear_searchers():
+    for searcher in _searchers.values():
+        if isinstance(searcher, requests.Session):
+            searcher.close()
+    _searchers.clear()
+
+def preconnect(engines=None, timeout=None):
+    """Open connections to the hosts of `engines` (default: all) in the background
+
+    Returns the list of greenlets making the connections, which can be
+    joined to wait for them to complete.
+    """
+    if engines is None:
+        engines = list(ENGINES.keys())
+
+    jobs = []
+    for engine in engines:
+        if engine not in ENGINES:
+            continue
+        try:
+            searcher = get_searcher(engine, timeout)
+        except NoAPICredentials:
+            continue
+        jobs.append(gevent.spawn(_preconnect_searcher, searcher, ENGINES[engine][1]))
+    return jobs
+
+def _preconnect_searcher(searcher, url):
+    try:
+        searcher.head(url, timeout=PRECONNECT_TIMEOUT)
+        log.info('Pre-connected to %s', url)
+    except requests.exceptions.RequestException as e:
+        log.info('Could not pre-connect to %s (%s)', url, str(e))
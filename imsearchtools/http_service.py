@@ -2,6 +2,11 @@
 
 import sys
 import logging
+
+# patch the standard library for gevent before anything else opens sockets
+import imsearchtools
+imsearchtools.monkey_patch()
+
 #logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG)
 logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
 
@@ -9,9 +14,10 @@ from flask import Flask, request, Response
 from flask import json
 from gevent.pywsgi import WSGIServer
 from . import http_service_helper
+from .utils.deadline import Deadline
 
 DEFAULT_SERVER_PORT = 8157
-SUPPORTED_ENGINES = ['bing_api', 'google_api', 'google_web', 'flickr_api']
+SUPPORTED_ENGINES = ['bing_api', 'google_api', 'google_web', 'flickr_api', 'federated']
 
 zmq_context = None # used to store zmq context created by init_zmq_context function
 
@@ -45,6 +51,35 @@ def query():
     query_res_list = http_service_helper.imsearch_query(query_text, engine, query_params)
     return Response(json.dumps(query_res_list), mimetype='application/json')
 
+@app.route('/query_batch', methods=['POST'])
+def query_batch():
+    # parse POST data
+    batch_prms = request.json
+    if not batch_prms or not batch_prms.get('terms'):
+        raise ValueError("Input must be 'application/json' encoded dict with a list of 'terms'")
+    engine = batch_prms.get('engine', 'google_web')
+    query_timeout = float(batch_prms.get('query_timeout', -1.0))
+    stream = (int(batch_prms.get('stream', 0)) == 1)
+
+    query_params = dict()
+    for param_nm in ['size', 'style']:
+        if param_nm in batch_prms:
+            query_params[param_nm] = batch_prms[param_nm]
+    if 'num_results' in batch_prms:
+        query_params['num_results'] = int(batch_prms['num_results'])
+
+    # execute queries
+    outcomes = http_service_helper.imsearch_query_batch(batch_prms['terms'], engine,
+                                                        query_params, query_timeout)
+    if stream:
+        # one JSON object per line for each term, as soon as it completes
+        def generate():
+            for term, outcome in outcomes:
+                yield json.dumps(dict(outcome, term=term)) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    return Response(json.dumps(dict(outcomes)), mimetype='application/json')
+
 @app.route('/download', methods=['POST'])
 def download():
     # parse POST data
@@ -62,6 +97,27 @@ def download():
 def get_engine_list():
     return json.dumps(SUPPORTED_ENGINES)
 
+@app.route('/get_query_cache_stats')
+def get_query_cache_stats():
+    return json.dumps(http_service_helper.get_query_cache_stats())
+
+@app.route('/get_image_store_stats')
+def get_image_store_stats():
+    return json.dumps(http_service_helper.get_image_store_stats())
+
+@app.route('/gc_image_store', methods=['POST'])
+def gc_image_store():
+    removed_count = http_service_helper.gc_image_store()
+    return json.dumps({'removed': removed_count})
+
+@app.route('/memory_budget')
+def memory_budget():
+    return json.dumps(http_service_helper.get_memory_budget_stats())
+
+@app.route('/engine_health')
+def engine_health():
+    return json.dumps(http_service_helper.get_engine_health())
+
 @app.route('/get_postproc_module_list')
 def get_postproc_module_list():
     return json.dumps(http_service_helper.get_postproc_modules())
@@ -88,6 +144,18 @@ def exec_pipeline():
     return_dfiles_list = request.form.get('return_dfiles_list', (postproc_module is None))
     return_dfiles_list = (int(return_dfiles_list) == 1)
 
+    # < optional deadline (in seconds) for the whole pipeline, after which
+    #   whatever was retrieved so far is returned >
+    deadline = Deadline(float(request.form['deadline'])) if 'deadline' in request.form else None
+
+    # < optional additional outputs, checked before anything is retrieved >
+    variants = None
+    if 'variants' in request.form:
+        try:
+            variants = http_service_helper.parse_variants(request.form['variants'])
+        except ValueError as e:
+            return Response('Invalid variants: %s' % str(e), status=400)
+
     # prepare query params
     query_timeout = request.form.get('query_timeout', -1.0)
     query_timeout = float(query_timeout)
@@ -97,19 +165,33 @@ def exec_pipeline():
             query_params[param_nm] = request.form[param_nm]
     if 'num_results' in request.form:
         query_params['num_results'] = int(request.form['num_results'])
-    # execute query
+    # < if streaming, downloads start as soon as the first page of results is retrieved >
+    stream_query = (int(request.form.get('stream_query', 0)) == 1)
+    # execute query (a streamed query sets query_status['partial'] once done)
+    query_status = {}
     query_res_list = http_service_helper.imsearch_query(query_text, engine,
-                                                        query_params, query_timeout)
-    print ('Query for %s completed: %d results retrieved' % (query_text, len(query_res_list)))
+                                                        query_params, query_timeout,
+                                                        stream=stream_query,
+                                                        deadline=deadline,
+                                                        status=query_status)
+    if stream_query:
+        print ('Query for %s started: results are streamed to the downloader' % query_text)
+    else:
+        print ('Query for %s completed: %d results retrieved' % (query_text, len(query_res_list)))
     #query_res_list = query_res_list[:5] # DEBUG CODE
     # prepare download params
     imgetter_params = dict()
     for param_nm in ['improc_timeout', 'per_image_timeout']:
         if param_nm in request.form:
             imgetter_params[param_nm] = float(request.form[param_nm])
-    for param_nm in ['resize_width', 'resize_height']:
+    for param_nm in ['resize_width', 'resize_height', 'max_downloads', 'max_downloads_per_host',
+                     'decode_in_memory', 'save_originals', 'passthrough', 'phash_max_distance',
+                     'target_count', 'target_overshoot', 'adaptive_timeouts',
+                     'hedge_requests']:
         if param_nm in request.form:
             imgetter_params[param_nm] = int(request.form[param_nm])
+    if variants is not None:
+        imgetter_params['variants'] = variants
     # download images
     print ('Downloading for %s started: %d sec improc_timeout, %d sec per_image_timeout' % (query_text,
                                                                                            imgetter_params['improc_timeout'] if imgetter_params['improc_timeout'] else -1,
@@ -119,17 +201,25 @@ def exec_pipeline():
                                                                   postproc_extra_prms,
                                                                   custom_local_path,
                                                                   imgetter_params,
-                                                                  zmq_context)
+                                                                  zmq_context,
+                                                                  deadline)
     print ('Downloading for %s completed: %d images retrieved' % (query_text, len(dfiles_list)))
     # convert pathnames to URL paths (if not running locally and specifying
     # a custom path)
     if not custom_local_path:
         dfiles_list = http_service_helper.make_url_dfiles_list(dfiles_list)
 
+    # flag responses missing results because of the deadline or timeouts
+    partial = (getattr(query_res_list, 'partial', False) or
+               query_status.get('partial', False) or
+               getattr(dfiles_list, 'partial', False))
+    headers = {'X-Imsearch-Partial': '1'} if partial else {}
+
     if return_dfiles_list:
-        return Response(json.dumps(dfiles_list), mimetype='application/json')
+        return Response(json.dumps(dfiles_list), mimetype='application/json',
+                        headers=headers)
 
-    return 'DONE'
+    return Response('DONE', headers=headers)
 
 
 if __name__ == '__main__':
@@ -138,6 +228,7 @@ if __name__ == '__main__':
     else:
         SERVER_PORT = DEFAULT_SERVER_PORT
     print ("Starting imsearch_http_service on port", SERVER_PORT)
+    http_service_helper.preconnect_searchers(SUPPORTED_ENGINES)
     http_server = WSGIServer(('', SERVER_PORT), app)
     http_server.serve_forever()
 
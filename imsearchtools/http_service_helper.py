@@ -1,40 +1,101 @@
 #!/usr/bin/env python
 
 import os
+import json
+import logging
+import functools
 
 from flask import request
 
 from imsearchtools import query as image_query
-from imsearchtools.process import image_processor, image_getter, callback_handler
+from imsearchtools.engines import searcher_pool, health
+from imsearchtools.process import image_processor, image_getter, callback_handler, image_store
+from imsearchtools.process import hash_index, memory_budget
 from imsearchtools.postproc_modules import module_finder
 
+# query results are cached in memory and on disk (so that they survive
+# restarts of the service) for a time depending on the engine
+QUERY_CACHE_DIR = os.path.join(os.getcwd(), 'query_cache')
+QUERY_CACHE_TTLS = {'GoogleWebSearch': 6*3600.0,
+                    'BingAPISearchV5': 24*3600.0,
+                    'GoogleAPISearch': 24*3600.0,
+                    'FlickrAPISearch': 24*3600.0}
 
-def imsearch_query(query, engine, query_params, query_timeout=-1.0):
+query_cache = image_query.ResultCache(engine_ttls=QUERY_CACHE_TTLS,
+                                      disk_dir=QUERY_CACHE_DIR)
+searcher_pool.set_result_cache(query_cache)
+
+# downloaded images are kept in a content-addressed store (created on first
+# use) and linked into the output directory of each request, so that images
+# returned for several queries are only downloaded and processed once
+IMAGE_STORE_DIR = os.path.join(os.getcwd(), 'image_store')
+IMAGE_STORE_GC_MIN_AGE = 24*3600.0
+
+downloaded_image_store = image_store.ImageStore(IMAGE_STORE_DIR)
+
+# perceptual hashes of downloaded images (when requested with
+# phash_max_distance) are indexed across requests, so that pictures already
+# retrieved from another URL are flagged and not post-processed again
+HASH_INDEX_DIR = os.path.join(os.getcwd(), 'phash_index')
+
+downloaded_hash_index = hash_index.HashIndex(HASH_INDEX_DIR)
+
+# images are processed in a pool of this many worker processes (-1 for one
+# per CPU, 0 to process them in the event loop) shared by all requests, with
+# at most PROCESS_QUEUE_DEPTH images waiting for a free worker
+PROCESS_WORKERS = 0
+PROCESS_QUEUE_DEPTH = image_getter.PROCESS_QUEUE_DEPTH
+
+# engine to query instead when an engine fails or its circuit breaker is
+# open, e.g. {'google_web': 'bing_api'} (engines not listed do not fail over)
+FALLBACK_ENGINES = {}
+
+log = logging.getLogger(__name__)
+
+def preconnect_searchers(engines):
+    # open connections to the engines before the first query is received
+    return searcher_pool.preconnect(engines)
+
+def imsearch_query(query, engine, query_params, query_timeout=-1.0, stream=False,
+                   deadline=None, status=None):
     # prepare input arguments for searcher initialization if non-default
-    searcher_args = dict()
+    searcher_timeout = None
     if query_timeout > 0.0:
-        searcher_args['timeout'] = query_timeout
-    # initialize searcher
-    if engine == 'bing_api':
-        searcher = image_query.BingAPISearchV5(**searcher_args)
-    elif engine == 'google_old_api':
-        searcher = image_query.GoogleOldAPISearch(**searcher_args)
-    elif engine == 'google_api':
-        searcher = image_query.GoogleAPISearch(**searcher_args)
-    elif engine == 'google_web':
-        searcher = image_query.GoogleWebSearch(**searcher_args)
-    elif engine == 'flickr_api':
-        searcher = image_query.FlickrAPISearch(**searcher_args)
+        searcher_timeout = query_timeout
+    # get (pooled) searcher
+    searcher = searcher_pool.get_searcher(engine, searcher_timeout)
+    # execute the query (if streaming, return a generator of results instead,
+    # setting status['partial'] if it is cut short), recording its outcome in
+    # the engine health scoreboard
+    if stream:
+        query_func = functools.partial(health.tracked_iter_query, status=status)
     else:
-        raise ValueError('Unknown query engine')
-    # execute the query
-    return searcher.query(query, **query_params)
+        query_func = health.tracked_query
+    try:
+        return query_func(searcher, query, deadline=deadline, **query_params)
+    except image_query.QueryException as e:
+        fallback_engine = FALLBACK_ENGINES.get(engine)
+        if not fallback_engine or (deadline is not None and deadline.expired()):
+            raise
+        log.info('Query for %s failed on %s (%s), failing over to %s',
+                 query, engine, str(e), fallback_engine)
+        searcher = searcher_pool.get_searcher(fallback_engine, searcher_timeout)
+        return query_func(searcher, query, deadline=deadline, **query_params)
+
+def imsearch_query_batch(terms, engine, query_params, query_timeout=-1.0):
+    searcher_timeout = None
+    if query_timeout > 0.0:
+        searcher_timeout = query_timeout
+    # returns a generator of (term, outcome) tuples in order of completion
+    return image_query.iter_query_many(terms, engine, timeout=searcher_timeout,
+                                       **query_params)
 
 def imsearch_download_to_static(query_res_list, postproc_module=None,
                                 postproc_extra_prms=None,
                                 custom_local_path=None,
                                 imgetter_params=None,
-                                zmq_context=None):
+                                zmq_context=None,
+                                deadline=None):
     # prepare extra parameters if required
     ig_params = dict()
     if imgetter_params:
@@ -42,17 +103,39 @@ def imsearch_download_to_static(query_res_list, postproc_module=None,
             ig_params['timeout'] = imgetter_params['improc_timeout']
         if 'per_image_timeout' in imgetter_params and imgetter_params['per_image_timeout'] > 0.0:
             ig_params['image_timeout'] = imgetter_params['per_image_timeout']
+        if 'max_downloads' in imgetter_params and imgetter_params['max_downloads'] > 0:
+            ig_params['max_downloads'] = imgetter_params['max_downloads']
+        if 'max_downloads_per_host' in imgetter_params and imgetter_params['max_downloads_per_host'] > 0:
+            ig_params['max_downloads_per_host'] = imgetter_params['max_downloads_per_host']
+        for param_nm in ['decode_in_memory', 'save_originals', 'adaptive_timeouts',
+                         'hedge_requests']:
+            if param_nm in imgetter_params:
+                ig_params[param_nm] = (imgetter_params[param_nm] == 1)
         do_width_resize = ('resize_width' in imgetter_params and imgetter_params['resize_width'] > 0)
         do_height_resize = ('resize_height' in imgetter_params and imgetter_params['resize_height'] > 0)
-        if do_width_resize or do_height_resize:
+        variants = imgetter_params.get('variants')
+        passthrough = (imgetter_params.get('passthrough') == 1)
+        use_phash = ('phash_max_distance' in imgetter_params)
+        if do_width_resize or do_height_resize or variants or passthrough or use_phash:
             improc_settings = image_processor.ImageProcessorSettings()
             if do_width_resize:
                 improc_settings.conversion['max_width'] = imgetter_params['resize_width']
             if do_height_resize:
                 improc_settings.conversion['max_height'] = imgetter_params['resize_height']
+            improc_settings.conversion['passthrough'] = passthrough
+            if use_phash:
+                improc_settings.phash['enabled'] = True
+                improc_settings.phash['max_distance'] = min(imgetter_params['phash_max_distance'],
+                                                            hash_index.MAX_SEARCH_DISTANCE)
+                ig_params['hash_index'] = downloaded_hash_index
+            for variant in variants or []:
+                improc_settings.add_variant(**variant)
             ig_params['opts'] = improc_settings
 
-    imgetter = image_getter.ImageGetter(**ig_params)
+    imgetter = image_getter.ImageGetter(store=downloaded_image_store,
+                                        process_workers=PROCESS_WORKERS,
+                                        process_queue_depth=PROCESS_QUEUE_DEPTH,
+                                        **ig_params)
         
     if not custom_local_path:
         outdir = os.path.join(os.getcwd(), 'static')
@@ -74,27 +157,76 @@ def imsearch_download_to_static(query_res_list, postproc_module=None,
     #    postproc_extra_prms['zmq_impath_return_sock'] = context.socket(zmq.REQ)
     #    postproc_extra_prms['zmq_impath_return_sock'].connect(postproc_extra_prms['zmq_impath_return_ch'])
 
+    # a generator of results (from a streamed query) is processed as results arrive
+    # (also when only a target number of images is requested, as URLs are then
+    # taken from it as they are needed)
+    target_count = imgetter_params.get('target_count', 0) if imgetter_params else 0
+    if target_count > 0:
+        target_params = dict(target_count=target_count)
+        if imgetter_params.get('target_overshoot', -1) >= 0:
+            target_params['overshoot'] = imgetter_params['target_overshoot']
+        process_func = functools.partial(imgetter.process_urls, **target_params)
+    elif isinstance(query_res_list, list):
+        process_func = imgetter.process_urls
+    else:
+        process_func = imgetter.process_url_stream
+
     # if a postprocessing module is defined, find the callback function
     # of the module
     if postproc_module:
         callback_func = module_finder.get_module_callback(postproc_module)
         if postproc_extra_prms:
-            return imgetter.process_urls(query_res_list, outdir, callback_func,
-                                         completion_extra_prms=postproc_extra_prms)
-
-        return imgetter.process_urls(query_res_list, outdir, callback_func)
-
-    return imgetter.process_urls(query_res_list, outdir)
+            return process_func(query_res_list, outdir, callback_func,
+                                completion_extra_prms=postproc_extra_prms,
+                                deadline=deadline)
+
+        return process_func(query_res_list, outdir, callback_func, deadline=deadline)
+
+    return process_func(query_res_list, outdir, deadline=deadline)
+
+def parse_variants(variants_json):
+    # returns the list of variant settings in `variants_json`, raising
+    # ValueError if it is not valid JSON or any variant is invalid
+    variants = json.loads(variants_json)
+    if not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants):
+        raise ValueError('variants must be a list of objects')
+    improc_settings = image_processor.ImageProcessorSettings()
+    for variant in variants:
+        try:
+            improc_settings.add_variant(**variant)
+        except TypeError as e:
+            raise ValueError(str(e))
+    return variants
 
 def make_url_dfiles_list(dfiles_list):
     cwd = os.getcwd()
     # recast local fs image paths as server paths using hostname from request
     for dfile_ifo in dfiles_list:
-        dfile_ifo['orig_fn'] = 'http://' + request.host + dfile_ifo['orig_fn'].replace(cwd, '')
-        dfile_ifo['thumb_fn'] = 'http://' + request.host + dfile_ifo['thumb_fn'].replace(cwd, '')
-        dfile_ifo['clean_fn'] = 'http://' + request.host + dfile_ifo['clean_fn'].replace(cwd, '')
+        for fn_key in ['orig_fn', 'thumb_fn', 'clean_fn']:
+            # (the original is not saved when decoding in memory without save_originals)
+            if dfile_ifo.get(fn_key):
+                dfile_ifo[fn_key] = 'http://' + request.host + dfile_ifo[fn_key].replace(cwd, '')
+        for variant_nm, variant_fn in dfile_ifo.get('variant_fns', {}).items():
+            if variant_fn:
+                dfile_ifo['variant_fns'][variant_nm] = 'http://' + request.host + variant_fn.replace(cwd, '')
     return dfiles_list
 
+def get_query_cache_stats():
+    return query_cache.stats()
+
+def get_image_store_stats():
+    return downloaded_image_store.stats()
+
+def gc_image_store(min_age=IMAGE_STORE_GC_MIN_AGE):
+    # remove stored images no longer linked from any output directory
+    return downloaded_image_store.gc(min_age)
+
+def get_memory_budget_stats():
+    return memory_budget.get_memory_budget().stats()
+
+def get_engine_health():
+    return health.scoreboard()
+
 def get_postproc_modules():
     return module_finder.get_module_list()
 
@@ -1,2 +1,24 @@
-from .image_getter import *
-from .image_processor import ImageProcessorSettings
+"""
+Image download and processing
+
+The downloader (which imports PIL) is only loaded when first accessed.
+"""
+
+import importlib
+
+# attribute name -> submodule defining it
+_LAZY_ATTRIBUTES = {'ImageGetter': 'image_getter',
+                    'ImageProcessor': 'image_processor',
+                    'ImageProcessorSettings': 'image_processor',
+                    'FilterException': 'image_processor'}
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()))
@@ -62,12 +62,17 @@ class CallbackHandler(object):
                 callback_launch_greenlet.join()
 
 
+    def add_tasks(self, task_count):
+        # used when the total number of tasks is not known on creation
+        self.task_count = self.task_count + task_count
+
     def skip(self):
         log.debug('Skipping task')
         self._dec_task_count_skipped()
 
-    def join(self):
-        # waiting for all tasks to complete
+    def join(self, deadline=None):
+        # waiting for all tasks to complete (or until the optional deadline
+        # expires) - returns False if some tasks had to be killed
         log.debug('Waiting all tasks to be completed...')
 
         last_task_count = self.task_count
@@ -80,7 +85,7 @@ class CallbackHandler(object):
                 last_task_elapsed = 0.0
             time.sleep(0.05)
             last_task_elapsed = last_task_elapsed + 0.05
-            if last_task_elapsed > 1.5:
+            if last_task_elapsed > 1.5 or (deadline is not None and deadline.expired()):
                 task_wait_timed_out = True
                 break
 
@@ -92,6 +97,7 @@ class CallbackHandler(object):
             log.debug('All tasks completed! (Timed out)')
         else:
             log.debug('All tasks completed!')
+        return not task_wait_timed_out
 
     def terminate(self):
         log.debug('Terminating workers early...')
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Module: download_scheduler
+Bounds the number of concurrent image downloads, both in total and for each
+host, serving hosts with pending downloads in round-robin order.
+"""
+
+import logging
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+import gevent
+
+log = logging.getLogger(__name__)
+
+# default maximum number of downloads in flight, in total and for each host
+MAX_CONCURRENT_DOWNLOADS = 64
+MAX_DOWNLOADS_PER_HOST = 4
+
+def host_from_url(url):
+    try:
+        return (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+class DownloadScheduler(object):
+    """Runs download jobs with a global and a per-host concurrency cap
+
+    `spawn(url, func, *args, **kwargs)` returns an (unstarted) greenlet which
+    is started once fewer than `max_concurrency` jobs in total and fewer than
+    `max_per_host` jobs for the host of `url` are running. When a slot is
+    freed, the next job is taken from the host which was least recently
+    served, so that a host with many URLs does not delay all others.
+
+    The returned greenlets can be joined and killed as usual - killing a
+    greenlet which has not started yet removes it from the queue.
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENT_DOWNLOADS,
+                 max_per_host=MAX_DOWNLOADS_PER_HOST):
+        if max_concurrency < 1 or max_per_host < 1:
+            raise ValueError('Concurrency limits must be at least 1')
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self._queues = OrderedDict()  # host -> deque of greenlets
+        self._last_served = {}  # host -> number of the last job started for it
+        self._served_count = 0
+        self._active = 0
+        self._host_active = {}
+
+    def spawn(self, url, func, *args, **kwargs):
+        job = gevent.Greenlet(func, *args, **kwargs)
+        host = host_from_url(url)
+        if host not in self._queues:
+            self._queues[host] = deque()
+        self._queues[host].append(job)
+        self._dispatch()
+        return job
+
+    @property
+    def active_count(self):
+        return self._active
+
+    @property
+    def pending_count(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency:
+            job, host = self._next_job()
+            if job is None:
+                return
+            self._active = self._active + 1
+            self._host_active[host] = self._host_active.get(host, 0) + 1
+            job.link(lambda job, host=host: self._on_job_done(host))
+            job.start()
+
+    def _next_job(self):
+        # take the next job of the least recently served host below its cap
+        # (hosts never served first, in order of arrival)
+        next_host = None
+        for host in list(self._queues.keys()):
+            queue = self._queues[host]
+            # skip jobs killed while waiting in the queue
+            while queue and queue[0].ready():
+                queue.popleft()
+            if not queue:
+                del self._queues[host]
+                continue
+            if self._host_active.get(host, 0) >= self.max_per_host:
+                continue
+            if (next_host is None or
+                self._last_served.get(host, -1) < self._last_served.get(next_host, -1)):
+                next_host = host
+        if next_host is None:
+            return None, None
+
+        queue = self._queues[next_host]
+        job = queue.popleft()
+        if not queue:
+            del self._queues[next_host]
+        self._last_served[next_host] = self._served_count
+        self._served_count = self._served_count + 1
+        return job, next_host
+
+    def _on_job_done(self, host):
+        self._active = self._active - 1
+        self._host_active[host] = self._host_active[host] - 1
+        if not self._host_active[host]:
+            del self._host_active[host]
+            if host not in self._queues:
+                self._last_served.pop(host, None)
+        self._dispatch()
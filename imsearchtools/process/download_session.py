@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""
+Module: download_session
+Process-wide requests session used to download images, so that keep-alive
+connections to image hosts are reused across downloads, calls to
+`ImageGetter.process_urls` and requests to the HTTP service.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .download_scheduler import MAX_DOWNLOADS_PER_HOST
+
+# number of hosts for which connection pools are kept, and number of
+# keep-alive connections kept per host (matching the default number of
+# concurrent downloads from a single host)
+POOL_HOSTS = 128
+POOL_MAXSIZE = MAX_DOWNLOADS_PER_HOST
+
+def make_download_session(pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE):
+    session = requests.Session()
+    adapter_args = dict(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+    session.mount('https://', HTTPAdapter(**adapter_args))
+    session.mount('http://', HTTPAdapter(**adapter_args))
+    return session
+
+_download_session = None
+
+def get_download_session():
+    """Return the download session shared by the whole process"""
+    global _download_session
+    if _download_session is None:
+        _download_session = make_download_session()
+    return _download_session
+
+def set_download_session(session):
+    """Use `session` for all ImageGetter instances created from now on"""
+    global _download_session
+    _download_session = session
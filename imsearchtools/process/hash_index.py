@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+"""
+Module: hash_index
+Persistent index of the perceptual hashes (see phash) of all downloaded
+images, answering "which images are within N bits of this hash?" across
+queries, e.g. to find whether a picture was already retrieved from another
+URL.
+
+The index uses multi-index hashing: each 64-bit hash is split into four
+16-bit chunks, and for each chunk a table maps every chunk value to the
+records with that value. Two hashes within r bits of each other have at
+least one chunk within r // 4 bits, so a search only has to look at the
+records in the buckets of the chunk values within r // 4 bits of those of
+the query, and compute the full distance to these candidates.
+
+Files (in `root_dir`):
+    hashes.u64 - the hash of each record, appended on insert
+    tables.mih - the bucket tables over the first `indexed` records, in
+                 compressed sparse row form (memory-mapped)
+    keys.sqlite - the key (e.g. URL) of each record
+
+Records inserted after the tables were last built are kept in an in-memory
+delta (rebuilt from hashes.u64 when the index is opened), and the tables
+are rebuilt in the background once the delta grows large. Files use the
+native byte order, and the index supports a single writing process.
+"""
+
+import os
+import mmap
+import struct
+import sqlite3
+import logging
+import itertools
+from array import array
+
+import gevent
+from gevent.lock import Semaphore
+
+log = logging.getLogger(__name__)
+
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_VALUES = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_VALUES - 1
+
+# the tables are rebuilt when the records not yet in them exceed both of
+# these (the second keeping the amortized cost of rebuilding constant)
+COMPACT_MIN_RECORDS = 10000
+COMPACT_FRACTION = 0.25
+
+# searches are limited to this many bits (the number of buckets probed grows
+# combinatorially with the distance)
+MAX_SEARCH_DISTANCE = 10
+
+# maximum number of record ids looked up in a single query of keys.sqlite
+KEYS_PER_SELECT = 500
+
+# seconds to wait for keys.sqlite while it is locked (e.g. by another
+# process reading it) before raising sqlite3.OperationalError
+DB_TIMEOUT = 0.5
+
+TABLES_MAGIC = b'IMHI'
+TABLES_VERSION = 1
+TABLES_HEADER = struct.Struct('=4sIQ')  # magic, version, number of records indexed
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:
+    def _popcount(value):
+        return bin(value).count('1')
+
+def _chunk(value, chunk):
+    return (value >> (chunk*CHUNK_BITS)) & CHUNK_MASK
+
+def _neighbours(chunk_value, max_bits):
+    # all chunk values within `max_bits` bits of `chunk_value`
+    yield chunk_value
+    for bits in range(1, max_bits + 1):
+        for positions in itertools.combinations(range(CHUNK_BITS), bits):
+            flipped = chunk_value
+            for position in positions:
+                flipped = flipped ^ (1 << position)
+            yield flipped
+
+def build_tables(hashes):
+    """Return (offsets, ids) arrays for each chunk, given a sequence of hashes
+
+    The ids of the records whose chunk has value v are ids[offsets[v]:offsets[v + 1]].
+    """
+    count = len(hashes)
+    tables = []
+    for chunk in range(CHUNKS):
+        chunk_values = [_chunk(value, chunk) for value in hashes]
+        offsets = array('I', [0])*(CHUNK_VALUES + 1)
+        for chunk_value in chunk_values:
+            offsets[chunk_value + 1] += 1
+        for index in range(CHUNK_VALUES):
+            offsets[index + 1] += offsets[index]
+        ids = array('I', [0])*count
+        next_pos = array('I', offsets[:-1])
+        for record_id, chunk_value in enumerate(chunk_values):
+            ids[next_pos[chunk_value]] = record_id
+            next_pos[chunk_value] += 1
+        tables.append((offsets, ids))
+    return tables
+
+def _write_tables(fn, hashes):
+    # build the tables over `hashes` and write them to `fn`
+    tables = build_tables(hashes)
+    with open(fn, 'wb') as f:
+        f.write(TABLES_HEADER.pack(TABLES_MAGIC, TABLES_VERSION, len(hashes)))
+        for offsets, ids in tables:
+            f.write(offsets.tobytes())
+            f.write(ids.tobytes())
+
+class HashIndex(object):
+    """
+    Persistent multi-index hashing index of 64-bit hashes, rooted at `root_dir`
+
+    `add(value, key)` inserts a record, and `search(value, max_distance)`
+    returns (distance, key) tuples for all records within `max_distance`
+    bits of `value`, nearest first. The index is opened on first use.
+    """
+
+    def __init__(self, root_dir, compact_min_records=COMPACT_MIN_RECORDS,
+                 compact_fraction=COMPACT_FRACTION):
+        self.root_dir = root_dir
+        self.compact_min_records = compact_min_records
+        self.compact_fraction = compact_fraction
+        self._opened = False
+        self._compact_lock = Semaphore()
+        self._compact_job = None
+
+    # Opening and closing
+    def _open(self):
+        if self._opened:
+            return
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+        self._db = sqlite3.connect(os.path.join(self.root_dir, 'keys.sqlite'),
+                                   timeout=DB_TIMEOUT, isolation_level=None)
+        self._db.execute('CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, '
+                         'key TEXT NOT NULL)')
+
+        hashes_fn = os.path.join(self.root_dir, 'hashes.u64')
+        self._hashes_file = open(hashes_fn, 'ab+')
+        # drop a partially written record
+        count = os.path.getsize(hashes_fn) // 8
+        self._hashes_file.truncate(count*8)
+        self._count = count
+
+        self._map_tables()
+        # records not in the tables yet
+        self._recent = array('Q')
+        self._delta = [dict() for _ in range(CHUNKS)]
+        if count > self._indexed:
+            self._hashes_file.seek(self._indexed*8)
+            recent = array('Q')
+            recent.frombytes(self._hashes_file.read((count - self._indexed)*8))
+            for value in recent:
+                self._add_to_delta(value)
+        self._opened = True
+
+    def _map_tables(self):
+        # memory-map the bucket tables and the hashes of the records in them
+        self._tables_mmap = None
+        self._hashes_mmap = None
+        self._tables = None
+        self._indexed_hashes = None
+        self._indexed = 0
+        tables_fn = os.path.join(self.root_dir, 'tables.mih')
+        if not os.path.exists(tables_fn):
+            return
+        with open(tables_fn, 'rb') as f:
+            magic, version, indexed = TABLES_HEADER.unpack(f.read(TABLES_HEADER.size))
+            if magic != TABLES_MAGIC or version != TABLES_VERSION or indexed > self._count:
+                log.warning('Ignoring invalid hash index tables: %s', tables_fn)
+                return
+            if indexed == 0:
+                return
+            self._tables_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._tables_mmap)
+        pos = TABLES_HEADER.size
+        offsets_bytes = (CHUNK_VALUES + 1)*4
+        self._tables = []
+        for chunk in range(CHUNKS):
+            offsets = view[pos:pos + offsets_bytes].cast('I')
+            pos = pos + offsets_bytes
+            ids = view[pos:pos + indexed*4].cast('I')
+            pos = pos + indexed*4
+            self._tables.append((offsets, ids))
+        self._hashes_mmap = mmap.mmap(self._hashes_file.fileno(), indexed*8,
+                                      access=mmap.ACCESS_READ)
+        self._indexed_hashes = memoryview(self._hashes_mmap).cast('Q')
+        self._indexed = indexed
+
+    def _unmap_tables(self):
+        # (views must be released before the maps can be closed)
+        for offsets, ids in self._tables or []:
+            offsets.release()
+            ids.release()
+        if self._indexed_hashes is not None:
+            self._indexed_hashes.release()
+        for mapped in (self._tables_mmap, self._hashes_mmap):
+            if mapped is not None:
+                mapped.close()
+        self._tables = None
+
+    def close(self):
+        if self._compact_job is not None:
+            # (waiting for the tables being rebuilt in the background)
+            self._compact_job.join()
+            self._compact_job = None
+        if self._opened:
+            self._unmap_tables()
+            self._hashes_file.close()
+            self._db.close()
+            self._opened = False
+
+    def __len__(self):
+        self._open()
+        return self._count
+
+    # Inserting
+    def add(self, value, key):
+        """Add a record with hash `value` and `key`, returning its id"""
+        return self.add_many([(value, key)])[0]
+
+    def add_many(self, records):
+        """Add (value, key) records, returning their ids"""
+        self._open()
+        records = list(records)
+        record_ids = list(range(self._count, self._count + len(records)))
+        self._db.execute('BEGIN')
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?)',
+                                 [(record_id, key) for record_id, (_, key)
+                                  in zip(record_ids, records)])
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        values = array('Q', [value for value, _ in records])
+        self._hashes_file.seek(0, os.SEEK_END)
+        self._hashes_file.write(values.tobytes())
+        self._hashes_file.flush()
+        self._count = self._count + len(records)
+        for value in values:
+            self._add_to_delta(value)
+
+        if (len(self._recent) >= max(self.compact_min_records,
+                                     self.compact_fraction*self._indexed) and
+            (self._compact_job is None or self._compact_job.ready())):
+            self._compact_job = gevent.spawn(self._compact_in_background)
+        return record_ids
+
+    def _add_to_delta(self, value):
+        record_id = self._indexed + len(self._recent)
+        self._recent.append(value)
+        for chunk in range(CHUNKS):
+            self._delta[chunk].setdefault(_chunk(value, chunk), []).append(record_id)
+
+    def compact(self):
+        """Rebuild the bucket tables to include all records
+
+        The tables are built in the threadpool of the gevent hub, so that
+        other greenlets keep running meanwhile (searching the current tables
+        and adding records, which are kept in the delta until the next
+        rebuild). Only one rebuild runs at a time.
+        """
+        self._open()
+        with self._compact_lock:
+            if not self._recent:
+                return
+            log.info('Rebuilding hash index tables for %d records', self._count)
+            hashes = array('Q')
+            if self._indexed_hashes is not None:
+                hashes.frombytes(self._indexed_hashes.tobytes())
+            hashes.extend(self._recent)
+
+            tables_fn = os.path.join(self.root_dir, 'tables.mih')
+            tmp_fn = tables_fn + '.tmp%d' % os.getpid()
+            try:
+                gevent.get_hub().threadpool.apply(_write_tables, (tmp_fn, hashes))
+            except BaseException:
+                if os.path.exists(tmp_fn):
+                    os.remove(tmp_fn)
+                raise
+            # records added while the tables were built
+            added = self._recent[len(hashes) - self._indexed:]
+            self._unmap_tables()
+            os.replace(tmp_fn, tables_fn)
+            self._map_tables()
+            self._recent = array('Q')
+            self._delta = [dict() for _ in range(CHUNKS)]
+            for value in added:
+                self._add_to_delta(value)
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception:
+            log.exception('Could not rebuild hash index tables')
+
+    # Searching
+    def search(self, value, max_distance):
+        """Return (distance, key) of the records within `max_distance` bits of `value`
+
+        Results are sorted by increasing distance. `max_distance` is limited
+        to MAX_SEARCH_DISTANCE.
+        """
+        self._open()
+        max_distance = min(max_distance, MAX_SEARCH_DISTANCE)
+        probe_bits = max_distance // CHUNKS
+        candidates = set()
+        for chunk in range(CHUNKS):
+            for chunk_value in _neighbours(_chunk(value, chunk), probe_bits):
+                candidates.update(self._bucket(chunk, chunk_value))
+
+        matches = []
+        indexed, indexed_hashes, recent = self._indexed, self._indexed_hashes, self._recent
+        for record_id in candidates:
+            if record_id < indexed:
+                other = indexed_hashes[record_id]
+            else:
+                other = recent[record_id - indexed]
+            distance = _popcount(value ^ other)
+            if distance <= max_distance:
+                matches.append((distance, record_id))
+        matches.sort()
+
+        keys = self._keys([record_id for _, record_id in matches])
+        return [(distance, keys[record_id]) for distance, record_id in matches
+                if record_id in keys]
+
+    def _keys(self, record_ids):
+        # dict mapping each of `record_ids` (found in keys.sqlite) to its key
+        keys = {}
+        for start in range(0, len(record_ids), KEYS_PER_SELECT):
+            batch = record_ids[start:start + KEYS_PER_SELECT]
+            rows = self._db.execute('SELECT id, key FROM records WHERE id IN (%s)' %
+                                    ','.join('?'*len(batch)), batch)
+            keys.update(rows)
+        return keys
+
+    def _bucket(self, chunk, chunk_value):
+        # ids of the records whose chunk `chunk` has value `chunk_value`
+        record_ids = self._delta[chunk].get(chunk_value, [])
+        if self._tables is not None:
+            offsets, ids = self._tables[chunk]
+            record_ids = ids[offsets[chunk_value]:offsets[chunk_value + 1]].tolist() + record_ids
+        return record_ids
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Module: host_latency
+Per-host statistics of image download latency, used to set the timeouts of
+each download from the history of its host instead of using a single fixed
+timeout for all hosts.
+
+For each host, exponentially weighted moving averages are kept of the time
+to first byte (the time until the response headers are received) and of its
+deviation, as well as of the throughput of response bodies. The timeout for
+the response headers is the mean time to first byte plus a multiple of its
+deviation (as for TCP retransmission timeouts), and the timeout between two
+reads of the body allows for reading a chunk at the usual throughput of the
+host. Downloads which time out count as a sample of twice their timeout, so
+that the timeouts of slow hosts grow until their downloads complete.
+
+The 95th percentile of the recent times to first byte of each host is also
+kept, after which a second (hedged) request can be sent for a download.
+"""
+
+import logging
+from collections import OrderedDict, deque
+
+from .download_scheduler import host_from_url
+
+log = logging.getLogger(__name__)
+
+## Latency Configuration
+#  --------------------------------------------
+
+# weight of each new sample in the moving averages
+EWMA_WEIGHT = 0.2
+
+# samples needed from a host before its timeouts adapt to them
+MIN_SAMPLES = 3
+
+# number of recent times to first byte over which the p95 is computed
+LATENCY_WINDOW = 50
+
+# the timeout for the response headers is the mean time to first byte plus
+# this many deviations, and reads of the body must keep up with 1/this of
+# the mean throughput
+TIMEOUT_DEVIATIONS = 4.0
+
+# timed out downloads count as a sample of their timeout times this
+TIMEOUT_BACKOFF = 2.0
+
+# bounds of adapted timeouts: at least MIN_TIMEOUT seconds, and at most
+# MAX_TIMEOUT_FACTOR times the default timeout (the `image_timeout` of ImageGetter)
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT_FACTOR = 4.0
+
+# bytes read from the response body at a time (see ImageGetter)
+READ_CHUNK_BYTES = 64*1024
+
+# maximum number of hosts for which statistics are kept (least recently
+# used hosts are forgotten first)
+MAX_HOSTS = 10000
+
+## Host Latency Classes
+#  --------------------------------------------
+
+class HostLatency(object):
+    """Moving averages of the time to first byte and throughput of a host"""
+
+    def __init__(self, ewma_weight=EWMA_WEIGHT, window=LATENCY_WINDOW):
+        self.ewma_weight = ewma_weight
+        self.ttfb = None            # mean time to first byte (seconds)
+        self.ttfb_deviation = 0.0   # mean deviation of the time to first byte
+        self.throughput = None      # mean throughput of response bodies (bytes/second)
+        self.sample_count = 0
+        self.timeout_count = 0
+        self._recent = deque(maxlen=window)
+
+    def record_response(self, ttfb):
+        self.sample_count = self.sample_count + 1
+        self._recent.append(ttfb)
+        if self.ttfb is None:
+            self.ttfb = ttfb
+            self.ttfb_deviation = ttfb/2.0
+        else:
+            self.ttfb_deviation = self._average(self.ttfb_deviation, abs(ttfb - self.ttfb))
+            self.ttfb = self._average(self.ttfb, ttfb)
+
+    def record_timeout(self, timeout):
+        self.timeout_count = self.timeout_count + 1
+        self.record_response(timeout*TIMEOUT_BACKOFF)
+
+    def record_body(self, nbytes, elapsed):
+        # (bodies read from buffers at once say nothing about the throughput)
+        if nbytes < READ_CHUNK_BYTES or elapsed <= 0.0:
+            return
+        throughput = nbytes/elapsed
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = self._average(self.throughput, throughput)
+
+    def p95_ttfb(self):
+        if len(self._recent) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(0.95*len(ordered)))]
+
+    def timeouts(self, default_timeout):
+        """Return the (connect, read) timeouts for a download from the host"""
+        if self.sample_count < MIN_SAMPLES:
+            return default_timeout, default_timeout
+        max_timeout = max(MIN_TIMEOUT, default_timeout*MAX_TIMEOUT_FACTOR)
+        headers_timeout = self.ttfb + TIMEOUT_DEVIATIONS*self.ttfb_deviation
+        read_timeout = headers_timeout
+        if self.throughput:
+            read_timeout = max(read_timeout, TIMEOUT_DEVIATIONS*READ_CHUNK_BYTES/self.throughput)
+        return (min(max(headers_timeout, MIN_TIMEOUT), max_timeout),
+                min(max(read_timeout, MIN_TIMEOUT), max_timeout))
+
+    def stats(self):
+        return dict(ttfb=self.ttfb,
+                    ttfb_deviation=self.ttfb_deviation,
+                    p95_ttfb=self.p95_ttfb(),
+                    throughput=self.throughput,
+                    samples=self.sample_count,
+                    timeouts=self.timeout_count)
+
+    def _average(self, mean, sample):
+        return (1.0 - self.ewma_weight)*mean + self.ewma_weight*sample
+
+class HostLatencyTracker(object):
+    """Keeps the HostLatency of each host downloaded from (by URL)"""
+
+    def __init__(self, max_hosts=MAX_HOSTS):
+        self.max_hosts = max_hosts
+        self._hosts = OrderedDict()
+
+    def host(self, url):
+        host = host_from_url(url)
+        latency = self._hosts.pop(host, None)
+        if latency is None:
+            latency = HostLatency()
+            if len(self._hosts) >= self.max_hosts:
+                self._hosts.popitem(last=False)
+        self._hosts[host] = latency
+        return latency
+
+    def timeouts(self, url, default_timeout):
+        return self.host(url).timeouts(default_timeout)
+
+    def stats(self):
+        return dict((host, latency.stats()) for host, latency in self._hosts.items())
+
+_latency_tracker = None
+
+def get_latency_tracker():
+    """Return the host latency tracker shared by the whole process"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = HostLatencyTracker()
+    return _latency_tracker
+
+def set_latency_tracker(latency_tracker):
+    """Use `latency_tracker` for all ImageGetter instances created from now on"""
+    global _latency_tracker
+    _latency_tracker = latency_tracker
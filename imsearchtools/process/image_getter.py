@@ -7,26 +7,55 @@ Author: Ken Chatfield <ken@robots.ox.ac.uk>
 Created on: 19 Oct 2012
 """
 
-import shutil
 import os
+import io
 import time
+import json
+import sqlite3
 import logging
+import itertools
+from collections import OrderedDict
+from hashlib import md5
 from http.client import BadStatusLine
 import requests
+from PIL import Image as PILImage, ImageFile
 
 import gevent
 from gevent.timeout import Timeout
+from gevent.queue import Queue, Empty
 from gevent import monkey
-monkey.patch_socket()
 
 from .image_processor import *
 from . import imutils
+from . import phash
 from imsearchtools.process import callback_handler
+from .download_scheduler import DownloadScheduler, MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_HOST
+from .download_session import get_download_session
+from .process_pool import get_process_pool, WorkerError, PROCESS_QUEUE_DEPTH
+from .memory_budget import get_memory_budget
+from .image_store import file_hash
+from .host_latency import get_latency_tracker
+from imsearchtools.utils.deadline import DeadlineExceeded, ResultList, time_left
+from imsearchtools.utils.urls import canonical_url
 #from callback_handler import CallbackHandler
 
 #logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 64*1024
+
+# maximum number of bytes read at the start of a download to parse the image
+# header, which is checked against the filter settings before continuing
+HEADER_SNIFF_BYTES = 256*1024
+
+# default number of URLs iter_process_urls processes ahead of the next result
+# to yield when preserving the order of the URLs
+REORDER_WINDOW = MAX_CONCURRENT_DOWNLOADS
+
+# default number of URLs processed speculatively beyond the number of images
+# still needed, when only a target number of images is requested
+TARGET_OVERSHOOT = 8
+
 class ImageGetter(ImageProcessor):
     """Class for downloading cleaned-up images from the web, given a set of URLs
 
@@ -36,25 +65,128 @@ class ImageGetter(ImageProcessor):
     the dictionary returned from the image search.
 
     Cleaned-up versions of the image, along with thumbnails, will be output.
+
+    At most `max_downloads` images are downloaded at the same time, and at
+    most `max_downloads_per_host` from any single host (see DownloadScheduler).
+    Images are downloaded using `session` (by default, a keep-alive session
+    shared by the whole process - see download_session).
+
+    If an ImageStore is given as `store`, images already downloaded (for any
+    query or output directory) are linked from the store instead of being
+    downloaded and processed again, and new downloads are added to it.
+
+    If `decode_in_memory` is set, images which are to be processed are
+    downloaded to memory and decoded from there instead of from the saved
+    file, and the original is only written to disk if `save_originals` is
+    set (or a store is used) - otherwise 'orig_fn' is None in the results.
+
+    If `process_workers` is non-zero, images are processed in a pool of that
+    many worker processes (-1 for one per CPU) shared by all ImageGetter
+    instances with the same settings, instead of in the event loop where
+    processing blocks all downloads in progress. At most `process_queue_depth`
+    images wait for a free worker, after which downloads wait in turn.
+
+    If a HashIndex is given as `hash_index` (and perceptual hashing is
+    enabled in the settings), the hash of each image is looked up in it to
+    find whether the same picture was already retrieved from another URL,
+    for any query. If so, the URL is returned in the 'duplicate_of' field of
+    the results and no callback is made for the image - otherwise the image
+    is added to the index.
+
+    Before an image is decoded, its estimated decoded size is reserved from
+    `memory_budget` (by default, the budget shared by the whole process - see
+    memory_budget), waiting while other images use the budget, so that
+    bursts of large images are not all decoded at the same time.
+
+    The latency of downloads from each host is tracked in `latency_tracker`
+    (by default, the tracker shared by the whole process - see host_latency).
+    If `adaptive_timeouts` is set, the connect and read timeouts of each
+    download are set from the history of its host once known (between a
+    fraction and a multiple of `image_timeout`), instead of `image_timeout`.
+    If `hedge_requests` is set, a second request is sent for downloads whose
+    response has not arrived after the 95th percentile of the time to first
+    byte of their host, and the first response received is used.
     """
 
-    def __init__(self, timeout=5.0, image_timeout=1.0, opts=ImageProcessorSettings()):
+    def __init__(self, timeout=5.0, image_timeout=1.0, opts=ImageProcessorSettings(),
+                 max_downloads=MAX_CONCURRENT_DOWNLOADS,
+                 max_downloads_per_host=MAX_DOWNLOADS_PER_HOST, session=None,
+                 store=None, decode_in_memory=False, save_originals=True,
+                 process_workers=0, process_queue_depth=PROCESS_QUEUE_DEPTH,
+                 hash_index=None, memory_budget=None, adaptive_timeouts=True,
+                 hedge_requests=False, latency_tracker=None):
         self.opts = opts
         self.timeout = timeout
         self.image_timeout = image_timeout
         self.subprocs = []
+        self._download_scheduler = DownloadScheduler(max_downloads, max_downloads_per_host)
+        self.session = session if session is not None else get_download_session()
+        self.store = store
+        self.decode_in_memory = decode_in_memory
+        self.save_originals = save_originals
+        self._duplicate_filter = None
+        if hash_index is not None and not opts.phash['enabled']:
+            raise ValueError('A hash index requires perceptual hashing to be enabled')
+        self.hash_index = hash_index
+        self.process_pool = None
+        if process_workers:
+            self.process_pool = get_process_pool(process_workers, process_queue_depth)
+        self.memory_budget = memory_budget if memory_budget is not None else get_memory_budget()
+        self.adaptive_timeouts = adaptive_timeouts
+        self.hedge_requests = hedge_requests
+        self.latency_tracker = latency_tracker if latency_tracker is not None else get_latency_tracker()
+        if not monkey.is_module_patched('socket'):
+            log.warning('socket is not monkey-patched by gevent so images will be '
+                        'downloaded one at a time (call imsearchtools.monkey_patch())')
 
     def process_url(self, urldata, output_dir, call_completion_func=False,
-                    completion_extra_prms=None, start_time=0, process_images=True):
+                    completion_extra_prms=None, start_time=0, process_images=True,
+                    deadline=None):
         error_occurred = False
+        duplicate_of = None
+        if start_time is None:
+            # (jobs may have waited for a download slot before starting)
+            start_time = time.time()
         try:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded('deadline expired before download')
             output_fn = os.path.join(output_dir, self._filename_from_urldata(urldata))
-            self._download_image(urldata['url'], output_fn)
+            content_hash = None
+            image_data = None
+            add_to_store = False
+            if self.store is not None:
+                content_hash = self.store.link_url(urldata['url'], output_fn)
+            if content_hash is None:
+                if (process_images and self.decode_in_memory and
+                    not imutils.image_exists(output_fn)):
+                    image_data = self._download_image_data(urldata['url'],
+                                                           timeout=self._download_timeout(urldata['url'], deadline))
+                    if image_data is None:
+                        raise IOError('Could not download image')
+                    if self.save_originals or self.store is not None:
+                        with open(output_fn, 'wb') as out_file:
+                            out_file.write(image_data)
+                else:
+                    self._download_image(urldata['url'], output_fn,
+                                         timeout=self._download_timeout(urldata['url'], deadline))
+                    if not os.path.exists(output_fn):
+                        raise IOError('Could not download image')
+                # (the download is only added to the store once it has been
+                # processed, so that broken images are not stored for the URL)
+                if self.store is not None and process_images:
+                    content_hash = file_hash(output_fn)
+                    add_to_store = True
             if process_images:
-                clean_fn, thumb_fn = self.process_image(output_fn)
+                if content_hash is not None:
+                    out_fns = self._process_image_with_store(output_fn, content_hash, image_data)
+                else:
+                    out_fns = self._run_process_image(output_fn, image_data)
+                if add_to_store:
+                    self.store.add_url(urldata['url'], output_fn, content_hash)
+                self._filter_near_duplicate(urldata, out_fns.get('phash'))
+                duplicate_of = self._check_hash_index(urldata['url'], out_fns.get('phash'))
             else:
-                clean_fn = None
-                thumb_fn = None
+                out_fns = {}
         except requests.ConnectionError as e:
             log.info('Connection Error for %s (%s)', urldata['url'], str(e))
             error_occurred = True
@@ -71,18 +203,35 @@ class ImageGetter(ImageProcessor):
         except FilterException as e:
             log.info('Filtered out: %s (%s)', urldata['url'], str(e))
             error_occurred = True
+        except DeadlineExceeded as e:
+            log.info('Skipped: %s (%s)', urldata['url'], str(e))
+            error_occurred = True
+        except WorkerError as e:
+            log.info('Processing failed for: %s (%s)', urldata['url'], str(e))
+            error_occurred = True
 
         if not error_occurred:
             out_dict = urldata
-            out_dict['orig_fn'] = output_fn
-            out_dict['clean_fn'] = clean_fn
-            out_dict['thumb_fn'] = thumb_fn
+            # (the original is not saved when decoded in memory without save_originals)
+            out_dict['orig_fn'] = output_fn if image_data is None or os.path.exists(output_fn) else None
+            out_dict['clean_fn'] = out_fns.get('clean')
+            out_dict['thumb_fn'] = out_fns.get('thumb')
+            if self.opts.phash['enabled']:
+                out_dict['phash'] = out_fns.get('phash')
+            if self.hash_index is not None:
+                out_dict['duplicate_of'] = duplicate_of
+            if self.opts.variants:
+                out_dict['variant_fns'] = dict((variant['name'], out_fns.get(variant['name']))
+                                               for variant in self.opts.variants)
             if start_time > 0:
                 out_dict['download_time'] = time.time() - start_time
 
             if call_completion_func:
                 # use callback handler to run completion func configured in process_urls
-                if completion_extra_prms:
+                # (except for pictures already retrieved from another URL)
+                if duplicate_of is not None:
+                    self._callback_handler.skip()
+                elif completion_extra_prms:
                     self._callback_handler.run_callback(out_dict, completion_extra_prms, blocking=True)
                 else:
                     self._callback_handler.run_callback(out_dict, blocking=True)
@@ -96,27 +245,263 @@ class ImageGetter(ImageProcessor):
 
             return None
 
-    def _download_image(self, url, output_fn):
+    def _derived_variants(self):
+        # names of the clean image, thumbnail and variants in the store (by
+        # output name), identifying the settings used to create them
+        def variant_name(kind, settings):
+            settings = dict((k, v) for k, v in settings.items() if k not in ('suffix', 'subdir'))
+            return '%s-%s' % (kind, md5(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12])
+        variants = OrderedDict([('clean', variant_name('clean', self.opts.conversion)),
+                                ('thumb', variant_name('thumb', self.opts.thumbnail))])
+        for variant in self.opts.variants:
+            variants[variant['name']] = variant_name('variant', variant)
+        return variants
+
+    def _process_image_with_store(self, fn, content_hash, data=None):
+        # link outputs from the store if available (so that process_image
+        # skips them), and add them to the store otherwise
+        variants = self._derived_variants()
+        out_fns = self._output_filenames(fn)
+        linked = dict((name, self.store.link_derived(content_hash, variant, out_fns[name]))
+                      for name, variant in variants.items())
+
+        out_fns = self._run_process_image(fn, data)
+
+        for name, variant in variants.items():
+            if not linked[name]:
+                self.store.add_derived(content_hash, variant, out_fns[name])
+        return out_fns
+
+    def _filter_near_duplicate(self, urldata, image_hash):
+        # drop images near-identical to one with the same or a better rank
+        # already processed for the same call to process_urls (before
+        # callbacks are run for them) - images processed earlier than a
+        # near-duplicate with a better rank are superseded by it instead
+        if image_hash is None or self._duplicate_filter is None:
+            return
+        duplicate = self._duplicate_filter.check(phash.hash_from_hex(image_hash),
+                                                 urldata.get('rank'), urldata['url'])
+        if duplicate is not None:
+            raise FilterException('near-duplicate of image with hash %s' %
+                                  phash.hash_to_hex(duplicate))
+
+    def _check_hash_index(self, url, image_hash):
+        # return the URL of a picture near-identical to this one retrieved
+        # before (for any query), adding this one to the index otherwise
+        if (image_hash is None or self.hash_index is None or
+            self.opts.phash['max_distance'] < 0):
+            return None
+        value = phash.hash_from_hex(image_hash)
+        curl = canonical_url(url)
+        try:
+            matches = self.hash_index.search(value, self.opts.phash['max_distance'])
+            if not matches:
+                self.hash_index.add(value, curl)
+                return None
+        except sqlite3.OperationalError as e:
+            # (e.g. the index stayed locked for hash_index.DB_TIMEOUT - rather
+            # than stalling all downloads, the image is taken as not seen before)
+            log.warning('Skipped hash index for: %s (%s)', url, str(e))
+            return None
+        if any(key == curl for _, key in matches):
+            # (the same URL retrieved again)
+            return None
+        return matches[0][1]
+
+    def _superseded(self, out_dict):
+        # whether a near-duplicate with a better rank was processed after the image
+        return (self._duplicate_filter is not None and
+                self._duplicate_filter.superseded(out_dict['url']))
+
+    def _make_duplicate_filter(self):
+        if self.opts.phash['enabled'] and self.opts.phash['max_distance'] >= 0:
+            return phash.NearDuplicateFilter(self.opts.phash['max_distance'])
+        return None
+
+    def _run_process_image(self, fn, data=None):
+        # process the image in the pool of worker processes if configured,
+        # returning the filenames of all outputs (once the memory needed to
+        # decode it is available)
+        with self.memory_budget.reserved(self._estimate_decode_bytes(fn, data)):
+            if self.process_pool is None:
+                return self.process_image_outputs(fn, data)
+            return self.process_pool.apply(process_image_outputs_with_settings, self.opts, fn, data)
+
+    def _estimate_decode_bytes(self, fn, data=None):
+        # (only the header is read - images which cannot be opened fail when processed)
+        try:
+            im = PILImage.open(fn if data is None else io.BytesIO(data))
+        except (IOError, SyntaxError, ValueError):
+            return 0
+        try:
+            return self._estimate_image_bytes(im.size, im.mode)
+        finally:
+            im.close()
+
+    def _download_image(self, url, output_fn, timeout=None):
         if imutils.image_exists(output_fn):
             log.info('Output filename exists for URL: %s', url)
             return
 
+        # the body is written to a temporary file which only replaces
+        # `output_fn` once complete, as a partial file would be taken as
+        # already downloaded
+        tmp_fn = '%s.part%d' % (output_fn, id(gevent.getcurrent()))
+        response = self._get_response(url, timeout)
+        try:
+            if response:
+                try:
+                    # reading the whole body through iter_content returns the
+                    # connection to the pool of the session for reuse
+                    with open(tmp_fn, 'wb') as out_file:
+                        for chunk in self._iter_response_body(response, url):
+                            out_file.write(chunk)
+                except FilterException:
+                    raise
+                except Exception as e:
+                    log.info('Exception while saving %s: %s' % (output_fn, str(e)))
+                    self._remove_file(tmp_fn)
+                else:
+                    os.replace(tmp_fn, output_fn)
+        except BaseException:
+            # the transfer is aborted (or the job cancelled), closing the connection
+            self._remove_file(tmp_fn)
+            raise
+        finally:
+            if response is not None:
+                response.close()
+
+    def _download_image_data(self, url, timeout=None):
+        # download the image to memory, returning its contents (or None)
+        response = self._get_response(url, timeout)
+        if response is None:
+            return None
+        try:
+            if not response:
+                return None
+            # preallocate the buffer if the size of the body is known (and
+            # acceptable - the headers are checked before it is allocated)
+            self._filter_response_headers(response.headers)
+            content_length = response.headers.get('Content-Length', '')
+            data = bytearray(int(content_length) if content_length.isdigit() else 0)
+            nbytes = 0
+            try:
+                for chunk in self._iter_response_body(response, url):
+                    data[nbytes:nbytes + len(chunk)] = chunk
+                    nbytes = nbytes + len(chunk)
+            except FilterException:
+                raise
+            except Exception as e:
+                log.info('Exception while downloading from %s: %s' % (url, str(e)))
+                return None
+            del data[nbytes:]
+            return data
+        finally:
+            response.close()
+
+    def _download_timeout(self, url, deadline=None):
+        # timeout (or (connect, read) timeouts) of a download from the host of `url`
+        if not self.adaptive_timeouts:
+            return time_left(deadline, self.image_timeout)
+        connect_timeout, read_timeout = self.latency_tracker.timeouts(url, self.image_timeout)
+        return (time_left(deadline, connect_timeout), time_left(deadline, read_timeout))
+
+    def _get_response(self, url, timeout=None):
+        if timeout is None:
+            timeout = self.image_timeout
         log.info('Downloading URL: %s', url)
+        hedge_delay = None
+        if self.hedge_requests:
+            hedge_delay = self.latency_tracker.host(url).p95_ttfb()
+        if hedge_delay is None:
+            return self._request(url, timeout)
+
+        # send a second request if the response is late for the host, and
+        # use whichever response arrives first
+        attempts = [gevent.spawn(self._request, url, timeout)]
+        attempts[0].join(hedge_delay)
+        if not attempts[0].ready():
+            log.info('Sending hedged request for %s after %.2f s', url, hedge_delay)
+            attempts.append(gevent.spawn(self._request, url, timeout))
         response = None
         try:
-            response = requests.get(url, timeout=self.image_timeout, stream=True)
+            while response is None and attempts:
+                for attempt in gevent.wait(attempts, count=1):
+                    attempts.remove(attempt)
+                    if attempt.value is None:
+                        continue
+                    if response is None:
+                        response = attempt.value
+                    else:
+                        attempt.value.close()
+        finally:
+            gevent.killall(attempts, block=False)
+        return response
+
+    def _request(self, url, timeout):
+        # returns the response (with only its headers read), recording its
+        # time to first byte for the host
+        start_time = time.time()
+        try:
+            response = self.session.get(url, timeout=timeout, stream=True)
+        except requests.Timeout as e:
+            self.latency_tracker.host(url).record_timeout(time.time() - start_time)
+            log.info('Timeout while downloading from %s: %s' % (url, str(e)))
+            return None
         except Exception as e:
             log.info('Exception while downloading from %s: %s' % (url, str(e)))
-            response = None
-        if response:
+            return None
+        self.latency_tracker.host(url).record_response(time.time() - start_time)
+        return response
+
+    def _iter_response_body(self, response, url=None):
+        # images which clearly violate the filter settings are rejected based
+        # on the response headers and on the image header in the first few KB
+        # of the body, before the rest of the body is downloaded
+        self._filter_response_headers(response.headers)
+        start_time = time.time()
+        chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        head_chunks = self._sniff_image_header(chunks)
+
+        nbytes = 0
+        for chunk in itertools.chain(head_chunks, chunks):
+            nbytes = nbytes + len(chunk)
+            self._filter_file_size(nbytes)
+            yield chunk
+        if url is not None:
+            self.latency_tracker.host(url).record_body(nbytes, time.time() - start_time)
+
+    def _sniff_image_header(self, chunks):
+        # returns the chunks read to parse the header (raising FilterException
+        # if the image should be filtered out)
+        parser = ImageFile.Parser()
+        head_chunks = []
+        nbytes = 0
+        for chunk in chunks:
+            head_chunks.append(chunk)
+            nbytes = nbytes + len(chunk)
             try:
-                with open(output_fn, 'wb') as out_file:
-                    shutil.copyfileobj(response.raw, out_file)
-            except Exception as e:
-                log.info('Exception while saving %s: %s' % (output_fn, str(e)))
+                parser.feed(chunk)
+            except Exception:
+                # leave it to the full check after the download
+                break
+            if parser.image is not None:
+                self._filter_image_properties(parser.image.size, parser.image.mode)
+                break
+            if nbytes >= HEADER_SNIFF_BYTES:
+                break
+        return head_chunks
+
+    @staticmethod
+    def _remove_file(fn):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
 
     def process_urls(self, urls, output_dir, completion_func=None,
-                     completion_worker_count=-1, completion_extra_prms=None, process_images=True):
+                     completion_worker_count=-1, completion_extra_prms=None, process_images=True,
+                     deadline=None, target_count=None, overshoot=TARGET_OVERSHOOT):
         """Process returned list of URL dicts returned from search client class
 
         Args:
@@ -129,19 +514,49 @@ class ImageGetter(ImageProcessor):
                 where out_dict is a dictionary of the same form as a single
                 entry in the return dict (i.e. containing 'orig_fn', 'clean_fn',
                 and 'thumb_fn' fields)
+            [deadline]: an optional Deadline (see imsearchtools.utils.deadline)
+                by which downloads and callbacks should have completed, in
+                addition to the `timeout` and `image_timeout` of the instance
+            [target_count]: if given, only the first `target_count` images
+                retrieved (in the order of `urls`, which can then be any
+                iterable) are returned, and URLs are processed in that order
+                only while they could still be needed - at most `overshoot`
+                more than the number of images still missing at a time.
+                Downloads no longer needed are cancelled.
 
             Returns:
-                A list of dictionaries of the form:
+                A ResultList (a list with a `partial` flag set if some of the
+                downloads or callbacks did not complete in time) of dictionaries
+                of the form:
                 [{'orig_fn':'/path/to/image/as/downloaded/directly/from/url',
                   'clean_fn':'/path/to/processed/and/validated/image',
                   'thumb_fn':'/path/to/thumbnail'},
                   ...]
+                If variants are defined in the settings (see
+                `ImageProcessorSettings.add_variant`), each dictionary also
+                contains a 'variant_fns' field mapping each variant name to
+                the path of that variant, and if perceptual hashing is enabled
+                a 'phash' field with the hash of the image (as a hex string)
+                - of each set of near-duplicates, only the image with the
+                best 'rank' (or the first processed, without ranks) is then
+                returned. No callback is made for images processed after a
+                near-duplicate with the same or a better rank, but one may
+                have been made for an image superseded by a better ranked
+                near-duplicate processed later.
 
         """
 
         # check input parameters
         if not urls:
             raise ValueError('At least one url must be specified for processing')
+        if target_count is not None:
+            if target_count < 1:
+                raise ValueError('target_count must be at least 1')
+            return self._process_urls_to_target(urls, output_dir, target_count, overshoot,
+                                                completion_func, completion_worker_count,
+                                                completion_extra_prms, process_images, deadline)
+
+        self._duplicate_filter = self._make_duplicate_filter()
 
         # prepare workers for callback if using callback function
         # returned process will end once all callbacks have been completed
@@ -151,19 +566,224 @@ class ImageGetter(ImageProcessor):
                                                      completion_worker_count)
 
         # launch main URL processor jobs
-        jobs = [gevent.spawn(self.process_url,
-                             urldata, output_dir,
-                             call_completion_func=(completion_func is not None),
-                             completion_extra_prms=completion_extra_prms, process_images=process_images,
-                             start_time=time.time())
+        jobs = [self._download_scheduler.spawn(urldata['url'], self.process_url,
+                                               urldata, output_dir,
+                                               call_completion_func=(completion_func is not None),
+                                               completion_extra_prms=completion_extra_prms,
+                                               process_images=process_images,
+                                               start_time=None, deadline=deadline)
                 for urldata in urls]
 
+        return self._join_process_url_jobs(jobs, time_left(deadline, self.timeout),
+                                           completion_func is not None, deadline)
+
+    def process_url_stream(self, url_iter, output_dir, completion_func=None,
+                           completion_worker_count=-1, completion_extra_prms=None, process_images=True,
+                           deadline=None):
+        """Process URL dicts from an iterator, as they become available
+
+        Equivalent to `process_urls`, but accepting any iterable of URL dicts
+        (e.g. the generator returned from `SearchClient.iter_query`). The
+        download of each URL is started as soon as it is produced by the
+        iterator, so images from the first page of results are downloaded while
+        further pages are still being retrieved. The `timeout` of the instance
+        is counted from the time the first URL is received. If `deadline` is
+        specified, no more URLs are taken from the iterator once it expires.
+
+            Returns:
+                A list of dictionaries of the same form as `process_urls`,
+                sorted by 'rank' if all URL dicts contain this field.
+        """
+
+        self._duplicate_filter = self._make_duplicate_filter()
+
+        # prepare workers for callback if using callback function - the number
+        # of tasks is unknown in advance, so it is increased as URLs arrive
+        if completion_func:
+            self._callback_handler = callback_handler.CallbackHandler(completion_func,
+                                                     0,
+                                                     completion_worker_count)
+
+        # launch main URL processor jobs as URLs are received
+        jobs = []
+        first_job_time = None
+        for urldata in url_iter:
+            if deadline is not None and deadline.expired():
+                break
+            if first_job_time is None:
+                first_job_time = time.time()
+            if completion_func:
+                self._callback_handler.add_tasks(1)
+            jobs.append(self._download_scheduler.spawn(urldata['url'], self.process_url,
+                                                       urldata, output_dir,
+                                                       call_completion_func=(completion_func is not None),
+                                                       completion_extra_prms=completion_extra_prms,
+                                                       process_images=process_images,
+                                                       start_time=None, deadline=deadline))
+
+        # the URL iterator may also have been cut short by the deadline
+        stream_cut = (deadline is not None and deadline.expired())
+        if not jobs:
+            return ResultList(partial=stream_cut)
+
+        timeout = max(0.0, self.timeout - (time.time() - first_job_time))
+        results = self._join_process_url_jobs(jobs, time_left(deadline, timeout),
+                                              completion_func is not None, deadline)
+        results.partial = results.partial or stream_cut
+
+        if all('rank' in out_dict for out_dict in results):
+            results.sort(key=lambda out_dict: out_dict['rank'])
+        return results
+
+    def iter_process_urls(self, urls, output_dir, ordered=False, reorder_window=REORDER_WINDOW,
+                          target_count=None, overshoot=TARGET_OVERSHOOT, process_images=True,
+                          deadline=None):
+        """Process a list of URL dicts, yielding each result as soon as it is ready
+
+        Equivalent to `process_urls` (without callbacks - the caller acts on
+        each result instead), but returning a generator of the dictionaries
+        of the processed images, in order of completion. If `ordered` is set,
+        they are yielded in the order of `urls` (i.e. by rank) instead: at
+        most `reorder_window` URLs past the next one to yield are processed
+        at any time, which bounds the number of results held back waiting for
+        an earlier one.
+
+        If `target_count` is given, iteration stops once that many images
+        have been yielded, and URLs are only taken from `urls` (which can
+        then be any iterable) as they could still be needed: at most
+        `overshoot` more than the number of images still missing are
+        processed at any time.
+
+        Iteration ends once all URLs have been processed, or when the
+        `timeout` of the instance (counted from the start of iteration,
+        including the time spent by the caller between results) or `deadline`
+        expires. Downloads still in progress are then cancelled, as they are
+        when the generator is closed (e.g. when the caller stops early).
+        """
+        if not urls:
+            raise ValueError('At least one url must be specified for processing')
+        if reorder_window < 1:
+            raise ValueError('reorder_window must be at least 1')
+        if target_count is not None and target_count < 1:
+            raise ValueError('target_count must be at least 1')
+        return self._iter_process_urls(urls, output_dir, ordered, reorder_window,
+                                       target_count, overshoot, process_images, deadline, {})
+
+    def _iter_process_urls(self, urls, output_dir, ordered, reorder_window, target_count,
+                           overshoot, process_images, deadline, status):
+        # (sets status['timed_out'] if iteration is cut short by the timeout or deadline)
+        self._duplicate_filter = self._make_duplicate_filter()
+
+        url_iter = iter(urls)
+        urls_left = True
+        # positions (in urls) of completed jobs, in order of completion
+        done = Queue()
+        jobs = []
+        running = 0
+        held = {}           # results completed before those of earlier URLs, by position
+        next_position = 0   # position of the next result to yield, if ordered
+        accepted = 0        # images yielded or held
+        yielded = 0
+        end_time = time.time() + self.timeout
+        try:
+            while True:
+                # launch jobs for the next URLs (within the window if ordered,
+                # and only while they could still be needed if there is a target)
+                while urls_left:
+                    if ordered and len(jobs) >= next_position + reorder_window:
+                        break
+                    if target_count is not None and (accepted >= target_count or
+                                                     running >= target_count - accepted + overshoot):
+                        break
+                    urldata = next(url_iter, None)
+                    if urldata is None:
+                        urls_left = False
+                        break
+                    job = self._download_scheduler.spawn(urldata['url'], self.process_url,
+                                                         urldata, output_dir,
+                                                         process_images=process_images,
+                                                         start_time=None, deadline=deadline)
+                    job.link(lambda job, position=len(jobs): done.put(position))
+                    jobs.append(job)
+                    running = running + 1
+                if not running:
+                    return
+
+                try:
+                    position = done.get(timeout=time_left(deadline, max(0.0, end_time - time.time())))
+                except Empty:
+                    log.info('Timeout occurred when iterating over processed URLs')
+                    status['timed_out'] = True
+                    return
+                running = running - 1
+                out_dict = jobs[position].value if jobs[position].successful() else None
+                if out_dict:
+                    accepted = accepted + 1
+
+                held[position] = out_dict
+                while held:
+                    if ordered:
+                        if next_position not in held:
+                            break
+                        out_dict = held.pop(next_position)
+                        next_position = next_position + 1
+                    else:
+                        out_dict = held.popitem()[1]
+                    if out_dict and self._superseded(out_dict):
+                        accepted = accepted - 1
+                        out_dict = None
+                    if out_dict:
+                        yield out_dict
+                        yielded = yielded + 1
+                        if target_count is not None and yielded >= target_count:
+                            return
+        finally:
+            # cancel the jobs still waiting for a download slot or in progress
+            gevent.killall([job for job in jobs if not job.ready()], block=False)
+
+    def _process_urls_to_target(self, urls, output_dir, target_count, overshoot, completion_func,
+                                completion_worker_count, completion_extra_prms, process_images,
+                                deadline):
+        # process the URLs in order until `target_count` images have been
+        # retrieved, running callbacks for these images only
+        if completion_func:
+            self._callback_handler = callback_handler.CallbackHandler(completion_func,
+                                                     0,
+                                                     completion_worker_count)
+        status = {}
+        results = ResultList()
+        for out_dict in self._iter_process_urls(urls, output_dir, True, REORDER_WINDOW, target_count,
+                                                overshoot, process_images, deadline, status):
+            results.append(out_dict)
+            # (no callback for pictures already retrieved from another URL)
+            if completion_func and out_dict.get('duplicate_of') is None:
+                self._callback_handler.add_tasks(1)
+                if completion_extra_prms:
+                    self._callback_handler.run_callback(out_dict, completion_extra_prms)
+                else:
+                    self._callback_handler.run_callback(out_dict)
+
+        results.partial = status.get('timed_out', False)
+        if completion_func and not self._callback_handler.join(deadline):
+            results.partial = True
+        return results
+
+    def _join_process_url_jobs(self, jobs, timeout, use_callbacks, deadline=None):
         # wait for all URL processor jobs to complete
-        gevent.joinall(jobs, timeout=self.timeout)
+        gevent.joinall(jobs, timeout=timeout)
         log.info('all process_url jobs joined!')
+        partial = not all(job.ready() for job in jobs)
+
+        # downloads still waiting for a free slot are not started anymore (and
+        # will not report to the callback handler themselves)
+        pending_jobs = [job for job in jobs if not job.started and not job.ready()]
+        gevent.killall(pending_jobs, block=False)
+        if use_callbacks:
+            for _ in pending_jobs:
+                self._callback_handler.skip()
 
         # if using callbacks, wait for all callbacks to complete before continuing
-        if completion_func:
+        if use_callbacks:
             # detect if timeout occurred by iterating through jobs and using 'get', which
             # will re-raise the Timeout exception for any jobs
             timeout_occurred = False
@@ -180,16 +800,19 @@ class ImageGetter(ImageProcessor):
             # (as timeout will cause uncompleted gevent jobs to be forcibly ended
             #  thus never returning to allow job manager to in turn return)
             if not timeout_occurred:
-                self._callback_handler.join()
+                if not self._callback_handler.join(deadline):
+                    partial = True
             else:
                 log.info('Timeout occurred when processing jobs')
                 self._callback_handler.terminate()
 
         # construct return list of filenames
-        results = []
+        results = ResultList(partial=partial)
 
+        # (killed jobs have a GreenletExit as their value)
         for job in jobs:
-            if job.value:
+            if (job.successful() and isinstance(job.value, dict) and
+                not self._superseded(job.value)):
                 results.append(job.value)
 
         return results
@@ -8,16 +8,34 @@ Created on: 19 Oct 2012
 """
 
 import os
+import io
+import re
+import math
+import hashlib
 from urllib.parse import urlparse
 import logging
+from collections import OrderedDict
 from PIL import Image as PILImage
 from . import imutils
+from . import phash
+from .image_store import link_or_copy
 
 log = logging.getLogger(__name__)
 
 class FilterException(Exception):
     pass
 
+# names of variants (used in their filenames)
+VARIANT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+
+# (h, w) size to fit images into when only decoding them to compute their hash
+PHASH_SOURCE_SHAPE = (64, 64)
+
+# content types of responses which are never images (error pages etc.)
+REJECTED_CONTENT_TYPES = ('text/', 'application/json', 'application/xml',
+                          'application/xhtml', 'application/javascript',
+                          'audio/', 'video/')
+
 
 class ImageProcessorSettings(object):
     """
@@ -29,6 +47,29 @@ class ImageProcessorSettings(object):
         conversion - settings related to the standardization and re-writing of
             downloaded images
         thumbnail - settings related to the generation of thumbnails for downloaded images
+        variants - a list of additional named outputs (e.g. a preview size),
+            added by calling `add_variant()`
+        phash - settings related to perceptual hashing: if enabled, a hash of
+            each image is computed (see phash.dhash) and ImageGetter drops
+            images within `max_distance` bits of an image already returned
+            for the same set of URLs (-1 to keep all near-duplicates)
+
+    All outputs (the clean image, the thumbnail and the variants) define how images are downsized:
+    `resample` is the name of the filter used (see imutils.RESAMPLE_FILTERS)
+    and `reducing_gap` trades quality for speed. If it is set, JPEGs are
+    decoded at a reduced scale (draft mode) and images are reduced by an
+    integer factor before the final resample, as long as the image stays at
+    least `reducing_gap` times larger than the output - the larger the gap,
+    the closer the result to a full resample (e.g. 2.0 or 3.0). If it is
+    None (the default), the full image is always decoded and resampled
+    (slowest, best quality). `quality` is the
+    encoder quality (e.g. 1-95 for JPEG), or None for the PIL default.
+
+    If `conversion['passthrough']` is set, originals which are already RGB
+    JPEGs within the maximum size (as read from their header) are hard linked
+    or copied as the clean image instead of being decoded and re-encoded -
+    the clean image is then byte-identical to the original, including its
+    metadata, and the `quality` setting does not apply to it.
     """
 
     def __init__(self):
@@ -37,12 +78,17 @@ class ImageProcessorSettings(object):
                            max_width=10000,
                            max_height=10000,
                            max_size_bytes=2*4*1024*1024,  #2 MP
+                           max_file_bytes=32*1024*1024,
                            remove_flickr_placeholders=False)
 
         self.conversion = dict(format='jpg',
                                suffix='-clean',
                                max_width=10000,
                                max_height=10000,
+                               resample='lanczos',
+                               reducing_gap=None,
+                               quality=None,
+                               passthrough=False,
                                subdir='')
 
         self.thumbnail = dict(format='jpg',
@@ -50,7 +96,51 @@ class ImageProcessorSettings(object):
                               subdir='',
                               width=90,
                               height=90,
-                              pad_to_size=True)
+                              pad_to_size=True,
+                              resample='lanczos',
+                              reducing_gap=None,
+                              quality=None)
+
+        self.variants = []
+
+        self.phash = dict(enabled=False,
+                          max_distance=phash.MAX_DISTANCE)
+
+    def add_variant(self, name, width, height, format='jpg', quality=None,
+                    pad_to_size=False, resample='lanczos', reducing_gap=None, subdir=''):
+        """Add an output of at most `width` x `height` pixels named `name`
+
+        Each variant is saved alongside the clean image and thumbnail (as
+        '<image_id>-<name>-<width>x<height>.<format>'), and its filename is
+        returned under `name` in the 'variant_fns' field of the results.
+
+        Raises ValueError if any of the settings is invalid.
+        """
+        if not isinstance(name, str) or not VARIANT_NAME_PATTERN.match(name):
+            raise ValueError('Invalid variant name: %r' % (name,))
+        if name in ('clean', 'thumb', 'phash') or name in [variant['name'] for variant in self.variants]:
+            raise ValueError('Variant name already used: %s' % name)
+        for size in (width, height):
+            if not isinstance(size, int) or isinstance(size, bool) or size < 1:
+                raise ValueError('Invalid variant size: %r' % (size,))
+        if not isinstance(format, str) or not imutils.is_image_format(format):
+            raise ValueError('Unknown image format: %r' % (format,))
+        if quality is not None and (not isinstance(quality, int) or not 1 <= quality <= 100):
+            raise ValueError('Invalid variant quality: %r' % (quality,))
+        if not isinstance(resample, str):
+            raise ValueError('Unknown resample filter: %r' % (resample,))
+        imutils.resample_filter(resample)
+        if reducing_gap is not None and (not isinstance(reducing_gap, (int, float)) or reducing_gap < 1.0):
+            raise ValueError('Invalid variant reducing_gap: %r' % (reducing_gap,))
+        self.variants.append(dict(name=name,
+                                  width=width,
+                                  height=height,
+                                  format=format,
+                                  quality=quality,
+                                  pad_to_size=pad_to_size,
+                                  resample=resample,
+                                  reducing_gap=reducing_gap,
+                                  subdir=subdir))
 
     
 class ImageProcessor(object):
@@ -89,52 +179,168 @@ class ImageProcessor(object):
             thumb_fn = os.path.join(self.opts.thumbnail['subdir'], thumb_fn)
         return thumb_fn
 
+    def _variant_filename_from_filename(self, fn, variant):
+        variant_fn = '%s-%s-%dx%d.%s' % (os.path.splitext(fn)[0], variant['name'],
+                                         variant['width'], variant['height'],
+                                         variant['format'].lower())
+        if variant['subdir']:
+            variant_fn = os.path.join(variant['subdir'], variant_fn)
+        return variant_fn
+
+    def _output_filenames(self, fn):
+        # filename of each output (the clean image, thumbnail and variants) by name
+        out_fns = OrderedDict([('clean', self._clean_filename_from_filename(fn)),
+                               ('thumb', self._thumb_filename_from_filename(fn))])
+        for variant in self.opts.variants:
+            out_fns[variant['name']] = self._variant_filename_from_filename(fn, variant)
+        return out_fns
+
+    def _output_settings(self):
+        # settings of each output by name, with the (h, w) `shape` it should fit in
+        conversion = self.opts.conversion
+        thumbnail = self.opts.thumbnail
+        settings = OrderedDict([
+            ('clean', dict(conversion, pad_to_size=False,
+                           shape=(conversion['max_height'], conversion['max_width']))),
+            ('thumb', dict(thumbnail, shape=(thumbnail['height'], thumbnail['width'])))])
+        for variant in self.opts.variants:
+            settings[variant['name']] = dict(variant, shape=(variant['height'], variant['width']))
+        return settings
+
     # Process image and standardize it
-    def process_image(self, fn):
+    def process_image(self, fn, data=None):
         """
         Process a single image, saving a cleaned up version of the image + thumbnail
 
         Args:
             fn: the filename of the image to process
+            [data]: the contents of the image file, if already in memory (in
+                which case it is decoded from memory, and `fn` is only used
+                to name the output files and does not need to exist)
 
         Returns:
             A tuple (clean_fn, thumb_fn) containing the filenames of the saved
-            cleaned up image and thumbnail
+            cleaned up image and thumbnail (see `process_image_outputs` for
+            the filenames of the variants)
+        """
+        out_fns = self.process_image_outputs(fn, data)
+        return out_fns['clean'], out_fns['thumb']
+
+    def process_image_outputs(self, fn, data=None):
+        """
+        Process a single image, saving the clean image, thumbnail and variants
+
+        The image is decoded once, and the outputs are resized from it in
+        order of decreasing size, each from the previous one.
+
+        Returns:
+            An ordered dict mapping 'clean', 'thumb' and the name of each
+            variant to the filename of the saved output, and (if enabled in
+            the `phash` settings) 'phash' to the perceptual hash of the image
         """
-        im = imutils.LazyImage(fn)
-        self._filter_image(fn)
-
-        # write converted version
-        clean_fn = self._clean_filename_from_filename(fn)
-        if not imutils.image_exists(clean_fn):
-            if self.opts.filter['remove_flickr_placeholders']:
-                self._filter_flickr_placeholder(fn)
-            convimg = imutils.downsize_by_max_dims(im.image,
-                                                   (self.opts.conversion['max_height'],
-                                                    self.opts.conversion['max_width']))
-            imutils.save_image(clean_fn, convimg)
-        else:
-            log.info('Converted image available: %s', clean_fn)
-
-        # write thumbnail
-        thumb_fn = self._thumb_filename_from_filename(fn)
-        if not imutils.image_exists(thumb_fn):
-            thumbnail = imutils.create_thumbnail(im.image,
-                                                 (self.opts.thumbnail['height'],
-                                                  self.opts.thumbnail['width']))
-            imutils.save_image(thumb_fn, thumbnail)
-        else:
-            log.info('Thumbnail image available: %s', thumb_fn)
-
-        return clean_fn, thumb_fn
+        # PIL only reads the header until the image data is requested
+        im = PILImage.open(fn if data is None else io.BytesIO(data))
+        self._filter_image_properties(im.size, im.mode)
+
+        # sizes are computed from the original size, as decoding in draft
+        # mode may give an image of a (slightly) different aspect ratio
+        out_fns = self._output_filenames(fn)
+        outputs = []
+        for name, settings in self._output_settings().items():
+            if imutils.image_exists(out_fns[name]):
+                log.info('Output image available: %s', out_fns[name])
+            else:
+                outputs.append((name, out_fns[name], settings,
+                                imutils.fit_size(im.size, settings['shape'])))
+        compute_hash = self.opts.phash['enabled']
+        if not (outputs or compute_hash):
+            return out_fns
+
+        if (outputs and self.opts.filter['remove_flickr_placeholders'] and
+            not imutils.image_exists(out_fns['clean'])):
+            self._filter_flickr_placeholder(fn, data)
+
+        # a clean image which would only be a re-encoded copy of the original
+        # is linked (or copied) from it instead
+        if outputs and outputs[0][0] == 'clean' and self._conforms_to_conversion(im):
+            log.info('Original used as converted image: %s', out_fns['clean'])
+            if data is None:
+                link_or_copy(fn, out_fns['clean'])
+            else:
+                with open(out_fns['clean'], 'wb') as out_file:
+                    out_file.write(data)
+            outputs = outputs[1:]
+            if not (outputs or compute_hash):
+                return out_fns
+
+        draft_outputs = [(size, settings['reducing_gap']) for _, _, settings, size in outputs]
+        if compute_hash:
+            draft_outputs.append((imutils.fit_size(im.size, PHASH_SOURCE_SHAPE), 1.0))
+        im = imutils.decode_image(im, self._draft_size(im.size, draft_outputs))
+
+        outputs.sort(key=lambda output: output[3][0]*output[3][1], reverse=True)
+        source = im
+        for _, out_fn, settings, size in outputs:
+            if source.size[0] < size[0] or source.size[1] < size[1]:
+                source = im
+            resized = imutils.resize_image(source, size,
+                                           imutils.resample_filter(settings['resample']),
+                                           settings['reducing_gap'])
+            if settings['pad_to_size']:
+                imutils.save_image(out_fn, imutils.pad_image(resized, settings['shape']),
+                                   settings['quality'])
+            else:
+                imutils.save_image(out_fn, resized, settings['quality'])
+            source = resized
+
+        # the hash is computed from the smallest (unpadded) output
+        if compute_hash:
+            out_fns['phash'] = phash.hash_to_hex(phash.dhash(source))
+
+        return out_fns
+
+    def _conforms_to_conversion(self, im):
+        # whether the original (of which only the header has been read) is
+        # already a JPEG of the mode and size the clean image would have
+        conversion = self.opts.conversion
+        return (conversion['passthrough'] and
+                conversion['format'].lower() in ('jpg', 'jpeg') and
+                im.format == 'JPEG' and im.mode == 'RGB' and
+                im.size[0] <= conversion['max_width'] and
+                im.size[1] <= conversion['max_height'])
+
+    @staticmethod
+    def _draft_size(size, outputs):
+        # smallest size at which an image of `size` can be decoded so that it
+        # is still at least `reducing_gap` times larger than each of the
+        # outputs, given as (output size, reducing_gap) tuples - or None if
+        # any output needs the full image
+        if not outputs:
+            return None
+        draft_w, draft_h = 0, 0
+        for out_size, reducing_gap in outputs:
+            if reducing_gap is None or tuple(out_size) == tuple(size):
+                return None
+            draft_w = max(draft_w, int(math.ceil(out_size[0]*reducing_gap)))
+            draft_h = max(draft_h, int(math.ceil(out_size[1]*reducing_gap)))
+        return (draft_w, draft_h)
 
     def _filter_image(self, fn):
+        # (fn may also be a file object)
         # This is faster than reading the full image into memory: the PIL open
         # function is lazy and only reads the header until the data is requested
         im = PILImage.open(fn)
-        w, h = im.size
+        self._filter_image_properties(im.size, im.mode)
+
+    @staticmethod
+    def _estimate_image_bytes(size, mode):
         # This is an in memory size *estimate*
-        nbytes = w * h * len(im.mode)
+        w, h = size
+        return w * h * len(mode)
+
+    def _filter_image_properties(self, size, mode):
+        w, h = size
+        nbytes = self._estimate_image_bytes(size, mode)
 
         if w < self.opts.filter['min_width']:
             raise FilterException('w < min_width')
@@ -147,8 +353,31 @@ class ImageProcessor(object):
         if nbytes > self.opts.filter['max_size_bytes']:
             raise FilterException('nbytes > max_size_bytes')
 
-    def _filter_flickr_placeholder(self, fn):
-        import hashlib
-        with open(fn) as fid:
-            if hashlib.sha256(fid.read()).hexdigest() == '0f28f49410a89e24c95acfd345210cc6f2294814584ad7c60f698fee74e46aad':
-                raise FilterException('Flickr placeholder image filtered')
+    def _filter_response_headers(self, headers):
+        # reject responses which are clearly not (acceptable) images before
+        # downloading their body
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type.startswith(REJECTED_CONTENT_TYPES):
+            raise FilterException('content type %s' % content_type)
+        content_length = headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            self._filter_file_size(int(content_length))
+
+    def _filter_file_size(self, nbytes):
+        if nbytes > self.opts.filter['max_file_bytes']:
+            raise FilterException('file size > max_file_bytes')
+
+    def _filter_flickr_placeholder(self, fn, data=None):
+        if data is None:
+            with open(fn, 'rb') as fid:
+                data = fid.read()
+        if hashlib.sha256(data).hexdigest() == '0f28f49410a89e24c95acfd345210cc6f2294814584ad7c60f698fee74e46aad':
+            raise FilterException('Flickr placeholder image filtered')
+
+def process_image_outputs_with_settings(opts, fn, data=None):
+    """Run `ImageProcessor.process_image` with settings `opts`
+
+    Used to process images in the worker processes of a ProcessPool, and
+    returns the filenames of all outputs (see `process_image_outputs`).
+    """
+    return ImageProcessor(opts).process_image_outputs(fn, data)
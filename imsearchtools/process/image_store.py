@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+Module: image_store
+Content-addressed store of downloaded images shared across queries and
+output directories.
+
+Downloaded originals are stored once per content hash (and derived images,
+i.e. clean versions and thumbnails, once per content hash and settings), and
+an index maps canonical URLs to content hashes so that a URL seen before is
+not downloaded again. Files are made available in each output directory as
+hard links to the stored copy (or as copies where hard links are not
+supported), and each such reference is recorded so that stored files which
+are no longer referenced can be garbage collected.
+
+Store calls block the whole process while they wait for the index (e.g.
+while another process writes to it), so they only wait DB_TIMEOUT seconds,
+after which the store is skipped: lookups are treated as misses, and
+images are not added.
+"""
+
+import os
+import time
+import errno
+import shutil
+import sqlite3
+import hashlib
+import logging
+import functools
+
+from imsearchtools.utils.urls import canonical_url
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64*1024
+
+# seconds to wait for a locked index before skipping the store
+DB_TIMEOUT = 0.5
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, path TEXT NOT NULL,
+                                  size INTEGER NOT NULL, last_used REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, content_hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS refs (path TEXT PRIMARY KEY, key TEXT NOT NULL,
+                                 linked INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS refs_key ON refs (key);
+CREATE INDEX IF NOT EXISTS urls_content_hash ON urls (content_hash);
+'''
+
+def file_hash(fn):
+    sha1 = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def link_or_copy(src_fn, dst_fn):
+    """Hard link `src_fn` to `dst_fn` (replacing it), copying if linking fails
+
+    Returns True if a hard link was made.
+    """
+    tmp_fn = dst_fn + '.tmp%d' % os.getpid()
+    try:
+        os.link(src_fn, tmp_fn)
+        linked = True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src_fn, tmp_fn)
+        linked = False
+    os.replace(tmp_fn, dst_fn)
+    return linked
+
+def _skip_if_unavailable(default):
+    # decorator for store calls, returning `default` (instead of raising)
+    # if the index could not be used, e.g. as it stayed locked for DB_TIMEOUT
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                log.warning('Skipped image store for %s (%s)', func.__name__, str(e))
+                return default
+        return wrapper
+    return decorator
+
+class ImageStore(object):
+    """
+    Content-addressed image store rooted at `root_dir`
+
+    The store (and its sqlite index) is only created on first use. Keys of
+    stored files are the SHA-1 of the content of originals, or
+    '<content hash>/<variant>' for derived images, where the variant name
+    identifies the settings used to create them.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._db = None
+
+    # Index
+    @property
+    def db(self):
+        if self._db is None:
+            if not os.path.isdir(self.root_dir):
+                os.makedirs(self.root_dir)
+            self._db = sqlite3.connect(os.path.join(self.root_dir, 'index.sqlite'),
+                                       timeout=DB_TIMEOUT, isolation_level=None)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _blob_fn(self, key, extension):
+        name = key.replace('/', '-') + extension
+        return os.path.join(self.root_dir, 'blobs', key[:2], name)
+
+    def _get_blob(self, key):
+        row = self.db.execute('SELECT path FROM blobs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row[0]):
+            # removed from outside the store
+            self._remove_blob(key)
+            return None
+        self.db.execute('UPDATE blobs SET last_used = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def _add_blob(self, key, fn):
+        """Store `fn` under `key` (unless already stored), and make `fn` a reference to it"""
+        blob_fn = self._get_blob(key)
+        if blob_fn is None:
+            blob_fn = self._blob_fn(key, os.path.splitext(fn)[1])
+            if not os.path.isdir(os.path.dirname(blob_fn)):
+                os.makedirs(os.path.dirname(blob_fn))
+            link_or_copy(fn, blob_fn)
+            try:
+                self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)',
+                                (key, blob_fn, os.path.getsize(blob_fn), time.time()))
+            except sqlite3.OperationalError:
+                # (not left in the store directory without being indexed)
+                os.remove(blob_fn)
+                raise
+            linked = os.path.samefile(fn, blob_fn)
+        else:
+            # same content already stored (e.g. from another URL)
+            linked = link_or_copy(blob_fn, fn)
+        self._add_ref(fn, key, linked)
+
+    def _link_blob(self, key, fn):
+        """Make `fn` a reference to the file stored under `key` (False if not stored)"""
+        blob_fn = self._get_blob(key)
+        if blob_fn is None:
+            return False
+        out_dir = os.path.dirname(fn)
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        linked = link_or_copy(blob_fn, fn)
+        try:
+            self._add_ref(fn, key, linked)
+        except sqlite3.OperationalError:
+            # (so that `fn` is not written to as a link to the stored file)
+            os.remove(fn)
+            raise
+        return True
+
+    def _add_ref(self, fn, key, linked):
+        self.db.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                        (os.path.abspath(fn), key, int(linked)))
+
+    def _remove_blob(self, key):
+        row = self.db.execute('SELECT path FROM blobs WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            try:
+                os.remove(row[0])
+            except OSError:
+                pass
+        self.db.execute('DELETE FROM blobs WHERE key = ?', (key,))
+        self.db.execute('DELETE FROM urls WHERE content_hash = ?', (key,))
+
+    # Originals
+    @_skip_if_unavailable(None)
+    def link_url(self, url, fn):
+        """Make `fn` a reference to the stored download of `url`
+
+        Returns the content hash of the image, or None if `url` has not been
+        downloaded before (or the store is unavailable, see DB_TIMEOUT), in
+        which case `fn` is left untouched.
+        """
+        row = self.db.execute('SELECT content_hash FROM urls WHERE url = ?',
+                              (canonical_url(url),)).fetchone()
+        if row is None or not self._link_blob(row[0], fn):
+            return None
+        return row[0]
+
+    def add_url(self, url, fn, content_hash=None):
+        """Add the image downloaded from `url` to `fn` to the store
+
+        If an image with the same content is already stored, `fn` is replaced
+        by a reference to it. Returns the content hash of the image (which
+        can be given as `content_hash` if already computed), whether or not
+        the store was available.
+        """
+        if content_hash is None:
+            content_hash = file_hash(fn)
+        self._add_url(url, fn, content_hash)
+        return content_hash
+
+    @_skip_if_unavailable(None)
+    def _add_url(self, url, fn, content_hash):
+        self._add_blob(content_hash, fn)
+        self.db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)',
+                        (canonical_url(url), content_hash))
+
+    # Derived images
+    @_skip_if_unavailable(False)
+    def link_derived(self, content_hash, variant, fn):
+        """Make `fn` a reference to a stored derived image (False if not stored)"""
+        return self._link_blob('%s/%s' % (content_hash, variant), fn)
+
+    @_skip_if_unavailable(None)
+    def add_derived(self, content_hash, variant, fn):
+        self._add_blob('%s/%s' % (content_hash, variant), fn)
+
+    # Maintenance
+    def gc(self, min_age=0.0):
+        """Remove stored files without references which were not used for `min_age` seconds
+
+        References whose file was deleted (or, for hard links, replaced by
+        another file) are dropped first. Returns the number of files removed.
+        """
+        for path, key, linked in self.db.execute('SELECT path, key, linked FROM refs').fetchall():
+            blob = self.db.execute('SELECT path FROM blobs WHERE key = ?', (key,)).fetchone()
+            try:
+                valid = (blob is not None and os.path.exists(path) and
+                         (not linked or os.path.samefile(path, blob[0])))
+            except OSError:
+                valid = False
+            if not valid:
+                self.db.execute('DELETE FROM refs WHERE path = ?', (path,))
+
+        unreferenced = self.db.execute(
+            'SELECT key FROM blobs WHERE last_used <= ? AND '
+            'NOT EXISTS (SELECT 1 FROM refs WHERE refs.key = blobs.key)',
+            (time.time() - min_age,)).fetchall()
+        for (key,) in unreferenced:
+            self._remove_blob(key)
+        log.info('Removed %d unreferenced files from image store', len(unreferenced))
+        return len(unreferenced)
+
+    def ref_count(self, key):
+        return self.db.execute('SELECT COUNT(*) FROM refs WHERE key = ?', (key,)).fetchone()[0]
+
+    def stats(self):
+        blob_count, total_bytes = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return dict(files=blob_count,
+                    bytes=total_bytes,
+                    urls=self.db.execute('SELECT COUNT(*) FROM urls').fetchone()[0],
+                    refs=self.db.execute('SELECT COUNT(*) FROM refs').fetchone()[0])
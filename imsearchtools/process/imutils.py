@@ -17,17 +17,47 @@ def image_exists(fn):
         return False
     return True
 
-def load_image(fn):
-    im = PILImage.open(fn)
+# names of the resampling filters which can be given in ImageProcessorSettings
+RESAMPLE_FILTERS = {'nearest': PILImage.NEAREST,
+                    'box': PILImage.BOX,
+                    'bilinear': PILImage.BILINEAR,
+                    'hamming': PILImage.HAMMING,
+                    'bicubic': PILImage.BICUBIC,
+                    'lanczos': PILImage.LANCZOS}
+
+def resample_filter(name):
+    try:
+        return RESAMPLE_FILTERS[name.lower()]
+    except KeyError:
+        raise ValueError('Unknown resample filter: %s' % name)
+
+def is_image_format(extension):
+    # whether PIL can save images with filename extension `extension` (e.g. 'jpg')
+    PILImage.init()
+    return ('.' + extension.lower()) in PILImage.registered_extensions()
+
+def decode_image(im, draft_size=None):
+    # decode an image opened with PILImage.open (which only reads the header)
+    # - JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) which
+    # still gives an image of at least `draft_size`, which is much faster
+    if draft_size is not None and im.format == 'JPEG':
+        im.draft(None, draft_size)
     if im.mode != "RGB":
         im = im.convert("RGB")
     return im
 
-def save_image(fn, im):
-    im.save(fn)
+def load_image(fn, draft_size=None):
+    return decode_image(PILImage.open(fn), draft_size)
+
+def save_image(fn, im, quality=None):
+    if quality is None:
+        im.save(fn)
+    else:
+        im.save(fn, quality=quality)
 
-def downsize_by_max_dims(im, shape=(10000, 10000)):
-    w, h = im.size
+def fit_size(size, shape=(10000, 10000)):
+    # size (w, h) of an image of `size` downsized to fit within `shape` (h, w)
+    w, h = size
     sf = 1.0
     if h > shape[0]:
         sf = float(shape[0])/h
@@ -36,22 +66,32 @@ def downsize_by_max_dims(im, shape=(10000, 10000)):
         if sf2 < sf:
             sf = sf2
     if sf < 1.0:
-        resized = im.resize((int(sf*w), int(sf*h)), PILImage.ANTIALIAS)
-        return resized
-
-    return im
+        return (max(1, int(sf*w)), max(1, int(sf*h)))
+    return (w, h)
 
+def resize_image(im, size, resample=PILImage.LANCZOS, reducing_gap=None):
+    # if `reducing_gap` is set, the image is first reduced by an integer
+    # factor (fast) to no less than `reducing_gap` times `size`
+    if im.size == tuple(size):
+        return im
+    return im.resize(size, resample, reducing_gap=reducing_gap)
 
-def create_thumbnail(im, shape=(128, 128), pad_to_size=True):
-    resized = downsize_by_max_dims(im, shape)
+def pad_image(im, shape):
+    # centre `im` in a black image of `shape` (h, w)
+    padded = PILImage.new('RGB', (shape[1], shape[0]))
     nw, nh = im.size
-    resized = im.resize((nw, nh), PILImage.ANTIALIAS)
+    padded.paste(im, (int((shape[1] - nw) / 2.0), int((shape[0] - nh) / 2.0)))
+    return padded
+
+def downsize_by_max_dims(im, shape=(10000, 10000), resample=PILImage.LANCZOS,
+                         reducing_gap=None):
+    return resize_image(im, fit_size(im.size, shape), resample, reducing_gap)
+
+def create_thumbnail(im, shape=(128, 128), pad_to_size=True, resample=PILImage.LANCZOS,
+                     reducing_gap=None):
+    resized = downsize_by_max_dims(im, shape, resample, reducing_gap)
     if pad_to_size:
-        thumbnail = PILImage.new('RGB', shape)
-        cx = int((shape[1] - nw) / 2.0)
-        cy = int((shape[0] - nh) / 2.0)
-        thumbnail.paste(resized, (cy, cx))
-        return thumbnail
+        return pad_image(resized, shape)
 
     return resized
 
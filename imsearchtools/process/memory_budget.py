@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Module: memory_budget
+Process-wide budget for the memory of decoded images, so that bursts of
+large images are decoded a few at a time instead of all at once.
+
+Before decoding an image, its (estimated) decoded size is reserved from the
+budget - waiting if the budget is exhausted - and released once processing
+ends. Waiting greenlets are admitted in order of arrival, so large images
+are not starved by a stream of small ones.
+"""
+
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+from gevent.event import Event
+
+log = logging.getLogger(__name__)
+
+# default budget for all images being decoded at the same time in the process
+MEMORY_BUDGET_BYTES = 1024*1024*1024
+
+class MemoryBudgetTimeout(Exception):
+    pass
+
+class MemoryBudget(object):
+    """Bounds the total size of the reservations held at the same time
+
+    `reserve(nbytes)` blocks the calling greenlet until `nbytes` fit in the
+    budget (reservations larger than the whole budget are reduced to it, so
+    that they are admitted on their own), and `release(nbytes)` returns them.
+    `reserved(nbytes)` is a context manager doing both.
+    """
+    def __init__(self, total_bytes=MEMORY_BUDGET_BYTES):
+        if total_bytes < 1:
+            raise ValueError('Memory budget must be at least 1 byte')
+        self.total_bytes = total_bytes
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.reserve_count = 0
+        self.wait_count = 0
+        self.wait_time = 0.0
+        self._waiters = deque()  # [nbytes, event] of each waiting greenlet
+
+    def reserve(self, nbytes, timeout=None):
+        """Reserve `nbytes`, returning the number of bytes actually reserved
+
+        Raises MemoryBudgetTimeout if they could not be reserved within
+        `timeout` seconds.
+        """
+        nbytes = max(0, min(nbytes, self.total_bytes))
+        self.reserve_count = self.reserve_count + 1
+        if not self._waiters and self.used_bytes + nbytes <= self.total_bytes:
+            self._take(nbytes)
+            return nbytes
+
+        waiter = [nbytes, Event()]
+        self._waiters.append(waiter)
+        self.wait_count = self.wait_count + 1
+        start_time = time.time()
+        try:
+            if not waiter[1].wait(timeout):
+                raise MemoryBudgetTimeout('%d bytes not available within %.1fs' % (nbytes, timeout))
+        except BaseException:
+            if waiter[1].is_set():
+                # (admitted while being killed)
+                self.release(nbytes)
+            else:
+                self._waiters.remove(waiter)
+                self._admit_waiters()
+            raise
+        finally:
+            self.wait_time = self.wait_time + (time.time() - start_time)
+        return nbytes
+
+    def release(self, nbytes):
+        self.used_bytes = self.used_bytes - nbytes
+        self._admit_waiters()
+
+    @contextmanager
+    def reserved(self, nbytes, timeout=None):
+        nbytes = self.reserve(nbytes, timeout)
+        try:
+            yield nbytes
+        finally:
+            self.release(nbytes)
+
+    def stats(self):
+        return dict(total_bytes=self.total_bytes,
+                    used_bytes=self.used_bytes,
+                    peak_bytes=self.peak_bytes,
+                    waiting=len(self._waiters),
+                    reserve_count=self.reserve_count,
+                    wait_count=self.wait_count,
+                    wait_time=self.wait_time)
+
+    def _take(self, nbytes):
+        self.used_bytes = self.used_bytes + nbytes
+        self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+
+    def _admit_waiters(self):
+        # admit waiting greenlets in order of arrival while they fit
+        while self._waiters and self.used_bytes + self._waiters[0][0] <= self.total_bytes:
+            nbytes, event = self._waiters.popleft()
+            self._take(nbytes)
+            event.set()
+
+_memory_budget = None
+
+def get_memory_budget():
+    """Return the memory budget shared by the whole process"""
+    global _memory_budget
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget()
+    return _memory_budget
+
+def set_memory_budget(memory_budget):
+    """Use `memory_budget` for all ImageGetter instances created from now on"""
+    global _memory_budget
+    _memory_budget = memory_budget
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+Module: phash
+Perceptual hashing of images, to detect the same picture downloaded at
+different sizes, compressions or slightly different crops.
+
+Hashes are 64-bit difference hashes (dHash): the image is reduced to a 9x8
+grayscale image, and each bit records whether a pixel is brighter than its
+left neighbour. Similar pictures have hashes which differ in few bits (a
+small Hamming distance).
+"""
+
+from PIL import Image as PILImage
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE*HASH_SIZE
+
+# default maximum Hamming distance between the hashes of near-duplicates
+MAX_DISTANCE = 4
+
+def dhash(im, hash_size=HASH_SIZE):
+    """Return the difference hash of PIL image `im` as an integer"""
+    small = im.convert('L').resize((hash_size + 1, hash_size), PILImage.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row*(hash_size + 1) + col
+            value = (value << 1) | int(pixels[offset + 1] > pixels[offset])
+    return value
+
+def hash_to_hex(value):
+    # (hashes are returned as strings, as 64-bit integers do not survive JSON
+    # encoding in all clients)
+    return '%016x' % value
+
+def hash_from_hex(hex_value):
+    return int(hex_value, 16)
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+def hamming_distances(value, hashes):
+    """Return the Hamming distance of 64-bit hash `value` to each of `hashes`"""
+    return [hamming_distance(value, other) for other in hashes]
+
+class NearDuplicateFilter(object):
+    """Detects near-duplicates within a set of images (e.g. a result set)
+
+    `check(value, rank, key)` returns the hash of a previously checked image
+    with the same or a better (lower) rank which is within `max_distance`
+    bits of `value`, or None if there is none - in which case `value` is
+    added to the set. Images without a rank rank after all others, in order
+    of checking. Images in the set within `max_distance` bits of an image
+    with a better rank checked later are removed from it, and
+    `superseded(key)` is then True for their key.
+    """
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._hashes = []
+        self._ranks = []
+        self._keys = []
+        self._superseded = set()
+
+    def check(self, value, rank=None, key=None):
+        if rank is None:
+            rank = float('inf')
+        distances = hamming_distances(value, self._hashes)
+        near = [index for index in range(len(self._hashes))
+                if distances[index] <= self.max_distance]
+        better = [index for index in near if self._ranks[index] <= rank]
+        if better:
+            nearest = min(better, key=lambda index: distances[index])
+            return self._hashes[nearest]
+        for index in reversed(near):
+            self._superseded.add(self._keys[index])
+            del self._hashes[index], self._ranks[index], self._keys[index]
+        self._hashes.append(value)
+        self._ranks.append(rank)
+        self._keys.append(key)
+        return None
+
+    def superseded(self, key):
+        return key in self._superseded
+
+    def __len__(self):
+        return len(self._hashes)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+Module: process_pool
+Pool of worker processes for CPU-bound work (decoding, resizing and encoding
+images), which would otherwise block the gevent event loop and with it all
+downloads in progress.
+
+Each worker is a separate process connected to the parent through a pipe.
+Waiting for results only blocks the calling greenlet: the parent waits for
+the pipe to become readable through the gevent hub, so downloads continue
+while images are being processed.
+"""
+
+import os
+import atexit
+import signal
+import logging
+import multiprocessing
+
+import gevent
+from gevent.queue import Queue
+from gevent.event import AsyncResult
+from gevent.socket import wait_read
+
+log = logging.getLogger(__name__)
+
+# default maximum number of tasks waiting for a free worker - once reached,
+# submitting further tasks blocks until one is taken up
+PROCESS_QUEUE_DEPTH = 16
+
+class WorkerError(Exception):
+    pass
+
+def _worker_main(conn):
+    # run tasks received from the parent until the pipe is closed (interrupts
+    # are left to the parent, which stops the workers)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args, kwargs = task
+        try:
+            result = (True, func(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # (e.g. a result or exception which cannot be pickled)
+            conn.send((False, WorkerError('Could not return result: %s' % str(e))))
+
+class _Task(object):
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = AsyncResult()
+        self.cancelled = False
+
+class ProcessPool(object):
+    """Runs functions in a pool of `worker_count` worker processes
+
+    `apply(func, *args, **kwargs)` runs `func` in the next free worker and
+    returns its result (or raises its exception), blocking only the calling
+    greenlet. `func`, its arguments and its result must be picklable, so
+    `func` should be defined at the top level of a module.
+
+    At most `queue_depth` tasks wait for a free worker: further calls to
+    `apply` block until one is taken up, so that callers producing work faster
+    than it can be processed are slowed down instead of queueing without
+    bound. Tasks whose caller is killed while they are waiting are dropped.
+
+    Workers are started on the first call to `apply` (using the 'spawn'
+    method, as forking the running event loop is unsafe) and restarted if
+    they die, in which case the task being run fails with WorkerError.
+    """
+    def __init__(self, worker_count=-1, queue_depth=PROCESS_QUEUE_DEPTH):
+        # if number of workers is not specified, set it to the number of CPUs
+        if worker_count == -1:
+            worker_count = multiprocessing.cpu_count()
+        if worker_count < 1 or queue_depth < 1:
+            raise ValueError('Worker count and queue depth must be at least 1')
+        self.worker_count = worker_count
+        self.queue_depth = queue_depth
+        self._context = multiprocessing.get_context('spawn')
+        self._tasks = Queue(maxsize=queue_depth)
+        self._workers = []  # (process, connection) for each worker
+        self._servers = []  # greenlet feeding each worker
+        self._busy = 0
+        self.closed = False
+
+    def apply(self, func, *args, **kwargs):
+        if self.closed:
+            raise WorkerError('Process pool is closed')
+        if not self._servers:
+            self._start()
+        task = _Task(func, args, kwargs)
+        try:
+            self._tasks.put(task)
+            return task.result.get()
+        except gevent.GreenletExit:
+            task.cancelled = True
+            raise
+
+    @property
+    def busy_count(self):
+        return self._busy
+
+    @property
+    def pending_count(self):
+        return self._tasks.qsize()
+
+    def close(self):
+        """Stop all workers (after the tasks they are running)"""
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self._servers:
+            self._tasks.put(None)
+        gevent.joinall(self._servers)
+        for process, conn in self._workers:
+            if process is not None:
+                process.join(1.0)
+                if process.is_alive():
+                    process.terminate()
+            conn.close()
+        self._workers = []
+        self._servers = []
+
+    def _start(self):
+        log.info('Starting %d image processing workers', self.worker_count)
+        for index in range(self.worker_count):
+            self._workers.append(self._start_worker())
+            self._servers.append(gevent.spawn(self._serve, index))
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        # (the sockets are non-blocking if socket is monkey-patched, which the
+        # blocking reads and writes of the connections do not expect)
+        os.set_blocking(parent_conn.fileno(), True)
+        os.set_blocking(child_conn.fileno(), True)
+        process = self._context.Process(target=_worker_main, args=(child_conn,))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _restart_worker(self, index):
+        process, conn = self._workers[index]
+        conn.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self._workers[index] = self._start_worker()
+
+    def _serve(self, index):
+        # feed tasks from the queue to worker `index`, one at a time
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                _, conn = self._workers[index]
+                try:
+                    conn.send(None)
+                except (OSError, EOFError):
+                    pass
+                return
+            if task.cancelled:
+                continue
+
+            self._busy = self._busy + 1
+            try:
+                self._run_task(index, task)
+            finally:
+                self._busy = self._busy - 1
+
+    def _run_task(self, index, task):
+        _, conn = self._workers[index]
+        try:
+            conn.send((task.func, task.args, task.kwargs))
+        except (OSError, EOFError) as e:
+            task.result.set_exception(WorkerError('Worker failed: %s' % str(e)))
+            self._restart_worker(index)
+            return
+        except Exception as e:
+            # the task could not be pickled (and nothing was sent)
+            task.result.set_exception(e)
+            return
+
+        try:
+            wait_read(conn.fileno())
+            success, value = conn.recv()
+        except (OSError, EOFError) as e:
+            log.warning('Image processing worker died, restarting it')
+            task.result.set_exception(WorkerError('Worker died: %s' % str(e)))
+            self._restart_worker(index)
+            return
+        if success:
+            task.result.set(value)
+        else:
+            task.result.set_exception(value)
+
+## Process-wide Pools
+#  --------------------------------------------
+
+_process_pools = {}
+
+def get_process_pool(worker_count=-1, queue_depth=PROCESS_QUEUE_DEPTH):
+    """Return the pool with the given settings shared by the whole process
+
+    The workers of shared pools are stopped when the process exits.
+    """
+    key = (worker_count, queue_depth)
+    process_pool = _process_pools.get(key)
+    if process_pool is None:
+        process_pool = ProcessPool(worker_count, queue_depth)
+        _process_pools[key] = process_pool
+    return process_pool
+
+def close_process_pools():
+    for process_pool in _process_pools.values():
+        process_pool.close()
+    _process_pools.clear()
+
+atexit.register(close_process_pools)
@@ -1 +1,13 @@
-from . import result_page_gen
+import importlib
+
+_LAZY_SUBMODULES = ('result_page_gen', 'deadline', 'urls')
+
+def __getattr__(name):
+    if name not in _LAZY_SUBMODULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module = importlib.import_module('.' + name, __name__)
+    globals()[name] = module
+    return module
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_SUBMODULES))
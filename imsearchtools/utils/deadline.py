@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Module: deadline
+Utilities for propagating an end-to-end request deadline through the query,
+download and callback stages, each of which returns whatever it completed
+within its remaining time.
+"""
+
+import time
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline(object):
+    """Absolute time by which a request should complete
+
+    Initializer Args:
+        timeout: number of seconds from now until the deadline (if None or
+            negative, the deadline never expires)
+    """
+    def __init__(self, timeout=None):
+        if timeout is None or timeout < 0:
+            self.expiry = None
+        else:
+            self.expiry = time.time() + timeout
+
+    def remaining(self):
+        """Seconds until the deadline (never negative), or None if it never expires"""
+        if self.expiry is None:
+            return None
+        return max(0.0, self.expiry - time.time())
+
+    def expired(self):
+        return self.expiry is not None and time.time() >= self.expiry
+
+def time_left(deadline, timeout=None):
+    """The time a stage with its own `timeout` can take without missing `deadline`
+
+    Either argument can be None, in which case it does not impose a limit (and
+    None is returned if neither does).
+    """
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return timeout
+    if timeout is None or timeout < 0:
+        return remaining
+    return min(timeout, remaining)
+
+class ResultList(list):
+    """List of results with a `partial` flag
+
+    `partial` is True when the stage producing the results ran out of time
+    and some results may be missing.
+    """
+    def __init__(self, results=(), partial=False):
+        super(ResultList, self).__init__(results)
+        self.partial = partial
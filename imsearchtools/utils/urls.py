@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+"""
+Module: urls
+URL helpers shared by the query and download stages.
+"""
+
+from urllib.parse import urlsplit, urlunsplit
+
+def canonical_url(url):
+    """Return a normalized form of `url` used to detect duplicate results
+
+    The scheme, fragment and default ports are dropped and the host name is
+    lower-cased, so e.g. 'http://Example.com:80/a.jpg#x' and
+    'https://example.com/a.jpg' map to the same canonical URL.
+    """
+    parts = urlsplit(url.strip())
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') or netloc.endswith(':443'):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path or '/'
+    return urlunsplit(('', netloc, path, parts.query, ''))
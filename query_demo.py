@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import imsearchtools
+imsearchtools.monkey_patch()
 from imsearchtools import query as image_query
 from imsearchtools.utils import result_page_gen
 import time